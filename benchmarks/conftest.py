@@ -0,0 +1,136 @@
+"""Fixtures for the micro-benchmarks."""
+
+# pylint: disable=W0621
+
+from __future__ import annotations
+
+import random
+import uuid
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import TYPE_CHECKING
+
+import pytest
+from sqlalchemy import Table, insert
+from sqlalchemy.orm import Session, sessionmaker
+
+from eguivalet_server import crud, models
+from eguivalet_server.config import Settings
+from eguivalet_server.database import create_database_engine
+
+if TYPE_CHECKING:
+    from collections.abc import Generator
+
+    from sqlalchemy.engine import Engine
+
+INSERT_CHUNK_SIZE = 10_000
+
+
+def pytest_addoption(parser: pytest.Parser) -> None:
+    """Let the database sizes be chosen on the command line."""
+    parser.addoption(
+        "--row-counts",
+        default="10000,100000,1000000",
+        help="comma-separated numbers of messages in the benchmark databases",
+    )
+
+
+def pytest_generate_tests(metafunc: pytest.Metafunc) -> None:
+    """Run every database benchmark once per database size."""
+    if "dataset" in metafunc.fixturenames:
+        row_counts = [int(count) for count in metafunc.config.getoption("--row-counts").split(",")]
+        metafunc.parametrize("dataset", row_counts, indirect=True, scope="session", ids=lambda count: f"{count}rows")
+
+
+@dataclass
+class Dataset:
+    """A seeded benchmark database and samples of what it contains."""
+
+    engine: Engine
+    users: list[uuid.UUID]
+    rooms: list[uuid.UUID]
+    messages: dict[uuid.UUID, list[uuid.UUID]]
+
+    @property
+    def room_id(self) -> uuid.UUID:
+        """The room all the message benchmarks use."""
+        return self.rooms[0]
+
+
+def insert_chunked(db: Session, model: type[models.Base] | Table, rows: list[dict[str, object]]) -> None:
+    """Bulk insert rows a chunk at a time to keep memory use in check."""
+    for offset in range(0, len(rows), INSERT_CHUNK_SIZE):
+        db.execute(insert(model), rows[offset:offset + INSERT_CHUNK_SIZE])
+
+
+@pytest.fixture(scope="session")
+def dataset(request: pytest.FixtureRequest, tmp_path_factory: pytest.TempPathFactory) -> Generator[Dataset, None, None]:
+    """
+    Create an SQLite database holding the requested number of messages.
+
+    There is a user for every ten messages and a room for every thousand,
+    so the other tables grow along with the messages. Every user is a member
+    of three rooms.
+
+    Yields:
+        The seeded dataset.
+
+    """
+    row_count: int = request.param
+    path = tmp_path_factory.mktemp("benchmark") / f"{row_count}.db"
+    engine = create_database_engine(Settings(database_url=f"sqlite:///{path}"))
+    models.Base.metadata.create_all(bind=engine)
+
+    rng = random.Random(row_count)
+    users = [uuid.uuid4() for _ in range(max(row_count // 10, 10))]
+    rooms = [uuid.uuid4() for _ in range(max(row_count // 1000, 10))]
+    messages: dict[uuid.UUID, list[uuid.UUID]] = {room_id: [] for room_id in rooms}
+    start = datetime(2022, 9, 11, 12)  # ruff:ignore[call-datetime-without-tzinfo]
+
+    message_rows: list[dict[str, object]] = []
+    for index in range(row_count):
+        room_id = rooms[index % len(rooms)]
+        message_id = uuid.uuid4()
+        messages[room_id].append(message_id)
+        message_rows.append({
+            "id": message_id,
+            "user_id": rng.choice(users),
+            "room_id": room_id,
+            "message": f"Message number {index}",
+            "creation_time": start + timedelta(seconds=index),
+        })
+
+    with Session(engine) as db:
+        insert_chunked(db, models.User, [
+            {"id": user_id, "username": f"User {index}", "email": f"user{index}@jmail.com", "password_hash": "x"}
+            for index, user_id in enumerate(users)
+        ])
+        insert_chunked(db, models.Room, [
+            {"id": room_id, "name": f"Room {index}", "public": index % 2 == 0}
+            for index, room_id in enumerate(rooms)
+        ])
+        insert_chunked(db, models.Message, message_rows)
+        insert_chunked(db, models.users_in_rooms_table, [
+            {"user_id": user_id, "room_id": room_id}
+            for user_id in users
+            for room_id in rng.sample(rooms, 3)
+        ])
+        db.commit()
+
+    yield Dataset(engine=engine, users=users, rooms=rooms, messages=messages)
+    engine.dispose()
+
+
+@pytest.fixture
+def db(dataset: Dataset) -> Generator[Session, None, None]:
+    """
+    Open a session on the benchmark database.
+
+    Yields:
+        A database session.
+
+    """
+    session = sessionmaker(bind=dataset.engine)()
+    yield session
+    session.close()
+    crud.clear_caches()
@@ -0,0 +1,480 @@
+"""
+Measures the throughput and latency of the HTTP API under a mixed load.
+
+The database is seeded with users, rooms and messages through `crud`, after
+which each scenario sends a weighted mix of requests from concurrent clients,
+either to the app in-process over ASGI or to a local Uvicorn server. Request
+rates and latency percentiles are reported per route and saved as JSON, so
+runs on different commits can be compared:
+
+    python -m benchmarks.load_test --requests 5000
+    python -m benchmarks.load_test --compare old.json new.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import secrets
+import socket
+import statistics
+import subprocess  # ruff:ignore[suspicious-subprocess-import]
+import sys
+import tempfile
+import time
+from contextlib import suppress
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import TYPE_CHECKING
+from uuid import UUID, uuid4
+
+import httpx
+from pydantic import SecretStr
+
+if TYPE_CHECKING:
+    from collections.abc import Awaitable, Callable, Sequence
+
+    from sqlalchemy.orm import Session, sessionmaker
+
+logger = logging.getLogger(__name__)
+
+RESULTS_DIR = Path(__file__).parent / "results"
+ROOMS_API = "/api/v1/rooms"
+USERS_API = "/api/v1/users"
+SEED = 1037
+
+ROOMS_ROUTE = "GET /rooms/"
+MESSAGES_ROUTE = "GET /rooms/{room_id}/messages"
+MESSAGE_ROUTE = "GET /rooms/{room_id}/messages/{message_id}"
+USER_ROUTE = "GET /users/{user_id}"
+POST_MESSAGE_ROUTE = "POST /rooms/{room_id}"
+LOGIN_ROUTE = "POST /users/login"
+SEED_PASSWORD = "hunter22"  # ruff:ignore[hardcoded-password-string]
+
+
+@dataclass
+class SeedData:
+    """The identifiers of everything the database was seeded with."""
+
+    users: list[UUID]
+    rooms: list[UUID]
+    messages: dict[UUID, list[UUID]]
+    tokens: dict[UUID, str] = field(default_factory=dict)
+
+    def headers(self, user_id: UUID) -> dict[str, str]:
+        """
+        Authenticate a request as one of the users.
+
+        Returns:
+            The request headers.
+
+        """
+        return {"Authorization": f"Bearer {self.tokens[user_id]}"}
+
+
+@dataclass
+class RouteStats:
+    """Latencies of the requests made to one route."""
+
+    latencies: list[float] = field(default_factory=list)
+    errors: int = 0
+
+    def summary(self, elapsed: float) -> dict[str, float]:
+        """
+        Summarise the requests made to the route.
+
+        Returns:
+            The request count, error count, request rate and latency
+            percentiles in milliseconds.
+
+        """
+        latencies = sorted(self.latencies)
+        if len(latencies) > 1:
+            cut_points = statistics.quantiles(latencies, n=100, method="inclusive")
+            p50, p95, p99 = cut_points[49], cut_points[94], cut_points[98]
+        else:
+            p50 = p95 = p99 = latencies[0] if latencies else 0.0
+        return {
+            "requests": len(latencies),
+            "errors": self.errors,
+            "rps": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+            "p50_ms": round(p50 * 1000, 3),
+            "p95_ms": round(p95 * 1000, 3),
+            "p99_ms": round(p99 * 1000, 3),
+        }
+
+
+async def list_public_rooms(
+    client: httpx.AsyncClient, seed: SeedData, rng: random.Random,
+) -> tuple[str, httpx.Response]:
+    """
+    List the public rooms.
+
+    Returns:
+        The route template and the response.
+
+    """
+    return ROOMS_ROUTE, await client.get(f"{ROOMS_API}/", headers=seed.headers(rng.choice(seed.users)))
+
+
+async def read_latest_messages(
+    client: httpx.AsyncClient, seed: SeedData, rng: random.Random,
+) -> tuple[str, httpx.Response]:
+    """
+    Read the newest messages of a random room.
+
+    Returns:
+        The route template and the response.
+
+    """
+    room_id = rng.choice(seed.rooms)
+    headers = seed.headers(rng.choice(seed.users))
+    return MESSAGES_ROUTE, await client.get(f"{ROOMS_API}/{room_id}/messages", headers=headers)
+
+
+async def read_message(client: httpx.AsyncClient, seed: SeedData, rng: random.Random) -> tuple[str, httpx.Response]:
+    """
+    Read a random message.
+
+    Returns:
+        The route template and the response.
+
+    """
+    room_id = rng.choice(seed.rooms)
+    message_id = rng.choice(seed.messages[room_id])
+    return (
+        MESSAGE_ROUTE,
+        await client.get(f"{ROOMS_API}/{room_id}/messages/{message_id}", headers=seed.headers(rng.choice(seed.users))),
+    )
+
+
+async def read_user(client: httpx.AsyncClient, seed: SeedData, rng: random.Random) -> tuple[str, httpx.Response]:
+    """
+    Read a random user.
+
+    Returns:
+        The route template and the response.
+
+    """
+    user_id = rng.choice(seed.users)
+    return USER_ROUTE, await client.get(f"{USERS_API}/{user_id}", headers=seed.headers(user_id))
+
+
+async def post_message(client: httpx.AsyncClient, seed: SeedData, rng: random.Random) -> tuple[str, httpx.Response]:
+    """
+    Post a new message to a random room.
+
+    Returns:
+        The route template and the response.
+
+    """
+    room_id = rng.choice(seed.rooms)
+    user_id = rng.choice(seed.users)
+    message = {"id": str(uuid4()), "user_id": str(user_id), "message": f"Load test {rng.random()}"}
+    return POST_MESSAGE_ROUTE, await client.post(f"{ROOMS_API}/{room_id}", json=message, headers=seed.headers(user_id))
+
+
+async def login(client: httpx.AsyncClient, seed: SeedData, rng: random.Random) -> tuple[str, httpx.Response]:
+    """
+    Log in as a random user.
+
+    Returns:
+        The route template and the response.
+
+    """
+    credentials = {"email": f"user{rng.randrange(len(seed.users))}@example.com", "password": SEED_PASSWORD}
+    return LOGIN_ROUTE, await client.post(f"{USERS_API}/login", json=credentials)
+
+
+SCENARIOS: dict[str, dict[Callable[..., Awaitable[tuple[str, httpx.Response]]], int]] = {
+    "read-heavy": {read_latest_messages: 70, list_public_rooms: 10, read_message: 10, read_user: 5, post_message: 5},
+    "mixed": {read_latest_messages: 50, list_public_rooms: 10, read_user: 10, post_message: 30},
+    "write-heavy": {read_latest_messages: 20, post_message: 80},
+    # Shows whether slow password hashing holds up the requests around it
+    "login-storm": {login: 40, read_latest_messages: 40, post_message: 20},
+}
+
+
+def seed_database(
+    session_factory: sessionmaker[Session], users: int, rooms: int, messages_per_room: int, rng: random.Random,
+) -> SeedData:
+    """
+    Fill an empty database with test data through `crud`.
+
+    Returns:
+        The identifiers of the created users, rooms and messages.
+
+    """
+    # Imported late, so the database URL can be set first
+    from eguivalet_server import crud, schemas  # ruff:ignore[import-outside-top-level]
+    from eguivalet_server.auth import issue_token  # ruff:ignore[import-outside-top-level]
+    from eguivalet_server.security import hash_password  # ruff:ignore[import-outside-top-level]
+
+    # Every user gets the same password, so it only needs hashing once
+    password_hash = hash_password(SEED_PASSWORD)
+    db = session_factory()
+    try:
+        user_ids = [
+            crud.create_user(
+                db,
+                schemas.UserCreate(
+                    username=f"User {index}", email=f"user{index}@example.com", password=SecretStr(SEED_PASSWORD),
+                ),
+                password_hash,
+            ).id
+            for index in range(users)
+        ]
+        room_ids = [crud.create_room(db, schemas.Room(name=f"Room {index}")).id for index in range(rooms)]
+
+        # Messages are timestamped in local time, like the ones posted through the API
+        start = datetime.now() - timedelta(seconds=messages_per_room)  # ruff:ignore[call-datetime-now-without-tzinfo]
+        messages: dict[UUID, list[UUID]] = {}
+        for room_id in room_ids:
+            batch = [
+                (
+                    room_id,
+                    schemas.Message(
+                        user_id=rng.choice(user_ids),
+                        message=f"Seed message {index}",
+                        creation_time=start + timedelta(seconds=index),
+                    ),
+                )
+                for index in range(messages_per_room)
+            ]
+            for offset in range(0, len(batch), 500):
+                crud.create_messages(db, batch[offset:offset + 500])
+            messages[room_id] = [message.id for _, message in batch]
+    finally:
+        db.close()
+
+    # Issued directly rather than by logging in, which is slow on purpose
+    tokens = {user_id: issue_token(user_id)[0] for user_id in user_ids}
+    return SeedData(users=user_ids, rooms=room_ids, messages=messages, tokens=tokens)
+
+
+async def run_scenario(
+    client: httpx.AsyncClient, seed: SeedData, scenario: str, requests: int, concurrency: int, rng: random.Random,
+) -> dict[str, dict[str, float]]:
+    """
+    Send `requests` requests of the scenario's mix from concurrent clients.
+
+    Returns:
+        A summary per route, plus a total under the key "ALL".
+
+    """
+    weights = SCENARIOS[scenario]
+    plan = rng.choices(list(weights), weights=list(weights.values()), k=requests)
+    stats: dict[str, RouteStats] = {}
+    total = RouteStats()
+    queue = iter(plan)
+
+    async def worker() -> None:
+        for operation in queue:
+            started = time.perf_counter()
+            route, response = await operation(client, seed, rng)
+            latency = time.perf_counter() - started
+            for route_stats in (stats.setdefault(route, RouteStats()), total):
+                route_stats.latencies.append(latency)
+                if response.status_code >= httpx.codes.BAD_REQUEST:
+                    route_stats.errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    summary = {route: route_stats.summary(elapsed) for route, route_stats in sorted(stats.items())}
+    summary["ALL"] = total.summary(elapsed)
+    return summary
+
+
+def free_port() -> int:
+    """
+    Find a port nothing is listening on.
+
+    Returns:
+        The port number.
+
+    """
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def wait_until_up(client: httpx.AsyncClient, timeout: float = 30.0) -> None:
+    """
+    Wait for a freshly started server to answer.
+
+    Raises:
+        TimeoutError: If the server did not answer in time.
+
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        with suppress(httpx.TransportError):
+            await client.get("/")
+            return
+        await asyncio.sleep(0.2)
+    msg = "The server did not start in time"
+    raise TimeoutError(msg)
+
+
+async def run_target(target: str, seed: SeedData, args: argparse.Namespace) -> dict[str, dict[str, dict[str, float]]]:
+    """
+    Run every requested scenario against one target.
+
+    Returns:
+        The route summaries of each scenario.
+
+    """
+    rng = random.Random(SEED)
+    results = {}
+    if target == "asgi":
+        from eguivalet_server.main import app  # ruff:ignore[import-outside-top-level]
+
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+            for scenario in args.scenarios:
+                results[scenario] = await run_scenario(client, seed, scenario, args.requests, args.concurrency, rng)
+        return results
+
+    port = free_port()
+    command = [sys.executable, "-m", "eguivalet_server", "--port", str(port), "--workers", str(args.workers)]
+    server = await asyncio.create_subprocess_exec(
+        *command, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL,
+    )
+    try:
+        limits = httpx.Limits(max_connections=args.concurrency)
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", limits=limits) as client:
+            await wait_until_up(client)
+            for scenario in args.scenarios:
+                results[scenario] = await run_scenario(client, seed, scenario, args.requests, args.concurrency, rng)
+    finally:
+        server.terminate()
+        await server.wait()
+    return results
+
+
+def git_commit() -> str | None:
+    """
+    Find out which commit is being benchmarked.
+
+    Returns:
+        The commit hash, or None outside a Git checkout.
+
+    """
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],  # ruff:ignore[start-process-with-partial-path]
+            capture_output=True, check=True, text=True, cwd=Path(__file__).parent,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results: dict[str, dict[str, dict[str, dict[str, float]]]]) -> None:
+    """Print a table of route summaries for each target and scenario."""
+    for target, scenarios in results.items():
+        for scenario, routes in scenarios.items():
+            print(f"\n{target} / {scenario}")
+            print(f"{'route':<45}{'requests':>10}{'errors':>8}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+            for route, row in routes.items():
+                print(
+                    f"{route:<45}{row['requests']:>10}{row['errors']:>8}{row['rps']:>10}"
+                    f"{row['p50_ms']:>10}{row['p95_ms']:>10}{row['p99_ms']:>10}",
+                )
+
+
+def compare_results(old_path: Path, new_path: Path) -> None:
+    """Print how the request rate and p95 latency of each route changed between two saved runs."""
+    old = json.loads(old_path.read_text(encoding="utf-8"))["results"]
+    new = json.loads(new_path.read_text(encoding="utf-8"))["results"]
+    for target, scenarios in new.items():
+        for scenario, routes in scenarios.items():
+            print(f"\n{target} / {scenario}")
+            for route, row in routes.items():
+                before = old.get(target, {}).get(scenario, {}).get(route)
+                if before is None:
+                    continue
+                rps_change = (row["rps"] / before["rps"] - 1) * 100 if before["rps"] else 0.0
+                p95_change = (row["p95_ms"] / before["p95_ms"] - 1) * 100 if before["p95_ms"] else 0.0
+                print(f"{route:<45} req/s {rps_change:+7.1f}%   p95 {p95_change:+7.1f}%")
+
+
+def parse_args(argv: Sequence[str] | None = None) -> argparse.Namespace:
+    """
+    Read the command line options.
+
+    Returns:
+        The parsed options.
+
+    """
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.load_test", description=__doc__.splitlines()[1])
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--rooms", type=int, default=20)
+    parser.add_argument("--messages-per-room", type=int, default=1000)
+    parser.add_argument("--requests", type=int, default=2000, help="requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=32, help="simultaneous clients")
+    parser.add_argument("--scenarios", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument("--targets", nargs="+", choices=["asgi", "uvicorn"], default=["asgi", "uvicorn"])
+    parser.add_argument("--workers", type=int, default=1, help="Uvicorn worker processes")
+    parser.add_argument("--output", type=Path, help="where to save the results (default: benchmarks/results/)")
+    parser.add_argument("--compare", nargs=2, type=Path, metavar=("OLD", "NEW"), help="compare two saved runs")
+    return parser.parse_args(argv)
+
+
+def main(argv: Sequence[str] | None = None) -> None:
+    """Seed a throwaway database, run the scenarios and save the results."""
+    args = parse_args(argv)
+    if args.compare:
+        compare_results(*args.compare)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # Both the in-process app and the server subprocess use this database
+        os.environ["EGUIVALET_DATABASE_URL"] = f"sqlite:///{Path(tmp_dir) / 'benchmark.db'}"
+        # ...and accept the tokens issued here
+        os.environ["EGUIVALET_TOKEN_SECRET"] = secrets.token_urlsafe(32)
+        from eguivalet_server import models  # ruff:ignore[import-outside-top-level]
+        from eguivalet_server.database import SessionLocal, engine  # ruff:ignore[import-outside-top-level]
+
+        # Per-request logging would drown out the results
+        logging.getLogger("eguivalet_server").setLevel(logging.WARNING)
+        logging.getLogger("uvicorn.access").setLevel(logging.WARNING)
+
+        models.Base.metadata.create_all(bind=engine)
+        started = time.perf_counter()
+        rng = random.Random(SEED)
+        seed = seed_database(SessionLocal, args.users, args.rooms, args.messages_per_room, rng)
+        print(f"Seeded the database in {time.perf_counter() - started:.1f} s")
+
+        results = {target: asyncio.run(run_target(target, seed, args)) for target in args.targets}
+        engine.dispose()
+
+    print_results(results)
+
+    commit = git_commit()
+    timestamp = datetime.now(tz=timezone.utc)
+    report = {
+        "commit": commit,
+        "timestamp": timestamp.isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "parameters": {
+            key: value for key, value in vars(args).items() if key not in {"output", "compare"}
+        },
+        "results": results,
+    }
+    output = args.output or RESULTS_DIR / f"{timestamp:%Y%m%dT%H%M%S}-{(commit or 'unknown')[:10]}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2), encoding="utf-8")
+    print(f"\nResults saved to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,251 @@
+"""
+Micro-benchmarks for the `crud` functions.
+
+Every benchmark runs against databases of each size given with
+`--row-counts`, so both the cost of a call and how it scales with the amount
+of data show up. Run them with
+
+    pytest benchmarks --benchmark-only --no-cov
+"""
+
+# pylint: disable=W0621
+
+from __future__ import annotations
+
+import itertools
+from typing import TYPE_CHECKING
+
+import pytest
+from pydantic import SecretStr
+
+from eguivalet_server import crud, schemas
+from eguivalet_server.security import hash_password
+from eguivalet_server.utility import MessageCursor
+
+if TYPE_CHECKING:
+    import uuid
+
+    from sqlalchemy.orm import Session
+
+    from benchmarks.conftest import Dataset
+
+PAGE_SIZES = [50, 500]
+
+unique = itertools.count()
+
+# Hashed once; creating a user is benchmarked without the deliberately slow hashing
+PASSWORD_HASH = hash_password("Tr0ub4dor&3")
+
+
+def new_message(dataset: Dataset) -> schemas.Message:
+    """
+    Create a message from one of the seeded users.
+
+    Returns:
+        The message schema.
+
+    """
+    return schemas.Message(user_id=dataset.users[0], message=f"Benchmark message {next(unique)}")
+
+
+def new_user() -> schemas.UserCreate:
+    """
+    Create a user that does not exist yet.
+
+    Returns:
+        The user schema.
+
+    """
+    number = next(unique)
+    return schemas.UserCreate(
+        username=f"Benchmark user {number}",
+        email=f"benchmark.user{number}@jmail.com",
+        password=SecretStr("Tr0ub4dor&3"),
+    )
+
+
+def cursor_at(db: Session, dataset: Dataset, position: float) -> MessageCursor:
+    """
+    Find the paging cursor of a message part way through the room's history.
+
+    Returns:
+        The cursor of the message.
+
+    """
+    message_ids = dataset.messages[dataset.room_id]
+    message = crud.read_message(db, dataset.room_id, message_ids[int(len(message_ids) * position)])
+    assert message is not None
+    return MessageCursor(message.creation_time, message.id)
+
+
+# Rooms
+
+
+def test_read_public_rooms(benchmark, db, dataset):
+    """Benchmarks listing the public rooms from the database."""
+    benchmark(crud.read_public_rooms, db)
+
+
+def test_read_public_rooms_cached(benchmark, db, dataset):
+    """Benchmarks listing the public rooms when the listing is cached."""
+    crud.read_public_rooms_cached(db)
+    benchmark(crud.read_public_rooms_cached, db)
+
+
+def test_read_room(benchmark, db, dataset):
+    """Benchmarks fetching a room by its ID."""
+    benchmark(crud.read_room, db, dataset.room_id)
+
+
+def test_create_room(benchmark, db, dataset):
+    """Benchmarks creating a room."""
+    benchmark(lambda: crud.create_room(db, schemas.Room(name=f"Benchmark room {next(unique)}")))
+
+
+def test_delete_room(benchmark, db, dataset):
+    """Benchmarks deleting a room."""
+    def setup() -> tuple[tuple[Session, uuid.UUID], dict[str, object]]:
+        room = crud.create_room(db, schemas.Room(name=f"Benchmark room {next(unique)}"))
+        return (db, room.id), {}
+
+    benchmark.pedantic(crud.delete_room, setup=setup, rounds=100)
+
+
+# Memberships
+
+
+def test_read_user_rooms(benchmark, db, dataset):
+    """Benchmarks listing the rooms of a user."""
+    benchmark(crud.read_user_rooms, db, dataset.users[len(dataset.users) // 2], limit=100)
+
+
+def test_read_room_members(benchmark, db, dataset):
+    """Benchmarks fetching a page of a room's members."""
+    benchmark(crud.read_room_members, db, dataset.room_id, limit=100)
+
+
+def test_can_post(benchmark, db, dataset):
+    """Benchmarks the permission check made for every posted message, with a warm cache."""
+    benchmark(crud.can_post, db, dataset.rooms[1], dataset.users[0])
+
+
+def test_can_post_uncached(benchmark, db, dataset):
+    """Benchmarks the permission check when nothing about the room or the user is cached."""
+    def setup() -> tuple[tuple[Session, uuid.UUID, uuid.UUID], dict[str, object]]:
+        crud.clear_caches()
+        return (db, dataset.rooms[1], dataset.users[0]), {}
+
+    benchmark.pedantic(crud.can_post, setup=setup, rounds=100)
+
+
+# Users
+
+
+def test_read_user(benchmark, db, dataset):
+    """Benchmarks fetching a user by their ID."""
+    benchmark(crud.read_user, db, dataset.users[len(dataset.users) // 2])
+
+
+def test_read_user_by_email(benchmark, db, dataset):
+    """Benchmarks fetching a user by their email address."""
+    benchmark(crud.read_user_by_email, db, f"user{len(dataset.users) // 2}@jmail.com")
+
+
+def test_read_users(benchmark, db, dataset):
+    """Benchmarks fetching a page of users from the middle of the table."""
+    benchmark(crud.read_users, db, skip=len(dataset.users) // 2, limit=50)
+
+
+def test_create_user(benchmark, db, dataset):
+    """Benchmarks creating a user."""
+    benchmark(lambda: crud.create_user(db, new_user(), PASSWORD_HASH))
+
+
+def test_update_user(benchmark, db, dataset):
+    """Benchmarks renaming a user."""
+    user = schemas.User(id=dataset.users[0], username="Renamed", email="user0@jmail.com")
+    benchmark(crud.update_user, db, user)
+
+
+def test_delete_user(benchmark, db, dataset):
+    """Benchmarks deleting a user."""
+    def setup() -> tuple[tuple[Session, uuid.UUID], dict[str, object]]:
+        return (db, crud.create_user(db, new_user(), PASSWORD_HASH).id), {}
+
+    benchmark.pedantic(crud.delete_user, setup=setup, rounds=100)
+
+
+# Messages
+
+
+def test_read_message(benchmark, db, dataset):
+    """Benchmarks fetching a message by its ID."""
+    message_ids = dataset.messages[dataset.room_id]
+    benchmark(crud.read_message, db, dataset.room_id, message_ids[len(message_ids) // 2])
+
+
+@pytest.mark.parametrize("limit", PAGE_SIZES)
+def test_read_messages_latest(benchmark, db, dataset, limit):
+    """Benchmarks fetching the newest page of a room's messages."""
+    benchmark(crud.read_messages, db, dataset.room_id, limit=limit)
+
+
+@pytest.mark.parametrize("limit", PAGE_SIZES)
+def test_read_messages_before(benchmark, db, dataset, limit):
+    """Benchmarks paging backwards from deep in a room's history."""
+    before = cursor_at(db, dataset, 0.1)
+    benchmark(crud.read_messages, db, dataset.room_id, before=before, limit=limit)
+
+
+@pytest.mark.parametrize("limit", PAGE_SIZES)
+def test_read_messages_after(benchmark, db, dataset, limit):
+    """Benchmarks paging forwards from the middle of a room's history."""
+    after = cursor_at(db, dataset, 0.5)
+    benchmark(crud.read_messages, db, dataset.room_id, after=after, limit=limit)
+
+
+def test_search_messages_common_word(benchmark, db, dataset):
+    """Benchmarks the first page of a search matching every message in a room, all of which are ranked."""
+    benchmark(crud.search_messages, db, dataset.room_id, "message", limit=20)
+
+
+def test_search_messages_rare_words(benchmark, db, dataset):
+    """Benchmarks a search matching a single message in a room."""
+    benchmark(crud.search_messages, db, dataset.room_id, "message 7", limit=20)
+
+
+def test_read_message_rows_cached(benchmark, db, dataset):
+    """Benchmarks fetching the newest page of a room's messages once they are cached."""
+    crud.read_message_rows(db, dataset.room_id, limit=50)
+    benchmark(crud.read_message_rows, db, dataset.room_id, limit=50)
+
+
+def test_read_message_rows_uncached(benchmark, db, dataset):
+    """Benchmarks fetching the newest page of a room's messages as rows from the database."""
+    benchmark(crud.query_message_rows, db, dataset.room_id, limit=50)
+
+
+def test_create_message(benchmark, db, dataset):
+    """Benchmarks posting a single message."""
+    benchmark(lambda: crud.create_message(db, new_message(dataset), dataset.room_id))
+
+
+def test_create_messages(benchmark, db, dataset):
+    """Benchmarks posting a batch of a hundred messages."""
+    benchmark(lambda: crud.create_messages(db, [(dataset.room_id, new_message(dataset)) for _ in range(100)]))
+
+
+def test_update_message(benchmark, db, dataset):
+    """Benchmarks editing a message."""
+    message_ids = dataset.messages[dataset.room_id]
+    message = schemas.Message(id=message_ids[0], user_id=dataset.users[0], message="Edited")
+    benchmark(crud.update_message, db, message, dataset.room_id)
+
+
+def test_delete_message(benchmark, db, dataset):
+    """Benchmarks deleting a message."""
+    def setup() -> tuple[tuple[Session, uuid.UUID, uuid.UUID], dict[str, object]]:
+        message = crud.create_message(db, new_message(dataset), dataset.room_id)
+        return (db, dataset.room_id, message.id), {}
+
+    benchmark.pedantic(crud.delete_message, setup=setup, rounds=100)
@@ -0,0 +1,161 @@
+"""
+Micro-benchmarks for turning ORM objects into JSON responses.
+
+FastAPI validates what a route returns against its `response_model`, and then
+dumps the validated models to JSON. These benchmarks time both steps separately
+and together, for lists of ORM objects of various sizes, and compare them with
+encoding plain rows of the same columns, as the routes using `RowsResponse` do.
+Compared with the `crud` benchmarks, they show how much of a request is spent
+outside the database.
+"""
+
+# pylint: disable=W0621
+
+from __future__ import annotations
+
+import uuid
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+import pytest
+from pydantic import BaseModel, TypeAdapter
+
+from eguivalet_server import models, schemas
+from eguivalet_server.config import AccessLevel
+from eguivalet_server.serialization import encode_rows
+
+OBJECT_COUNTS = [1_000, 10_000, 100_000]
+
+
+def make_messages(count: int) -> list[models.Message]:
+    """
+    Create unsaved message models.
+
+    Returns:
+        The message models.
+
+    """
+    room_id = uuid.uuid4()
+    user_id = uuid.uuid4()
+    start = datetime(2022, 9, 11, 12)  # ruff:ignore[call-datetime-without-tzinfo]
+    return [
+        models.Message(
+            id=uuid.uuid4(),
+            user_id=user_id,
+            room_id=room_id,
+            message=f"Message number {index}",
+            creation_time=start + timedelta(seconds=index),
+        )
+        for index in range(count)
+    ]
+
+
+def make_rooms(count: int) -> list[models.Room]:
+    """
+    Create unsaved room models.
+
+    Returns:
+        The room models.
+
+    """
+    return [models.Room(id=uuid.uuid4(), name=f"Room {index}", public=True, owner=None) for index in range(count)]
+
+
+def make_users(count: int) -> list[models.User]:
+    """
+    Create unsaved user models.
+
+    Returns:
+        The user models.
+
+    """
+    return [
+        models.User(
+            id=uuid.uuid4(),
+            username=f"User {index}",
+            email=f"user{index}@jmail.com",
+            password_hash="x" * 64,
+            global_access_level=AccessLevel.BASIC,
+        )
+        for index in range(count)
+    ]
+
+
+SCHEMAS = {
+    "Message": (schemas.Message, make_messages),
+    "Room": (schemas.Room, make_rooms),
+    "User": (schemas.User, make_users),
+}
+
+
+@pytest.fixture(params=list(SCHEMAS))
+def schema_name(request: pytest.FixtureRequest) -> str:
+    """
+    Choose the schema to benchmark.
+
+    Returns:
+        The name of the schema.
+
+    """
+    return request.param
+
+
+@pytest.fixture(params=OBJECT_COUNTS, ids=lambda count: f"{count}objects")
+def orm_objects(request: pytest.FixtureRequest, schema_name: str) -> list[models.Base]:
+    """
+    Create the ORM objects to serialise.
+
+    Returns:
+        A list of unsaved models.
+
+    """
+    _, factory = SCHEMAS[schema_name]
+    return factory(request.param)
+
+
+@pytest.fixture
+def adapter(schema_name: str) -> TypeAdapter[list[BaseModel]]:
+    """
+    Create a validator for lists of the schema, like FastAPI does for `response_model=list[...]`.
+
+    Returns:
+        The type adapter.
+
+    """
+    schema, _ = SCHEMAS[schema_name]
+    return TypeAdapter(list[schema])  # type: ignore[valid-type]
+
+
+def test_validate(benchmark, adapter, orm_objects):
+    """Benchmarks validating ORM objects into Pydantic models."""
+    benchmark(adapter.validate_python, orm_objects, from_attributes=True)
+
+
+def test_dump_json(benchmark, adapter, orm_objects):
+    """Benchmarks dumping validated models to JSON."""
+    validated = adapter.validate_python(orm_objects, from_attributes=True)
+    benchmark(adapter.dump_json, validated)
+
+
+def test_response(benchmark, adapter, orm_objects):
+    """Benchmarks both steps, which is what building a list response costs."""
+    benchmark(lambda: adapter.dump_json(adapter.validate_python(orm_objects, from_attributes=True)))
+
+
+@pytest.fixture
+def rows(schema_name: str, orm_objects: list[models.Base]) -> list[tuple]:
+    """
+    Turn the ORM objects into rows of the columns their schema shows, like a query selecting just those would return.
+
+    Returns:
+        The rows, as named tuples.
+
+    """
+    schema, _ = SCHEMAS[schema_name]
+    row = namedtuple("Row", list(schema.model_fields))  # ruff:ignore[collections-named-tuple]
+    return [row(*(getattr(orm_object, field) for field in row._fields)) for orm_object in orm_objects]
+
+
+def test_encode_rows(benchmark, rows):
+    """Benchmarks encoding rows straight to JSON, which is what a `RowsResponse` costs."""
+    benchmark(encode_rows, rows)
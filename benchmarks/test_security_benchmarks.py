@@ -0,0 +1,67 @@
+"""
+Micro-benchmarks for password hashing and access tokens.
+
+Hashing is slow on purpose, so these show what the configured cost means for
+a single login, and how many logins a second the password hashing threads
+get through when many arrive at once. Checking an access token happens on
+every request, so it is timed with and without the cache of verified tokens.
+"""
+
+from __future__ import annotations
+
+import uuid
+
+import anyio
+import pytest
+
+from eguivalet_server.auth import decode_token, issue_token, verify_token
+from eguivalet_server.config import PASSWORD_HASH_THREADS
+from eguivalet_server.security import hash_password, verify_password, verify_password_async
+
+PASSWORD = "Tr0ub4dor&3"  # ruff:ignore[hardcoded-password-string]
+CONCURRENT_LOGINS = 4 * PASSWORD_HASH_THREADS
+
+
+@pytest.fixture(scope="module")
+def password_hash() -> str:
+    """
+    Hash the password once at the configured cost.
+
+    Returns:
+        The password hash.
+
+    """
+    return hash_password(PASSWORD)
+
+
+def test_hash_password(benchmark):
+    """Benchmarks hashing a password at the configured cost."""
+    benchmark.pedantic(hash_password, args=(PASSWORD,), rounds=10)
+
+
+def test_verify_password(benchmark, password_hash):
+    """Benchmarks verifying a password at the configured cost."""
+    benchmark.pedantic(verify_password, args=(PASSWORD, password_hash), rounds=10)
+
+
+def test_concurrent_logins(benchmark, password_hash):
+    """Benchmarks a burst of logins sharing the password hashing threads."""
+
+    async def burst() -> None:
+        async with anyio.create_task_group() as tasks:
+            for _ in range(CONCURRENT_LOGINS):
+                tasks.start_soon(verify_password_async, PASSWORD, password_hash)
+
+    benchmark.pedantic(anyio.run, args=(burst,), rounds=3)
+
+
+def test_verify_token(benchmark):
+    """Benchmarks checking an access token that was checked before."""
+    token, _ = issue_token(uuid.uuid4())
+    benchmark(verify_token, token)
+
+
+def test_verify_token_uncached(benchmark):
+    """Benchmarks checking the signature and claims of an access token."""
+    token, _ = issue_token(uuid.uuid4())
+    benchmark(decode_token, token)
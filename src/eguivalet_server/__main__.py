@@ -1,21 +1,5 @@
 """Run if the package is executed like a command."""
 
-import logging
+from eguivalet_server.launcher import main
 
-import uvicorn
-
-from eguivalet_server.config import (
-    HOST,
-    LOG_CONFIG,
-    PORT,
-)
-
-uvicorn.run(
-    "eguivalet_server.main:app",
-    host=HOST,
-    port=PORT,
-    log_level=logging.INFO,
-    reload=True,
-    log_config=str(LOG_CONFIG),
-    use_colors=True,
-)
+main()
@@ -0,0 +1,296 @@
+"""Issues and checks signed access tokens, without touching the database on every request."""
+
+from __future__ import annotations
+
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import secrets
+import time
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Annotated
+from uuid import UUID
+
+import anyio
+from fastapi import Depends, HTTPException, status
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+
+from eguivalet_server import crud
+from eguivalet_server.cache import TTLCache
+from eguivalet_server.config import (
+    TOKEN_CACHE_SIZE,
+    TOKEN_LIFETIME,
+    TOKEN_REVOCATION_SYNC_INTERVAL,
+    TOKEN_SECRET,
+)
+from eguivalet_server.database import SessionLocal, run_in_db_pool
+
+if TYPE_CHECKING:
+    from collections.abc import Iterable
+
+    from sqlalchemy.orm import Session
+
+logger = logging.getLogger(__name__)
+
+TOKEN_ID_BYTES = 16
+
+
+class InvalidTokenError(ValueError):
+    """Raised when an access token is malformed, forged, expired or revoked."""
+
+
+@dataclass(frozen=True)
+class TokenClaims:
+    """What a valid access token says about its bearer."""
+
+    user_id: UUID
+    token_id: str
+    expires: int  # UNIX time
+
+
+def b64url_encode(data: bytes) -> str:
+    """
+    Encode bytes as unpadded URL-safe base64, as used in JSON Web Tokens.
+
+    Returns:
+        The encoded string.
+
+    """
+    return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+
+def b64url_decode(data: str) -> bytes:
+    """
+    Decode unpadded URL-safe base64.
+
+    Returns:
+        The decoded bytes.
+
+    """
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+def load_signing_key() -> bytes:
+    """
+    Read the token signing key from the settings.
+
+    Returns:
+        The configured key, or a random one if none was configured.
+
+    """
+    if TOKEN_SECRET is not None:
+        return TOKEN_SECRET.get_secret_value().encode()
+    logger.warning("No token secret configured; access tokens will not outlive this process")
+    return secrets.token_bytes(32)
+
+
+signing_key = load_signing_key()
+# Only tokens with exactly this header are accepted, so the algorithm cannot be swapped out
+TOKEN_HEADER = b64url_encode(json.dumps({"alg": "HS256", "typ": "JWT"}, separators=(",", ":")).encode())
+
+
+def sign(signing_input: str) -> bytes:
+    """
+    Sign the header and payload of a token.
+
+    Returns:
+        The HMAC-SHA256 signature.
+
+    """
+    return hmac.new(signing_key, signing_input.encode(), hashlib.sha256).digest()
+
+
+def issue_token(user_id: UUID, now: int | None = None) -> tuple[str, TokenClaims]:
+    """
+    Create an access token for a user, valid for `TOKEN_LIFETIME` seconds.
+
+    Returns:
+        The token, in the JSON Web Token format, and its claims.
+
+    """
+    issued = int(time.time()) if now is None else now
+    claims = TokenClaims(user_id, secrets.token_urlsafe(TOKEN_ID_BYTES), issued + TOKEN_LIFETIME)
+    payload = {"sub": str(user_id), "jti": claims.token_id, "iat": issued, "exp": claims.expires}
+    signing_input = f"{TOKEN_HEADER}.{b64url_encode(json.dumps(payload, separators=(',', ':')).encode())}"
+    return f"{signing_input}.{b64url_encode(sign(signing_input))}", claims
+
+
+def decode_token(token: str) -> TokenClaims:
+    """
+    Check the signature of a token and read its claims, without checking whether it is still valid.
+
+    Returns:
+        The claims.
+
+    Raises:
+        InvalidTokenError: If the token is malformed or was not signed with our key.
+
+    """
+    try:
+        signing_input, signature = token.rsplit(".", 1)
+        header, payload = signing_input.split(".")
+        genuine = header == TOKEN_HEADER and hmac.compare_digest(b64url_decode(signature), sign(signing_input))
+    except ValueError as err:
+        msg = "Malformed token"
+        raise InvalidTokenError(msg) from err
+    if not genuine:
+        msg = "Bad signature"
+        raise InvalidTokenError(msg)
+
+    try:
+        claims = json.loads(b64url_decode(payload))
+        return TokenClaims(UUID(claims["sub"]), str(claims["jti"]), int(claims["exp"]))
+    except (ValueError, KeyError, TypeError) as err:
+        msg = "Malformed claims"
+        raise InvalidTokenError(msg) from err
+
+
+class RevocationList:
+    """
+    The IDs of tokens logged out of before they expire, each with its expiry time.
+
+    Revocations are never undone, and are forgotten once the token has
+    expired anyway, so the list only holds the logouts of the last
+    `TOKEN_LIFETIME` seconds.
+    """
+
+    def __init__(self) -> None:
+        """Create an empty list."""
+        self._revoked: dict[str, int] = {}
+
+    def __contains__(self, token_id: object) -> bool:
+        """
+        Check whether a token has been revoked.
+
+        Returns:
+            True if it has.
+
+        """
+        return token_id in self._revoked
+
+    def __len__(self) -> int:
+        """
+        Count the revoked tokens.
+
+        Returns:
+            The number of tokens.
+
+        """
+        return len(self._revoked)
+
+    def add(self, token_id: str, expires: int) -> None:
+        """Revoke a token."""
+        self._revoked[token_id] = expires
+
+    def update(self, revoked: Iterable[tuple[str, int]], now: int) -> None:
+        """Add tokens revoked elsewhere, and forget the expired ones."""
+        merged = {token_id: expires for token_id, expires in self._revoked.items() if expires > now}
+        merged.update(revoked)
+        # Swapped in whole, so readers in other threads never see it half-built
+        self._revoked = merged
+
+
+revoked_tokens = RevocationList()
+# Checking a signature is cheap, but not as cheap as remembering that it was fine
+verified_tokens: TTLCache[str, TokenClaims] = TTLCache(ttl=TOKEN_LIFETIME, maxsize=TOKEN_CACHE_SIZE)
+# Reported and cleared along with the other caches
+crud.CACHES["verified_tokens"] = verified_tokens
+
+
+def verify_token(token: str, now: float | None = None) -> TokenClaims:
+    """
+    Check that a token is genuine, has not expired and has not been revoked.
+
+    Returns:
+        The claims of the token.
+
+    Raises:
+        InvalidTokenError: If the token may not be used.
+
+    """
+    claims = verified_tokens.get(token)
+    if claims is None:
+        claims = decode_token(token)
+        verified_tokens.set(token, claims)
+
+    if claims.expires <= (time.time() if now is None else now):
+        msg = "Token has expired"
+        raise InvalidTokenError(msg)
+    if claims.token_id in revoked_tokens:
+        msg = "Token has been revoked"
+        raise InvalidTokenError(msg)
+    return claims
+
+
+def revoke(db: Session, claims: TokenClaims) -> None:
+    """Revoke a token in this worker at once, and in the others once they sync."""
+    crud.revoke_token(db, claims.token_id, claims.expires)
+    revoked_tokens.add(claims.token_id, claims.expires)
+
+
+def sync_revocations(db: Session) -> None:
+    """Pick up the tokens revoked by other workers, and forget the expired ones."""
+    now = int(time.time())
+    crud.delete_expired_revocations(db, now)
+    revoked_tokens.update(crud.read_revoked_tokens(db, now), now)
+
+
+async def revocation_sync_loop(interval: float = TOKEN_REVOCATION_SYNC_INTERVAL) -> None:
+    """Sync the revoked tokens periodically until cancelled."""
+    while True:
+        await anyio.sleep(interval)
+        try:
+            with SessionLocal() as db:
+                await run_in_db_pool(sync_revocations, db)
+        except Exception:
+            logger.exception("Syncing revoked tokens failed")
+
+
+token_scheme = HTTPBearer(auto_error=False, description="An access token from logging in")
+
+
+# Dependencies are async so FastAPI runs them on the event loop, rather than in a thread
+async def get_token_claims(  # ruff:ignore[unused-async]
+    credentials: Annotated[HTTPAuthorizationCredentials | None, Depends(token_scheme)],
+) -> TokenClaims:
+    """
+    Check the access token the request was sent with.
+
+    Returns:
+        The claims of the token.
+
+    Raises:
+        HTTPException: If there is no token, or it may not be used.
+
+    """
+    if credentials is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Not authenticated",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    try:
+        return verify_token(credentials.credentials)
+    except InvalidTokenError as err:
+        logger.warning("Rejected access token: %s", err)
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid or expired token",
+            headers={"WWW-Authenticate": 'Bearer error="invalid_token"'},
+        ) from err
+
+
+async def get_current_user(claims: Annotated[TokenClaims, Depends(get_token_claims)]) -> UUID:  # ruff:ignore[unused-async]
+    """
+    Identify the user making the request.
+
+    Returns:
+        The ID of the user the access token was issued to.
+
+    """
+    return claims.user_id
+
+
+CurrentUser = Annotated[UUID, Depends(get_current_user)]
@@ -0,0 +1,141 @@
+"""Implements an in-process hub for pushing room events to subscribers, and to the other workers."""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import TYPE_CHECKING
+
+from eguivalet_server.broker import Broker, create_broker
+from eguivalet_server.config import ROOM_SUBSCRIBER_QUEUE_SIZE
+
+if TYPE_CHECKING:
+    from collections.abc import Generator
+    from uuid import UUID
+
+logger = logging.getLogger(__name__)
+
+
+class Subscription:
+    """A single subscriber's queue of pending room events."""
+
+    def __init__(self, room_id: UUID, queue_size: int = ROOM_SUBSCRIBER_QUEUE_SIZE) -> None:
+        """Create an empty subscription to the given room."""
+        self.room_id = room_id
+        self._queue: asyncio.Queue[str | None] = asyncio.Queue(maxsize=queue_size)
+        self.lagged = False
+
+    def push(self, payload: str) -> None:
+        """
+        Queue an event for the subscriber.
+
+        A subscriber that cannot keep up is cut off instead of silently losing
+        events; it is expected to reconnect and catch up from the history.
+        """
+        if self.lagged:
+            return
+        try:
+            self._queue.put_nowait(payload)
+        except asyncio.QueueFull:
+            logger.warning("Subscriber to room %s fell behind, disconnecting", self.room_id)
+            self.lagged = True
+            while not self._queue.empty():
+                self._queue.get_nowait()
+            self._queue.put_nowait(None)
+
+    async def get(self) -> str | None:
+        """
+        Wait for the next event.
+
+        Returns:
+            The serialised event, or None if the subscriber fell behind.
+
+        """
+        return await self._queue.get()
+
+
+class RoomBroadcaster:
+    """
+    Fans out serialised room events to every subscriber of that room.
+
+    With a broker, events are also sent to the other workers, and the broker
+    listens to the rooms this worker has subscribers in.
+    """
+
+    def __init__(self, broker: Broker | None = None) -> None:
+        """Create a hub with no subscribers."""
+        self.broker = broker
+        self._subscribers: defaultdict[UUID, set[Subscription]] = defaultdict(set)
+
+    @contextmanager
+    def subscribe(self, room_id: UUID) -> Generator[Subscription, None, None]:
+        """
+        Subscribe to the events of a room for the duration of the context.
+
+        Yields:
+            The subscription receiving the events.
+
+        """
+        subscription = Subscription(room_id)
+        if room_id not in self._subscribers and self.broker is not None:
+            self.broker.listen(room_id)
+        self._subscribers[room_id].add(subscription)
+        try:
+            yield subscription
+        finally:
+            subscribers = self._subscribers[room_id]
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self._subscribers[room_id]
+                if self.broker is not None:
+                    self.broker.unlisten(room_id)
+
+    def publish(self, room_id: UUID, payload: str) -> int:
+        """
+        Send an event to everyone subscribed to the room, in this worker and the others.
+
+        Returns:
+            The number of subscribers in this worker the event was sent to.
+
+        """
+        if self.broker is not None:
+            self.broker.publish(room_id, payload)
+        return self.deliver(room_id, payload)
+
+    def deliver(self, room_id: UUID, payload: str) -> int:
+        """
+        Send an event to the subscribers of the room in this worker only.
+
+        Returns:
+            The number of subscribers the event was sent to.
+
+        """
+        subscribers = self._subscribers.get(room_id, ())
+        for subscription in subscribers:
+            subscription.push(payload)
+        return len(subscribers)
+
+    def subscriber_count(self, room_id: UUID) -> int:
+        """
+        Count the subscribers of a room.
+
+        Returns:
+            The number of active subscriptions to the room.
+
+        """
+        return len(self._subscribers.get(room_id, ()))
+
+    def has_audience(self, room_id: UUID) -> bool:
+        """
+        Check whether an event of the room could reach anyone.
+
+        Returns:
+            True if the room has subscribers in this worker, or may have some in the others.
+
+        """
+        return self.broker is not None or room_id in self._subscribers
+
+
+room_broadcaster = RoomBroadcaster(create_broker())
@@ -0,0 +1,550 @@
+"""
+Carries room events between worker processes.
+
+Each worker pushes events to its own subscribers through the in-process
+`RoomBroadcaster`. With several workers, a message posted through one of them
+must also reach the subscribers of the others, so the broadcaster hands its
+events to a broker too, and passes on the events the broker receives.
+
+A broker queues the events and sends them in batches over one persistent
+connection, and only receives the events of rooms this worker has
+subscribers in. There are two:
+
+- `UnixSocketBroker`, connected to the `BrokerHub` the launcher runs for the
+  workers of a single host
+- `PostgresBroker`, using the LISTEN and NOTIFY commands of the PostgreSQL
+  database the workers share, for servers on several hosts
+
+Events are best-effort: those published while a broker is reconnecting are
+sent once it is back, within `EVENT_BROKER_QUEUE_SIZE`, but those meant for
+it in the meantime are lost. Clients catch up from the message history.
+"""
+
+from __future__ import annotations
+
+import logging
+import uuid
+from abc import ABC, abstractmethod
+from collections import defaultdict, deque
+from contextlib import suppress
+from functools import partial
+from typing import TYPE_CHECKING, Any, NamedTuple, Protocol
+
+import anyio
+import anyio.to_thread
+
+from eguivalet_server.config import (
+    EVENT_BROKER,
+    EVENT_BROKER_BATCH_SIZE,
+    EVENT_BROKER_QUEUE_SIZE,
+    EVENT_BROKER_RECONNECT_INTERVAL,
+    EVENT_BROKER_SOCKET,
+    MAX_EVENT_BROKER_FRAME_SIZE,
+)
+from eguivalet_server.database import engine
+
+if TYPE_CHECKING:
+    from collections.abc import AsyncGenerator, Awaitable, Callable, Iterable, Sequence
+    from uuid import UUID
+
+    from anyio.abc import ByteReceiveStream, ByteSendStream, SocketStream, TaskStatus
+    from anyio.streams.memory import MemoryObjectReceiveStream, MemoryObjectSendStream
+    from sqlalchemy.engine import Engine
+
+    # Passes on an event received from another worker
+    EventHandler = Callable[[UUID, str], None]
+
+logger = logging.getLogger(__name__)
+
+# Frames of the Unix socket protocol, one per line: "<command> <room ID>[ <event>]"
+LISTEN = b"L"
+UNLISTEN = b"U"
+EVENT = b"E"
+# PostgreSQL channel of a room, followed by the hex of its ID
+CHANNEL_PREFIX = "room_"
+
+
+class Batch(NamedTuple):
+    """What a broker has to tell the others since it last sent anything."""
+
+    listen: set[UUID]  # Rooms whose events this worker now wants
+    unlisten: set[UUID]  # Rooms whose events it no longer wants
+    events: list[tuple[UUID, str]]  # Room IDs and serialised events
+
+
+class Broker(ABC):
+    """
+    Sends room events to the other workers, and receives theirs.
+
+    This keeps track of what has to be sent; subclasses implement `connect`.
+    Room events are expected to be JSON, which never contains a raw newline.
+    """
+
+    def __init__(self, queue_size: int = EVENT_BROKER_QUEUE_SIZE, batch_size: int = EVENT_BROKER_BATCH_SIZE) -> None:
+        """Create a broker that is not listening to any room."""
+        self.rooms: set[UUID] = set()  # Rooms this worker has subscribers in
+        self._listening: set[UUID] = set()  # Rooms the connection was last told about
+        self._outbox: deque[tuple[UUID, str]] = deque(maxlen=queue_size)
+        self._batch_size = batch_size
+        self._ready: anyio.Event | None = None
+        self.dropped = 0
+
+    def listen(self, room_id: UUID) -> None:
+        """Start receiving the events of a room from the other workers."""
+        self.rooms.add(room_id)
+        self._wake()
+
+    def unlisten(self, room_id: UUID) -> None:
+        """Stop receiving the events of a room."""
+        self.rooms.discard(room_id)
+        self._wake()
+
+    def publish(self, room_id: UUID, payload: str) -> None:
+        """Queue an event for the other workers, dropping the oldest one if the queue is full."""
+        if len(self._outbox) == self._outbox.maxlen:
+            self.dropped += 1
+        self._outbox.append((room_id, payload))
+        self._wake()
+
+    def _wake(self) -> None:
+        if self._ready is not None:
+            self._ready.set()
+
+    async def next_batch(self) -> Batch:
+        """
+        Wait until there is something to send, and take up to a batch of it.
+
+        Returns:
+            The changes to the rooms listened to, and the queued events.
+
+        """
+        if self._ready is None:
+            self._ready = anyio.Event()
+        while self.rooms == self._listening and not self._outbox:
+            await self._ready.wait()
+            self._ready = anyio.Event()
+
+        if self.dropped:
+            logger.warning("Dropped %d room events the other workers could not be sent in time", self.dropped)
+            self.dropped = 0
+        batch = Batch(self.rooms - self._listening, self._listening - self.rooms, [])
+        self._listening = set(self.rooms)
+        while self._outbox and len(batch.events) < self._batch_size:
+            batch.events.append(self._outbox.popleft())
+        return batch
+
+    async def send_batches(self, send: Callable[[Batch], Awaitable[None]]) -> None:
+        """Send each batch as soon as there is one, until cancelled."""
+        while True:
+            await send(await self.next_batch())
+
+    @abstractmethod
+    async def connect(self, deliver: EventHandler) -> None:
+        """
+        Connect, then send the queued events and receive those of the other workers until the connection fails.
+
+        Events are received from the rooms in `rooms`, and passed to `deliver`.
+        """
+
+    async def run(self, deliver: EventHandler, reconnect_interval: float = EVENT_BROKER_RECONNECT_INTERVAL) -> None:
+        """Carry events until cancelled, reconnecting whenever the connection fails."""
+        self._ready = None  # Made for the event loop this runs in
+        while True:
+            # A new connection is not listening to anything yet
+            self._listening = set()
+            try:
+                await self.connect(deliver)
+            except Exception:
+                logger.exception("Lost the connection to the event broker; retrying")
+            await anyio.sleep(reconnect_interval)
+
+
+def encode_frame(command: bytes, room_id: UUID, payload: str = "") -> bytes:
+    """
+    Encode a frame of the Unix socket protocol.
+
+    Returns:
+        The frame, with its newline.
+
+    """
+    frame = command + b" " + room_id.hex.encode()
+    if payload:
+        frame += b" " + payload.encode()
+    return frame + b"\n"
+
+
+def encode_batch(batch: Batch) -> bytes:
+    """
+    Encode a batch as frames of the Unix socket protocol.
+
+    Returns:
+        The frames, sent together.
+
+    """
+    frames = [encode_frame(UNLISTEN, room_id) for room_id in batch.unlisten]
+    frames += [encode_frame(LISTEN, room_id) for room_id in batch.listen]
+    frames += [encode_frame(EVENT, room_id, payload) for room_id, payload in batch.events]
+    return b"".join(frames)
+
+
+class Frame(NamedTuple):
+    """A decoded frame of the Unix socket protocol."""
+
+    command: bytes
+    room_id: UUID
+    payload: bytes
+
+
+def parse_frame(line: bytes) -> Frame:
+    """
+    Decode a frame of the Unix socket protocol.
+
+    Returns:
+        The frame.
+
+    Raises:
+        ValueError: If the line is not a frame.
+
+    """
+    command, room_id, payload = [*line.split(b" ", 2), b""][:3]
+    if command not in {LISTEN, UNLISTEN, EVENT}:
+        msg = f"Unknown event broker command {command!r}"
+        raise ValueError(msg)
+    return Frame(command, uuid.UUID(room_id.decode()), payload)
+
+
+async def receive_lines(
+    stream: ByteReceiveStream, max_size: int = MAX_EVENT_BROKER_FRAME_SIZE,
+) -> AsyncGenerator[list[bytes], None]:
+    """
+    Read newline-terminated frames as they arrive, until the stream ends.
+
+    Yields:
+        The frames that arrived together, without their newlines.
+
+    Raises:
+        ValueError: If a frame grows longer than `max_size`.
+
+    """
+    buffer = b""
+    async for chunk in stream:
+        *lines, buffer = (buffer + chunk).split(b"\n")
+        if len(buffer) > max_size:
+            msg = "Event broker frame too long"
+            raise ValueError(msg)
+        if lines:
+            yield lines
+
+
+class UnixSocketBroker(Broker):
+    """Exchanges room events through a `BrokerHub` listening on a Unix socket."""
+
+    def __init__(self, path: str, **options: int) -> None:
+        """Create a broker for the hub at the given path."""
+        super().__init__(**options)
+        self.path = path
+
+    async def connect(self, deliver: EventHandler) -> None:
+        """
+        Connect to the hub, and exchange events until it hangs up.
+
+        Raises:
+            ConnectionResetError: Once the hub has closed the connection.
+
+        """
+        async with await anyio.connect_unix(self.path) as stream, anyio.create_task_group() as tasks:
+            logger.info("Connected to the event broker at %s", self.path)
+            tasks.start_soon(self.send_batches, partial(self._send, stream))
+            async for lines in receive_lines(stream):
+                for line in lines:
+                    frame = parse_frame(line)
+                    deliver(frame.room_id, frame.payload.decode())
+            msg = "The event broker closed the connection"
+            raise ConnectionResetError(msg)
+
+    @staticmethod
+    async def _send(stream: ByteSendStream, batch: Batch) -> None:
+        await stream.send(encode_batch(batch))
+
+
+def drain(events: MemoryObjectReceiveStream[bytes], first: bytes) -> bytes:
+    """
+    Take every event already waiting for a worker, to send along with the first.
+
+    Returns:
+        The events, joined.
+
+    """
+    chunks = [first]
+    with suppress(anyio.WouldBlock):
+        while True:
+            chunks.append(events.receive_nowait())
+    return b"".join(chunks)
+
+
+class BrokerHub:
+    """
+    Passes room events between the workers of one host, over a Unix socket.
+
+    Each event is only sent to the workers listening to its room, other than
+    the one it came from. A worker that stops reading has its events dropped,
+    rather than holding up the others.
+    """
+
+    def __init__(self, queue_size: int = EVENT_BROKER_QUEUE_SIZE) -> None:
+        """Create a hub with no workers connected."""
+        self._queue_size = queue_size
+        self._listeners: defaultdict[UUID, set[MemoryObjectSendStream[bytes]]] = defaultdict(set)
+
+    def listener_count(self, room_id: UUID) -> int:
+        """
+        Count the workers listening to a room.
+
+        Returns:
+            The number of workers.
+
+        """
+        return len(self._listeners.get(room_id, ()))
+
+    async def serve(self, path: str, *, task_status: TaskStatus[None] = anyio.TASK_STATUS_IGNORED) -> None:
+        """Accept workers on a Unix socket at the given path until cancelled, replacing any old socket there."""
+        async with await anyio.create_unix_listener(path) as listener:
+            logger.info("Event broker listening on %s", path)
+            task_status.started()
+            await listener.serve(self.handle)
+
+    async def handle(self, stream: SocketStream) -> None:
+        """Pass on the events of a worker, and send it those of the rooms it listens to, until it hangs up."""
+        outbox, events = anyio.create_memory_object_stream[bytes](self._queue_size)
+        rooms: set[UUID] = set()
+        try:
+            async with stream, outbox, events, anyio.create_task_group() as tasks:
+                tasks.start_soon(self._forward, events, stream)
+                async for lines in receive_lines(stream):
+                    self.route(outbox, rooms, lines)
+                tasks.cancel_scope.cancel()
+        except Exception:
+            logger.exception("Dropped a worker's event broker connection")
+        finally:
+            for room_id in rooms:
+                self._leave(room_id, outbox)
+
+    def route(self, sender: MemoryObjectSendStream[bytes], rooms: set[UUID], lines: Iterable[bytes]) -> None:
+        """Apply the frames a worker sent, queueing its events for the other workers in one write each."""
+        outgoing: defaultdict[MemoryObjectSendStream[bytes], list[bytes]] = defaultdict(list)
+        for line in lines:
+            frame = parse_frame(line)
+            if frame.command == LISTEN:
+                rooms.add(frame.room_id)
+                self._listeners[frame.room_id].add(sender)
+            elif frame.command == UNLISTEN:
+                rooms.discard(frame.room_id)
+                self._leave(frame.room_id, sender)
+            else:
+                for listener in self._listeners.get(frame.room_id, ()):
+                    if listener is not sender:
+                        outgoing[listener].append(line)
+
+        for listener, frames in outgoing.items():
+            self._queue(listener, frames)
+
+    @staticmethod
+    def _queue(listener: MemoryObjectSendStream[bytes], frames: list[bytes]) -> None:
+        try:
+            listener.send_nowait(b"\n".join(frames) + b"\n")
+        except anyio.WouldBlock:
+            logger.warning("A worker fell behind; dropped %d room events meant for it", len(frames))
+
+    def _leave(self, room_id: UUID, listener: MemoryObjectSendStream[bytes]) -> None:
+        listeners = self._listeners.get(room_id)
+        if listeners is not None:
+            listeners.discard(listener)
+            if not listeners:
+                del self._listeners[room_id]
+
+    @staticmethod
+    async def _forward(events: MemoryObjectReceiveStream[bytes], stream: ByteSendStream) -> None:
+        async for first in events:
+            await stream.send(drain(events, first))
+
+
+class NotifyConnection(Protocol):
+    """A PostgreSQL connection used for LISTEN and NOTIFY, in autocommit mode."""
+
+    def fileno(self) -> int:
+        """Get the socket to wait on for notifications."""
+
+    def listen(self, channels: Iterable[str]) -> None:
+        """Start receiving the notifications of the channels."""
+
+    def unlisten(self, channels: Iterable[str]) -> None:
+        """Stop receiving the notifications of the channels."""
+
+    def notify(self, notifications: Sequence[tuple[str, str]]) -> None:
+        """Send notifications, as channel and payload pairs, in one statement."""
+
+    def poll(self) -> list[tuple[str, str]]:
+        """Take the notifications received so far, as channel and payload pairs, without blocking."""
+
+    def close(self) -> None:
+        """Close the connection."""
+
+
+class PsycopgNotifyConnection:
+    """A `NotifyConnection` over psycopg2, the driver SQLAlchemy uses for PostgreSQL by default."""
+
+    def __init__(self, connection: Any) -> None:  # ruff:ignore[any-type]
+        """Wrap a psycopg2 connection, switching it to autocommit so notifications are sent at once."""
+        connection.autocommit = True
+        self._connection = connection
+
+    @classmethod
+    def from_engine(cls, db_engine: Engine) -> PsycopgNotifyConnection:
+        """
+        Open a connection to the database of an engine.
+
+        Returns:
+            The connection, held outside the engine's pool for as long as it is open.
+
+        """
+        connection = db_engine.raw_connection()
+        connection.detach()
+        return cls(connection.driver_connection)
+
+    def fileno(self) -> int:
+        """
+        Get the socket of the connection.
+
+        Returns:
+            The file descriptor.
+
+        """
+        return self._connection.fileno()
+
+    def _execute(self, statement: str, parameters: Sequence[object] = ()) -> None:
+        with self._connection.cursor() as cursor:
+            cursor.execute(statement, parameters)
+
+    def listen(self, channels: Iterable[str]) -> None:
+        """Start receiving the notifications of the channels."""
+        # Channel names are made up of a prefix and hex digits, so they need no quoting
+        self._execute("".join(f"LISTEN {channel};" for channel in channels))
+
+    def unlisten(self, channels: Iterable[str]) -> None:
+        """Stop receiving the notifications of the channels."""
+        self._execute("".join(f"UNLISTEN {channel};" for channel in channels))
+
+    def notify(self, notifications: Sequence[tuple[str, str]]) -> None:
+        """Send notifications, as channel and payload pairs, in one statement."""
+        channels, payloads = zip(*notifications, strict=True)
+        self._execute(
+            "SELECT pg_notify(channel, payload) FROM unnest(%s::text[], %s::text[]) AS batch(channel, payload)",
+            (list(channels), list(payloads)),
+        )
+
+    def poll(self) -> list[tuple[str, str]]:
+        """
+        Take the notifications received so far.
+
+        Returns:
+            Channel and payload pairs.
+
+        """
+        self._connection.poll()
+        notifications = [(notify.channel, notify.payload) for notify in self._connection.notifies]
+        self._connection.notifies.clear()
+        return notifications
+
+    def close(self) -> None:
+        """Close the connection."""
+        self._connection.close()
+
+
+def channel_name(room_id: UUID) -> str:
+    """
+    Name the PostgreSQL notification channel of a room.
+
+    Returns:
+        The channel name.
+
+    """
+    return f"{CHANNEL_PREFIX}{room_id.hex}"
+
+
+class PostgresBroker(Broker):
+    """
+    Exchanges room events through PostgreSQL notifications, with a channel per room.
+
+    Each batch of events is sent with a single statement. The database also
+    notifies the connection that sent them, so events are tagged with the
+    broker they came from, and it skips its own.
+    """
+
+    def __init__(self, connect: Callable[[], NotifyConnection], **options: int) -> None:
+        """Create a broker opening its connections with `connect`."""
+        super().__init__(**options)
+        self._connect = connect
+        self.origin = uuid.uuid4().hex
+
+    async def connect(self, deliver: EventHandler) -> None:
+        """Connect to the database, and exchange events until the connection fails."""
+        connection = await anyio.to_thread.run_sync(self._connect)
+        # The connection runs one statement at a time, and reading notifications counts as one
+        lock = anyio.Lock()
+
+        def receive() -> None:
+            for channel, message in connection.poll():
+                origin, _, payload = message.partition(" ")
+                if origin != self.origin:
+                    deliver(uuid.UUID(channel.removeprefix(CHANNEL_PREFIX)), payload)
+
+        async def send(batch: Batch) -> None:
+            async with lock:
+                await anyio.to_thread.run_sync(self._execute, connection, batch)
+                # Notifications arriving along with the results have been read off the socket already
+                receive()
+
+        try:
+            logger.info("Listening for room events from the database")
+            async with anyio.create_task_group() as tasks:
+                tasks.start_soon(self.send_batches, send)
+                while True:
+                    await anyio.wait_readable(connection.fileno())
+                    async with lock:
+                        receive()
+        finally:
+            connection.close()
+
+    def _execute(self, connection: NotifyConnection, batch: Batch) -> None:
+        if batch.unlisten:
+            connection.unlisten([channel_name(room_id) for room_id in batch.unlisten])
+        if batch.listen:
+            connection.listen([channel_name(room_id) for room_id in batch.listen])
+        if batch.events:
+            connection.notify([
+                (channel_name(room_id), f"{self.origin} {payload}") for room_id, payload in batch.events
+            ])
+
+
+def create_broker(kind: str | None = EVENT_BROKER, socket_path: str | None = EVENT_BROKER_SOCKET) -> Broker | None:
+    """
+    Create the configured event broker.
+
+    Returns:
+        The broker, or None if events stay within this worker.
+
+    Raises:
+        ValueError: If the broker cannot be used with this configuration.
+
+    """
+    if kind == "unix":
+        if socket_path is None:
+            msg = "The unix event broker needs EGUIVALET_EVENT_BROKER_SOCKET"
+            raise ValueError(msg)
+        return UnixSocketBroker(socket_path)
+    if kind == "postgresql":
+        if engine.dialect.name != "postgresql":
+            msg = f"The postgresql event broker cannot use a {engine.dialect.name} database"
+            raise ValueError(msg)
+        return PostgresBroker(partial(PsycopgNotifyConnection.from_engine, engine))
+    return None
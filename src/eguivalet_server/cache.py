@@ -0,0 +1,401 @@
+"""Implements process-local caches for frequently read data."""
+
+from __future__ import annotations
+
+import bisect
+import threading
+import time
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Generic, Protocol, TypeVar
+
+if TYPE_CHECKING:
+    from collections.abc import Callable, Hashable, Iterable
+    from datetime import datetime
+    from uuid import UUID
+
+K = TypeVar("K", bound="Hashable")
+V = TypeVar("V")
+
+
+class TTLCache(Generic[K, V]):
+    """
+    A thread-safe cache whose entries expire a fixed time after being stored.
+
+    Every invalidation bumps a generation counter. A value loaded before an
+    invalidation is refused when stored afterwards, so a slow reader cannot
+    put back data that a concurrent write has just made stale.
+
+    With a `maxsize`, the least recently used entry is evicted to make room
+    for new ones. Hits and misses are counted for the metrics.
+    """
+
+    def __init__(self, ttl: float, clock: Callable[[], float] = time.monotonic, maxsize: int | None = None) -> None:
+        """Create an empty cache whose entries live for `ttl` seconds."""
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._clock = clock
+        self._entries: OrderedDict[K, tuple[float, V]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        """
+        Count the stored entries, including expired ones not yet dropped.
+
+        Returns:
+            The number of entries.
+
+        """
+        return len(self._entries)
+
+    def get(self, key: K) -> V | None:
+        """
+        Fetch a cached value.
+
+        Returns:
+            The value, or None if it is missing or expired.
+
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires, value = entry
+            if expires <= self._clock():
+                del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: K, value: V, generation: int | None = None) -> bool:
+        """
+        Store a value.
+
+        If `generation` is given and the cache has been invalidated since it
+        was read, the value is discarded.
+
+        Returns:
+            True if the value was stored.
+
+        """
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return False
+            self._entries[key] = (self._clock() + self.ttl, value)
+            self._entries.move_to_end(key)
+            if self.maxsize is not None and len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+            return True
+
+    def invalidate(self, key: K) -> None:
+        """Drop a single entry."""
+        with self._lock:
+            self.generation += 1
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        """Drop every entry."""
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+
+
+class CachedMessage(Protocol):
+    """What `RecentMessages` needs to know about a message."""
+
+    @property
+    def id(self) -> UUID:
+        """The message ID."""
+
+    @property
+    def message(self) -> str:
+        """The text of the message."""
+
+    @property
+    def creation_time(self) -> datetime:
+        """When the message was sent."""
+
+
+M = TypeVar("M", bound=CachedMessage)
+
+
+class RoomTail(Generic[M]):
+    """The newest messages of a room, oldest first, with nothing missing in between."""
+
+    def __init__(self, messages: list[M], expires: float, entry_overhead: int, *, whole_room: bool) -> None:
+        """Hold the newest messages of a room; `whole_room` if there are no older ones."""
+        self.messages = messages
+        self.keys = [(message.creation_time, message.id) for message in messages]
+        self.whole_room = whole_room
+        self.expires = expires
+        self.entry_overhead = entry_overhead
+        self.size = sum(self.entry_size(message) for message in messages)
+
+    def entry_size(self, message: M) -> int:
+        """
+        Estimate how much memory a message takes.
+
+        Returns:
+            The estimate in bytes.
+
+        """
+        return self.entry_overhead + len(message.message)
+
+    def page(self, after: tuple[datetime, UUID] | None, limit: int) -> list[M] | None:
+        """
+        Find the oldest `limit` messages newer than `after`, or the newest `limit` without it.
+
+        Returns:
+            The messages, oldest first, or None if some of them might not be in the tail.
+
+        """
+        if after is None:
+            if limit > len(self.messages) and not self.whole_room:
+                return None
+            return self.messages[-limit:]
+        try:
+            if not self.whole_room and (not self.keys or after < self.keys[0]):
+                return None
+            start = bisect.bisect_right(self.keys, after)
+        except TypeError:
+            # A cursor with a time zone, when the database has none, or the other way around
+            return None
+        return self.messages[start:start + limit]
+
+    def insert(self, message: M, capacity: int) -> None:
+        """Add a new message, forgetting the oldest one if the tail is full."""
+        key = (message.creation_time, message.id)
+        if not self.whole_room and (not self.keys or key < self.keys[0]):
+            # Older than anything kept, so the tail stays the same
+            return
+        index = bisect.bisect_right(self.keys, key)
+        if index and self.keys[index - 1] == key:
+            # Already loaded from the database, between the message being written and added here
+            return
+        self.keys.insert(index, key)
+        self.messages.insert(index, message)
+        self.size += self.entry_size(message)
+        if len(self.messages) > capacity:
+            del self.keys[0]
+            self.size -= self.entry_size(self.messages.pop(0))
+            self.whole_room = False
+
+    def find(self, message_id: UUID) -> int | None:
+        """
+        Find a message by its ID.
+
+        Returns:
+            The index of the message, or None if it is not in the tail.
+
+        """
+        # Edits and deletions are rare next to reads, and tails are short
+        return next((index for index, message in enumerate(self.messages) if message.id == message_id), None)
+
+
+class RecentMessages(Generic[M]):
+    """
+    A thread-safe cache of the newest messages of each room, to serve most message reads without a query.
+
+    Each room's tail holds its newest `room_size` messages, or all of them if
+    there are fewer, so it can answer for the latest page, and for any page
+    after a cursor within it. It is loaded from the database on a miss, and
+    kept up to date by the writes of this process. Writes by other processes
+    are only seen once a tail expires, `ttl` seconds after it was loaded.
+
+    Rooms are evicted least recently used first, to keep the estimated size
+    of all tails within `budget` bytes. Like `TTLCache`, a tail loaded while
+    the room was being written to is refused, using generation counters.
+    Counters are shared by rooms whose IDs hash alike, which only means
+    refusing a little more often.
+    """
+
+    GENERATION_STRIPES = 1024
+
+    def __init__(
+        self,
+        room_size: int,
+        budget: int,
+        ttl: float,
+        entry_overhead: int,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        """Create an empty cache."""
+        self.room_size = room_size
+        self.budget = budget
+        self.ttl = ttl
+        self.entry_overhead = entry_overhead
+        self._clock = clock
+        self._tails: OrderedDict[UUID, RoomTail[M]] = OrderedDict()
+        self._generations = [0] * self.GENERATION_STRIPES
+        self._lock = threading.Lock()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        """
+        Count the rooms with a cached tail, including expired ones not yet dropped.
+
+        Returns:
+            The number of rooms.
+
+        """
+        return len(self._tails)
+
+    def __contains__(self, room_id: object) -> bool:
+        """
+        Check whether a room has a cached tail that has not expired.
+
+        Returns:
+            True if it does.
+
+        """
+        with self._lock:
+            tail = self._tails.get(room_id)  # type: ignore[call-overload]
+            return tail is not None and tail.expires > self._clock()
+
+    def generation(self, room_id: UUID) -> int:
+        """
+        Tell how many times rooms like this one have been written to, to pass to `fill`.
+
+        Returns:
+            The generation.
+
+        """
+        return self._generations[hash(room_id) % self.GENERATION_STRIPES]
+
+    def _bump(self, room_id: UUID) -> None:
+        self._generations[hash(room_id) % self.GENERATION_STRIPES] += 1
+
+    def _tail(self, room_id: UUID) -> RoomTail[M] | None:
+        tail = self._tails.get(room_id)
+        if tail is not None and tail.expires <= self._clock():
+            self._drop(room_id)
+            return None
+        return tail
+
+    def _drop(self, room_id: UUID) -> None:
+        tail = self._tails.pop(room_id, None)
+        if tail is not None:
+            self.size -= tail.size
+
+    def _evict(self) -> None:
+        while self.size > self.budget and self._tails:
+            _, tail = self._tails.popitem(last=False)
+            self.size -= tail.size
+
+    def peek(self, room_id: UUID, after: tuple[datetime, UUID] | None, limit: int) -> list[M] | None:
+        """
+        Read a page of messages like `read`, without counting it as a hit or a miss.
+
+        Returns:
+            The messages, oldest first, or None if the cache cannot tell.
+
+        """
+        with self._lock:
+            tail = self._tail(room_id)
+            if tail is None:
+                return None
+            self._tails.move_to_end(room_id)
+            return tail.page(after, limit)
+
+    def read(self, room_id: UUID, after: tuple[datetime, UUID] | None, limit: int) -> list[M] | None:
+        """
+        Read the oldest `limit` messages of a room newer than `after`, or the newest `limit` without it.
+
+        Returns:
+            The messages, oldest first, or None if the cache cannot tell.
+
+        """
+        messages = self.peek(room_id, after, limit)
+        with self._lock:
+            if messages is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return messages
+
+    def fill(self, room_id: UUID, messages: list[M], generation: int) -> bool:
+        """
+        Store the newest `room_size` messages of a room, oldest first, as read from the database.
+
+        Fewer messages than that are taken to be all of them. If the room has
+        been written to since `generation` was read, they are discarded.
+
+        Returns:
+            True if the messages were stored.
+
+        """
+        with self._lock:
+            if self.ttl <= 0 or generation != self.generation(room_id):
+                return False
+            self._drop(room_id)
+            tail = RoomTail(
+                messages[-self.room_size:],
+                self._clock() + self.ttl,
+                self.entry_overhead,
+                whole_room=len(messages) < self.room_size,
+            )
+            self._tails[room_id] = tail
+            self.size += tail.size
+            self._evict()
+            return True
+
+    def add(self, room_id: UUID, messages: Iterable[M]) -> None:
+        """Add new messages to the tail of a room, or forget the tail if they cannot be placed in it."""
+        with self._lock:
+            self._bump(room_id)
+            if (tail := self._tail(room_id)) is None:
+                return
+            self.size -= tail.size
+            try:
+                for message in messages:
+                    tail.insert(message, self.room_size)
+            except TypeError:
+                # A time with a time zone, when the database has none, or the other way around; the
+                # tail may be half updated, and its size was already taken off the total
+                del self._tails[room_id]
+                return
+            self.size += tail.size
+            self._evict()
+
+    def replace(self, room_id: UUID, message: M) -> None:
+        """Update an edited message in the tail of a room."""
+        with self._lock:
+            self._bump(room_id)
+            if (tail := self._tail(room_id)) is None or (index := tail.find(message.id)) is None:
+                return
+            self.size -= tail.size
+            tail.size += tail.entry_size(message) - tail.entry_size(tail.messages[index])
+            tail.messages[index] = message
+            self.size += tail.size
+            self._evict()
+
+    def remove(self, room_id: UUID, message_id: UUID) -> None:
+        """Forget a deleted message."""
+        with self._lock:
+            self._bump(room_id)
+            if (tail := self._tail(room_id)) is None or (index := tail.find(message_id)) is None:
+                return
+            del tail.keys[index]
+            removed = tail.messages.pop(index)
+            tail.size -= tail.entry_size(removed)
+            self.size -= tail.entry_size(removed)
+
+    def invalidate(self, room_id: UUID) -> None:
+        """Forget the tail of a room."""
+        with self._lock:
+            self._bump(room_id)
+            self._drop(room_id)
+
+    def clear(self) -> None:
+        """Forget every tail."""
+        with self._lock:
+            self._generations = [generation + 1 for generation in self._generations]
+            self._tails.clear()
+            self.size = 0
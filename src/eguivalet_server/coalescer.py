@@ -0,0 +1,127 @@
+"""Implements group commit for writes arriving close together."""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+from contextlib import suppress
+from typing import TYPE_CHECKING, Generic, TypeVar
+
+from eguivalet_server import crud
+from eguivalet_server.config import MESSAGE_WRITE_MAX_BATCH, MESSAGE_WRITE_WINDOW
+from eguivalet_server.database import SessionLocal, run_in_db_pool
+
+if TYPE_CHECKING:
+    from collections.abc import Callable
+    from uuid import UUID
+
+    from eguivalet_server import schemas
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+class WriteCoalescer(Generic[T, R]):
+    """
+    Collects writes from concurrent requests and commits them together.
+
+    The first write after an idle period waits up to `window` seconds (or
+    until `max_batch` writes have queued up) for company. Writes arriving
+    while a batch is being committed go out in the next batch straight away,
+    as they have already waited for a commit. Every caller gets its result
+    only after its batch has been committed, so durability is unchanged.
+    """
+
+    def __init__(self, flush: Callable[[list[T]], list[R]], window: float, max_batch: int) -> None:
+        """Create a coalescer that commits batches with the blocking `flush` function."""
+        self.flush = flush
+        self.window = window
+        self.max_batch = max_batch
+        self._pending: list[tuple[T, asyncio.Future[R]]] = []
+        self._batch_full: asyncio.Event | None = None
+        self._worker: asyncio.Task[None] | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+
+    async def submit(self, item: T) -> R:
+        """
+        Queue a write and wait for the batch containing it to be committed.
+
+        Returns:
+            The result `flush` gave for this item.
+
+        """
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            # Whatever was bound to a previous event loop can never finish
+            self._loop = loop
+            self._pending = []
+            self._batch_full = asyncio.Event()
+            self._worker = None
+
+        future: asyncio.Future[R] = loop.create_future()
+        self._pending.append((item, future))
+        if len(self._pending) >= self.max_batch and self._batch_full is not None:
+            self._batch_full.set()
+        if self._worker is None or self._worker.done():
+            self._worker = loop.create_task(self._run())
+        return await future
+
+    async def close(self) -> None:
+        """Wait until every queued write has been committed."""
+        if self._worker is not None and self._loop is asyncio.get_running_loop():
+            if self._batch_full is not None:
+                self._batch_full.set()
+            await self._worker
+
+    async def _run(self) -> None:
+        """Commit batches until the queue runs dry."""
+        if self._batch_full is not None and len(self._pending) < self.max_batch:
+            with suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._batch_full.wait(), self.window)
+
+        while self._pending:
+            if self._batch_full is not None:
+                self._batch_full.clear()
+            batch = self._pending[:self.max_batch]
+            del self._pending[:self.max_batch]
+            await self._commit(batch)
+
+    async def _commit(self, batch: list[tuple[T, asyncio.Future[R]]]) -> None:
+        """Run one batch through `flush` and hand out the results."""
+        logger.debug("Committing a batch of %d writes", len(batch))
+        try:
+            results = await run_in_db_pool(self.flush, [item for item, _ in batch])
+        except Exception as err:
+            logger.exception("Committing a batch of %d writes failed", len(batch))
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(err)
+            return
+
+        for (_, future), result in zip(batch, results, strict=True):
+            if not future.done():
+                future.set_result(result)
+
+
+def write_messages(batch: list[tuple[UUID, schemas.Message]]) -> list[bool]:
+    """
+    Write a batch of messages in a session of its own.
+
+    Returns:
+        Whether each message was created.
+
+    """
+    db = SessionLocal()
+    try:
+        return crud.create_messages(db, batch)
+    finally:
+        db.close()
+
+
+message_writer: WriteCoalescer[tuple[UUID, schemas.Message], bool] = WriteCoalescer(
+    write_messages,
+    window=MESSAGE_WRITE_WINDOW,
+    max_batch=MESSAGE_WRITE_MAX_BATCH,
+)
@@ -2,20 +2,109 @@
 
 from __future__ import annotations
 
+import hashlib
 import logging
 from datetime import datetime, timezone
-from typing import TYPE_CHECKING
+from itertools import starmap
+from typing import TYPE_CHECKING, Any, NamedTuple
+
+from pydantic import TypeAdapter
+from sqlalchemy import column, delete, func, insert, literal_column, select, table, text, tuple_, update
 
 from eguivalet_server import models, schemas
+from eguivalet_server.cache import RecentMessages, TTLCache
+from eguivalet_server.config import (
+    DELETION_BATCH_SIZE,
+    MESSAGE_CACHE_BUDGET,
+    MESSAGE_CACHE_ENTRY_OVERHEAD,
+    MESSAGE_CACHE_ROOM_SIZE,
+    MESSAGE_CACHE_TTL,
+    PERMISSION_CACHE_SIZE,
+    PERMISSION_CACHE_TTL,
+    POSTGRESQL_SEARCH_CONFIG,
+    PUBLIC_ROOMS_CACHE_TTL,
+    AccessLevel,
+    DeletionKind,
+    DeletionStatus,
+)
 
 if TYPE_CHECKING:
+    from collections.abc import Iterable, Sequence
     from uuid import UUID
 
+    from sqlalchemy import Select
     from sqlalchemy.orm import Session
 
+    from eguivalet_server.utility import MessageCursor
+
 logger = logging.getLogger(__name__)
 
 
+class PublicRooms(NamedTuple):
+    """Cached listing of the public rooms."""
+
+    rooms: list[schemas.Room]
+    etag: str
+    body: bytes  # The rooms as JSON, ready to send
+
+
+class MessageRow(NamedTuple):
+    """What `schemas.Message` shows of a message, as read from the database."""
+
+    id: UUID
+    user_id: UUID
+    message: str
+    creation_time: datetime
+
+
+MESSAGE_COLUMNS = (models.Message.id, models.Message.user_id, models.Message.message, models.Message.creation_time)
+
+
+def message_row(db_message: models.Message) -> MessageRow:
+    """
+    Take what `schemas.Message` shows of a message model.
+
+    Returns:
+        The message as a row.
+
+    """
+    return MessageRow(db_message.id, db_message.user_id, db_message.message, db_message.creation_time)
+
+
+rooms_adapter: TypeAdapter[list[schemas.Room]] = TypeAdapter(list[schemas.Room])
+public_rooms_cache: TTLCache[str, PublicRooms] = TTLCache(ttl=PUBLIC_ROOMS_CACHE_TTL)
+# What posting a message needs to know, so that checking permissions seldom needs a query
+room_public_cache: TTLCache[UUID, bool] = TTLCache(ttl=PERMISSION_CACHE_TTL, maxsize=PERMISSION_CACHE_SIZE)
+membership_cache: TTLCache[tuple[UUID, UUID], bool] = TTLCache(
+    ttl=PERMISSION_CACHE_TTL, maxsize=PERMISSION_CACHE_SIZE,
+)
+access_level_cache: TTLCache[UUID, AccessLevel] = TTLCache(ttl=PERMISSION_CACHE_TTL, maxsize=PERMISSION_CACHE_SIZE)
+
+# The newest messages of rooms recently read from, which most reads are for
+recent_messages: RecentMessages[MessageRow] = RecentMessages(
+    room_size=MESSAGE_CACHE_ROOM_SIZE,
+    budget=MESSAGE_CACHE_BUDGET,
+    ttl=MESSAGE_CACHE_TTL,
+    entry_overhead=MESSAGE_CACHE_ENTRY_OVERHEAD,
+)
+# The SQLite full-text index of message text; see `models.SEARCH_INDEX_DDL`
+MESSAGES_FTS = table("messages_fts", column("rowid"), column("rank"))
+
+CACHES: dict[str, TTLCache[Any, Any] | RecentMessages[Any]] = {
+    "public_rooms": public_rooms_cache,
+    "room_public": room_public_cache,
+    "membership": membership_cache,
+    "access_level": access_level_cache,
+    "recent_messages": recent_messages,
+}
+
+
+def clear_caches() -> None:
+    """Drop everything cached, eg. after the database was changed behind the server's back."""
+    for cache in CACHES.values():
+        cache.clear()
+
+
 def read_public_rooms(db: Session) -> list[models.Room]:
     """
     Fetch all public rooms.
@@ -26,20 +115,42 @@ def read_public_rooms(db: Session) -> list[models.Room]:
     """
     return (
         db.query(models.Room)
-        .filter(models.Room.public is True)
+        .filter(models.Room.public == True, models.Room.deletion_time.is_(None))
         .all()
     )
 
 
-def read_room(db: Session, room_id: UUID) -> models.Room | None:
+def read_public_rooms_cached(db: Session) -> PublicRooms:
+    """
+    Fetch all public rooms, from the cache if possible.
+
+    Returns:
+        The public rooms and an ETag identifying this version of the list.
+
+    """
+    if (cached := public_rooms_cache.get("public")) is not None:
+        return cached
+
+    generation = public_rooms_cache.generation
+    rooms = rooms_adapter.validate_python(read_public_rooms(db), from_attributes=True)
+    body = rooms_adapter.dump_json(rooms)
+    public_rooms = PublicRooms(rooms, f'"{hashlib.sha256(body).hexdigest()[:32]}"', body)
+    public_rooms_cache.set("public", public_rooms, generation=generation)
+    return public_rooms
+
+
+def read_room(db: Session, room_id: UUID, *, include_deleted: bool = False) -> models.Room | None:
     """
     Fetch a room by the room ID.
 
     Returns:
-        The room model, or None if not found.
+        The room model, or None if not found, or deleted unless `include_deleted` is set.
 
     """
-    return db.query(models.Room).filter(models.Room.id == room_id).first()
+    query = db.query(models.Room).filter(models.Room.id == room_id)
+    if not include_deleted:
+        query = query.filter(models.Room.deletion_time.is_(None))
+    return query.first()
 
 
 def create_room(db: Session, room: schemas.Room) -> models.Room:
@@ -52,63 +163,340 @@ def create_room(db: Session, room: schemas.Room) -> models.Room:
     """
     db_room = models.Room(**room.dict())
     db.add(db_room)
+    if room.owner is not None and read_user(db, room.owner) is not None:
+        # Owners are members of their rooms, so they can post in private ones
+        db.flush()
+        db.execute(insert(models.users_in_rooms_table).values(user_id=room.owner, room_id=db_room.id))
     db.commit()
+    public_rooms_cache.clear()
+    membership_cache.invalidate((db_room.id, room.owner))
     db.refresh(db_room)
     return db_room
 
 
-def delete_room(db: Session, room_id: UUID) -> None:
-    """Delete an existing room."""
-    db.query(models.Room).filter(models.Room.id == room_id).delete()
+def start_deletion(
+    db: Session, model: type[models.Room | models.User], kind: DeletionKind, target_id: UUID, requester_id: UUID,
+) -> models.DeletionJob | None:
+    """
+    Mark a room or user as deleted, and queue the purge of what it leaves behind.
+
+    Returns:
+        The new deletion job; the latest one if it was deleted already, or None if it never existed.
+
+    """
+    now = datetime.now(tz=timezone.utc)
+    marked = db.execute(
+        update(model).where(model.id == target_id, model.deletion_time.is_(None)).values(deletion_time=now),
+    )
+    if not marked.rowcount:  # type: ignore[attr-defined]
+        return db.scalars(
+            select(models.DeletionJob)
+            .where(models.DeletionJob.target_id == target_id, models.DeletionJob.kind == kind)
+            .order_by(models.DeletionJob.creation_time.desc())
+            .limit(1),
+        ).first()
+
+    db_job = models.DeletionJob(kind=kind, target_id=target_id, requester_id=requester_id, creation_time=now)
+    db.add(db_job)
+    db.commit()
+    db.refresh(db_job)
+    return db_job
+
+
+def delete_room(db: Session, room_id: UUID, requester_id: UUID) -> models.DeletionJob | None:
+    """
+    Delete a room at once, leaving its messages and memberships to be purged by `purge_deletion_batch`.
+
+    Returns:
+        The deletion job, or None if the room never existed.
+
+    """
+    db_job = start_deletion(db, models.Room, DeletionKind.ROOM, room_id, requester_id)
+    public_rooms_cache.clear()
+    room_public_cache.invalidate(room_id)
+    recent_messages.invalidate(room_id)
+    # The entries of the room cannot be picked out, and rooms are seldom deleted
+    membership_cache.clear()
+    return db_job
+
+
+def read_user_rooms(
+    db: Session, user_id: UUID, after: UUID | None = None, limit: int | None = None, *, public_only: bool = False,
+) -> list[models.Room]:
+    """
+    Fetch a page of the rooms a user is a member of, ordered by room ID.
+
+    The memberships are read in order from the primary key of the link
+    table, which starts with the user ID, and joined to their rooms in the
+    same query.
+
+    Returns:
+        A list of room models, leaving out private rooms if `public_only` is set.
+
+    """
+    membership = models.users_in_rooms_table
+    query = (
+        db.query(models.Room)
+        .join(membership, membership.c.room_id == models.Room.id)
+        .filter(membership.c.user_id == user_id, models.Room.deletion_time.is_(None))
+    )
+    if public_only:
+        query = query.filter(models.Room.public == True)
+    if after is not None:
+        query = query.filter(membership.c.room_id > after)
+    return query.order_by(membership.c.room_id).limit(limit).all()
+
+
+def read_room_members(
+    db: Session, room_id: UUID, after: UUID | None = None, limit: int | None = None,
+) -> list[models.User]:
+    """
+    Fetch a page of the members of a room, ordered by user ID.
+
+    Returns:
+        A list of user models.
+
+    """
+    membership = models.users_in_rooms_table
+    query = (
+        db.query(models.User)
+        .join(membership, membership.c.user_id == models.User.id)
+        .filter(membership.c.room_id == room_id, models.User.deletion_time.is_(None))
+    )
+    if after is not None:
+        query = query.filter(membership.c.user_id > after)
+    return query.order_by(membership.c.user_id).limit(limit).all()
+
+
+def is_member(db: Session, room_id: UUID, user_id: UUID) -> bool:
+    """
+    Check whether a user is a member of a room.
+
+    Returns:
+        True if the user has joined the room.
+
+    """
+    membership = models.users_in_rooms_table
+    return db.execute(
+        select(membership.c.user_id).where(membership.c.user_id == user_id, membership.c.room_id == room_id),
+    ).first() is not None
+
+
+def read_members_among(db: Session, room_id: UUID, user_ids: Iterable[UUID]) -> set[UUID]:
+    """
+    Find out which of the given users are members of a room.
+
+    Returns:
+        The IDs of the users who have joined the room.
+
+    """
+    membership = models.users_in_rooms_table
+    return set(db.scalars(
+        select(membership.c.user_id).where(membership.c.room_id == room_id, membership.c.user_id.in_(set(user_ids))),
+    ))
+
+
+def read_room_public_cached(db: Session, room_id: UUID) -> bool | None:
+    """
+    Find out whether a room is public, from the cache if possible.
+
+    Returns:
+        True if the room is public, or None if it does not exist.
+
+    """
+    if (public := room_public_cache.get(room_id)) is not None:
+        return public
+
+    generation = room_public_cache.generation
+    row = db.execute(
+        select(models.Room.public).where(models.Room.id == room_id, models.Room.deletion_time.is_(None)),
+    ).first()
+    if row is None:
+        return None
+    room_public_cache.set(room_id, bool(row.public), generation=generation)
+    return bool(row.public)
+
+
+def read_access_level_cached(db: Session, user_id: UUID) -> AccessLevel | None:
+    """
+    Fetch the global access level of a user, from the cache if possible.
+
+    Returns:
+        The access level, or None if the user does not exist.
+
+    """
+    if (access_level := access_level_cache.get(user_id)) is not None:
+        return access_level
+
+    generation = access_level_cache.generation
+    row = db.execute(
+        select(models.User.global_access_level).where(models.User.id == user_id, models.User.deletion_time.is_(None)),
+    ).first()
+    if row is None:
+        return None
+    access_level = AccessLevel(row.global_access_level)
+    access_level_cache.set(user_id, access_level, generation=generation)
+    return access_level
+
+
+def read_posters(db: Session, room_id: UUID, user_ids: Iterable[UUID]) -> set[UUID] | None:
+    """
+    Find out which of the given users may post in a room.
+
+    Banned and deleted users may not post anywhere, and private rooms are
+    for their members only. Everything is cached, so with a warm cache this takes no
+    queries; memberships missing from the cache are looked up together.
+
+    Returns:
+        The IDs of the users who may post, or None if the room does not exist.
+
+    """
+    public = read_room_public_cached(db, room_id)
+    if public is None:
+        return None
+
+    allowed: set[UUID] = set()
+    unknown: list[UUID] = []
+    for user_id in set(user_ids):
+        if read_access_level_cached(db, user_id) in {None, AccessLevel.BANNED}:
+            continue
+        member = True if public else membership_cache.get((room_id, user_id))
+        if member is None:
+            unknown.append(user_id)
+        elif member:
+            allowed.add(user_id)
+
+    if unknown:
+        generation = membership_cache.generation
+        members = read_members_among(db, room_id, unknown)
+        for user_id in unknown:
+            membership_cache.set((room_id, user_id), user_id in members, generation=generation)
+        allowed |= members
+    return allowed
+
+
+def can_post(db: Session, room_id: UUID, user_id: UUID) -> bool | None:
+    """
+    Check whether a user may post in a room.
+
+    Returns:
+        Whether the user may post, or None if the room does not exist.
+
+    """
+    posters = read_posters(db, room_id, [user_id])
+    return None if posters is None else user_id in posters
+
+
+def can_read(db: Session, room_id: UUID, user_id: UUID) -> bool | None:
+    """
+    Check whether a user may read the messages and members of a room.
+
+    Public rooms are open to everyone, and private rooms to their members.
+    Cached like `read_posters`, so with a warm cache this takes no queries.
+
+    Returns:
+        Whether the user may read the room, or None if the room does not exist.
+
+    """
+    public = read_room_public_cached(db, room_id)
+    if public is None or public:
+        return public
+
+    member = membership_cache.get((room_id, user_id))
+    if member is None:
+        generation = membership_cache.generation
+        member = is_member(db, room_id, user_id)
+        membership_cache.set((room_id, user_id), member, generation=generation)
+    return member
+
+
+def add_member(db: Session, room_id: UUID, user_id: UUID) -> bool:
+    """
+    Make a user a member of a room.
+
+    Returns:
+        True if the user joined, False if they already were a member.
+
+    """
+    if is_member(db, room_id, user_id):
+        return False
+    db.execute(insert(models.users_in_rooms_table).values(user_id=user_id, room_id=room_id))
     db.commit()
+    membership_cache.invalidate((room_id, user_id))
+    return True
 
 
-def read_user(db: Session, user_id: UUID) -> models.User | None:
+def remove_member(db: Session, room_id: UUID, user_id: UUID) -> bool:
+    """
+    Remove a user from a room.
+
+    Returns:
+        True if the user was a member.
+
+    """
+    membership = models.users_in_rooms_table
+    result = db.execute(
+        delete(membership).where(membership.c.user_id == user_id, membership.c.room_id == room_id),
+    )
+    db.commit()
+    membership_cache.invalidate((room_id, user_id))
+    return result.rowcount > 0  # type: ignore[attr-defined]
+
+
+def read_user(db: Session, user_id: UUID, *, include_deleted: bool = False) -> models.User | None:
     """
     Get a user by the user ID.
 
     Returns:
-        User model, or None if not found.
+        User model, or None if not found, or deleted unless `include_deleted` is set.
 
     """
-    return db.query(models.User).filter(models.User.id == user_id).first()
+    query = db.query(models.User).filter(models.User.id == user_id)
+    if not include_deleted:
+        query = query.filter(models.User.deletion_time.is_(None))
+    return query.first()
 
 
-def read_user_by_email(db: Session, email: str) -> models.User | None:
+def read_user_by_email(db: Session, email: str, *, include_deleted: bool = False) -> models.User | None:
     """
     Get a user by the user email.
 
     Returns:
-        User model, or None if not found.
+        User model, or None if not found, or deleted unless `include_deleted` is set.
 
     """
-    return db.query(models.User).filter(models.User.email == email).first()
+    query = db.query(models.User).filter(models.User.email == email)
+    if not include_deleted:
+        query = query.filter(models.User.deletion_time.is_(None))
+    return query.first()
 
 
 def read_users(db: Session, skip: int = 0, limit: int | None = None) -> list[models.User]:
     """
-    Get all users.
+    Get all users that have not been deleted.
 
     Returns:
         A list of user models.
 
     """
-    return db.query(models.User).offset(skip).limit(limit).all()
+    return db.query(models.User).filter(models.User.deletion_time.is_(None)).offset(skip).limit(limit).all()
 
 
-def create_user(db: Session, user: schemas.UserCreate) -> models.User:
+def create_user(db: Session, user: schemas.UserCreate, password_hash: str) -> models.User:
     """
     Create a new user.
 
+    The password is hashed beforehand, see `security.hash_password`, so
+    the slow hashing does not take up a database thread.
+
     Returns:
         Newly created user model.
 
     """
-    fake_hashed_password = user.password.get_secret_value() + "generate_salt_here_and_hash"
     db_user = models.User(
         email=user.email,
         username=user.username,
-        password_hash=fake_hashed_password,
+        password_hash=password_hash,
     )
 
     db.add(db_user)
@@ -135,15 +523,175 @@ def read_message(db: Session, room_id: UUID, message_id: UUID) -> models.Message
     )
 
 
-def read_messages(db: Session, room_id: UUID, skip: int = 0, limit: int | None = None) -> list[models.Message]:
+def select_message_page(
+    entities: Sequence[Any],
+    room_id: UUID,
+    before: MessageCursor | None = None,
+    after: MessageCursor | None = None,
+    limit: int | None = None,
+) -> Select[Any]:
+    """
+    Build the query for a page of messages in a room, as described in `read_messages`.
+
+    Returns:
+        The query, newest first unless `after` is given.
+
+    """
+    sort_key = tuple_(models.Message.creation_time, models.Message.id)
+    statement = select(*entities).where(models.Message.room_id == room_id)
+
+    if before is not None:
+        statement = statement.where(sort_key < tuple(before))
+
+    if after is not None:
+        return (
+            statement
+            .where(sort_key > tuple(after))
+            .order_by(models.Message.creation_time, models.Message.id)
+            .limit(limit)
+        )
+
+    return (
+        statement
+        .order_by(models.Message.creation_time.desc(), models.Message.id.desc())
+        .limit(limit)
+    )
+
+
+def read_messages(
+    db: Session,
+    room_id: UUID,
+    before: MessageCursor | None = None,
+    after: MessageCursor | None = None,
+    limit: int | None = None,
+) -> list[models.Message]:
     """
-    Fetch all messages in a room.
+    Fetch a page of messages in a room, oldest first.
+
+    Messages are ordered by `(creation_time, id)`. Without `after`, the page
+    holds the newest messages older than `before` (or the newest overall);
+    with `after`, it holds the oldest messages newer than it. Either way
+    the lookup is a range scan on the messages index, so the cost of a page
+    does not depend on how deep into the history it is.
 
     Returns:
         List of message models.
 
     """
-    return db.query(models.Message).filter(models.Message.room_id == room_id).offset(skip).limit(limit).all()
+    messages = list(db.scalars(select_message_page([models.Message], room_id, before, after, limit)))
+    if after is None:
+        messages.reverse()
+    return messages
+
+
+def query_message_rows(
+    db: Session,
+    room_id: UUID,
+    before: MessageCursor | None = None,
+    after: MessageCursor | None = None,
+    limit: int | None = None,
+) -> list[MessageRow]:
+    """
+    Fetch a page of messages in a room like `read_messages`, as rows, from the database.
+
+    Returns:
+        List of rows, oldest first.
+
+    """
+    rows = list(starmap(MessageRow, db.execute(select_message_page(MESSAGE_COLUMNS, room_id, before, after, limit))))
+    if after is None:
+        rows.reverse()
+    return rows
+
+
+def read_message_rows(
+    db: Session,
+    room_id: UUID,
+    before: MessageCursor | None = None,
+    after: MessageCursor | None = None,
+    limit: int | None = None,
+) -> list[MessageRow]:
+    """
+    Fetch a page of messages in a room like `read_messages`, as plain rows.
+
+    The rows hold the columns `schemas.Message` shows, and nothing is added
+    to the session, so they are cheap to turn into JSON. The newest page,
+    and pages after a recent cursor, usually come from `recent_messages`;
+    the first read of a room loads its newest messages into it.
+
+    Returns:
+        List of rows, oldest first.
+
+    """
+    if before is not None or limit is None or limit > recent_messages.room_size:
+        return query_message_rows(db, room_id, before, after, limit)
+
+    if (rows := recent_messages.read(room_id, after, limit)) is not None:
+        return rows
+    if room_id not in recent_messages:
+        generation = recent_messages.generation(room_id)
+        recent_messages.fill(room_id, query_message_rows(db, room_id, limit=recent_messages.room_size), generation)
+        if (rows := recent_messages.peek(room_id, after, limit)) is not None:
+            return rows
+    # The cursor is older than the cached messages
+    return query_message_rows(db, room_id, after=after, limit=limit)
+
+
+def fts5_match(room_id: UUID, terms: str) -> str:
+    """
+    Build an SQLite FTS5 query for the messages of a room containing every word of `terms`.
+
+    Each word is quoted, so nothing the user typed is taken as query syntax.
+
+    Returns:
+        The query, for the MATCH operator.
+
+    """
+    phrases = " ".join('"' + term.replace('"', '""') + '"' for term in terms.split())
+    return f'room_id : "{room_id.hex}" AND message : ({phrases})'
+
+
+def search_messages(
+    db: Session, room_id: UUID, terms: str, limit: int | None = None, offset: int = 0,
+) -> list[models.Message]:
+    """
+    Find the messages of a room containing every word of `terms`, best match first.
+
+    SQLite ranks them with BM25 and PostgreSQL with `ts_rank`, using the
+    full-text index set up in `models`. Other databases get an unranked
+    substring search, newest first.
+
+    Returns:
+        List of message models.
+
+    """
+    if not terms.split():
+        return []
+    query = db.query(models.Message).filter(models.Message.room_id == room_id)
+
+    dialect = db.get_bind().dialect.name
+    if dialect == "sqlite":
+        query = (
+            query
+            .join(MESSAGES_FTS, MESSAGES_FTS.c.rowid == literal_column("messages.rowid"))
+            .filter(text("messages_fts MATCH :match").bindparams(match=fts5_match(room_id, terms)))
+            .order_by(MESSAGES_FTS.c.rank, models.Message.id)
+        )
+    elif dialect == "postgresql":
+        tsquery = func.websearch_to_tsquery(POSTGRESQL_SEARCH_CONFIG, terms)
+        search_vector = literal_column("messages.search_vector")
+        query = (
+            query
+            .filter(search_vector.op("@@")(tsquery))
+            .order_by(func.ts_rank(search_vector, tsquery).desc(), models.Message.id)
+        )
+    else:
+        query = (
+            query
+            .filter(*(models.Message.message.contains(term, autoescape=True) for term in terms.split()))
+            .order_by(models.Message.creation_time.desc(), models.Message.id)
+        )
+    return query.offset(offset).limit(limit).all()
 
 
 def create_message(db: Session, message: schemas.Message, room_id: UUID) -> models.Message:
@@ -159,9 +707,58 @@ def create_message(db: Session, message: schemas.Message, room_id: UUID) -> mode
     db.add(db_message)
     db.commit()
     db.refresh(db_message)
+    recent_messages.add(room_id, [message_row(db_message)])
     return db_message
 
 
+def create_messages(db: Session, messages: Sequence[tuple[UUID, schemas.Message]]) -> list[bool]:
+    """
+    Create many messages, possibly in different rooms, in a single transaction.
+
+    The rows are bulk inserted, and only read back where the database can
+    return them from the insert, to add them to `recent_messages` as stored;
+    eg. a time zone given by the client is not. Messages whose ID already
+    exists, either in the database or earlier in the batch, are skipped.
+
+    Returns:
+        Whether each message was created, in the order given.
+
+    """
+    message_ids = [message.id for _, message in messages]
+    seen = {
+        message_id
+        for (message_id,) in db.query(models.Message.id).filter(models.Message.id.in_(message_ids))
+    }
+
+    created: list[bool] = []
+    rows: list[dict[str, object]] = []
+    for room_id, message in messages:
+        if message.id in seen:
+            created.append(False)
+            continue
+        seen.add(message.id)
+        created.append(True)
+        rows.append({**message.dict(), "room_id": room_id})
+
+    stored: list[tuple[UUID, MessageRow]] = []
+    if rows and db.get_bind().dialect.insert_executemany_returning:
+        statement = insert(models.Message).returning(models.Message.room_id, *MESSAGE_COLUMNS)
+        stored = [(room_id, MessageRow(*columns)) for room_id, *columns in db.execute(statement, rows)]
+    elif rows:
+        db.execute(insert(models.Message), rows)
+    db.commit()
+
+    rooms: dict[UUID, list[MessageRow]] = {}
+    for room_id, row in stored:
+        rooms.setdefault(room_id, []).append(row)
+    for room_id, room_rows in rooms.items():
+        recent_messages.add(room_id, room_rows)
+    if not stored:
+        for room_id in {row["room_id"] for row in rows}:
+            recent_messages.invalidate(room_id)
+    return created
+
+
 def update_message(db: Session, message: schemas.Message, room_id: UUID) -> models.Message:
     """
     Update a message.
@@ -182,12 +779,23 @@ def update_message(db: Session, message: schemas.Message, room_id: UUID) -> mode
         })
     )
     db.commit()
-    return read_message(db, room_id=room_id, message_id=message.id)  # type: ignore[return-value]
+    db_message = read_message(db, room_id=room_id, message_id=message.id)
+    if db_message is None:
+        recent_messages.invalidate(room_id)
+    else:
+        recent_messages.replace(room_id, message_row(db_message))
+    return db_message  # type: ignore[return-value]
 
 
-def delete_message(db: Session, room_id: UUID, message_id: UUID) -> None:
-    """Delete a message."""
-    (
+def delete_message(db: Session, room_id: UUID, message_id: UUID) -> bool:
+    """
+    Delete a message.
+
+    Returns:
+        True if the message existed, otherwise False.
+
+    """
+    deleted = (
         db.query(models.Message)
         .filter(
             models.Message.id == message_id,
@@ -196,6 +804,8 @@ def delete_message(db: Session, room_id: UUID, message_id: UUID) -> None:
         .delete()
     )
     db.commit()
+    recent_messages.remove(room_id, message_id)
+    return deleted > 0
 
 
 def update_user(db: Session, user: schemas.User) -> models.User:
@@ -217,16 +827,127 @@ def update_user(db: Session, user: schemas.User) -> models.User:
         })
     )
     db.commit()
+    access_level_cache.invalidate(user.id)
     return read_user(db, user_id=user.id)  # type: ignore[return-value]
 
 
-def delete_user(db: Session, user_id: UUID) -> None:
-    """Delete a user."""
-    (
-        db.query(models.User)
-        .filter(
-            models.User.id == user_id,
-        )
-        .delete()
-    )
+def update_password_hash(db: Session, user_id: UUID, password_hash: str) -> None:
+    """Replace the password hash of a user."""
+    db.query(models.User).filter(models.User.id == user_id).update({"password_hash": password_hash})
+    db.commit()
+
+
+def delete_user(db: Session, user_id: UUID) -> models.DeletionJob | None:
+    """
+    Delete a user at once, leaving their messages and memberships to be purged by `purge_deletion_batch`.
+
+    Returns:
+        The deletion job, or None if the user never existed.
+
+    """
+    db_job = start_deletion(db, models.User, DeletionKind.USER, user_id, user_id)
+    access_level_cache.invalidate(user_id)
+    membership_cache.clear()
+    return db_job
+
+
+def read_deletion_job(db: Session, job_id: UUID) -> models.DeletionJob | None:
+    """
+    Fetch a deletion job.
+
+    Returns:
+        The job model, or None if not found.
+
+    """
+    return db.get(models.DeletionJob, job_id)
+
+
+def read_pending_deletions(db: Session) -> list[UUID]:
+    """
+    Find the deletions whose purge has not finished.
+
+    Returns:
+        The job IDs, oldest first.
+
+    """
+    return list(db.scalars(
+        select(models.DeletionJob.id)
+        .where(models.DeletionJob.status == DeletionStatus.PENDING)
+        .order_by(models.DeletionJob.creation_time),
+    ))
+
+
+def purge_deletion_batch(db: Session, job_id: UUID, batch_size: int = DELETION_BATCH_SIZE) -> bool:
+    """
+    Delete the next batch of what a deleted room or user left behind, in a transaction of its own.
+
+    Messages go first, then memberships, and the room or user itself once
+    nothing is left. Each batch is a few indexed statements touching at most
+    `batch_size` rows, so the database is never held for long; purging the
+    same job in several workers at once only wastes some effort.
+
+    Returns:
+        True once the purge has finished, or if there is no such job.
+
+    """
+    db_job = read_deletion_job(db, job_id)
+    if db_job is None or db_job.status == DeletionStatus.DONE:
+        return True
+
+    target_id = db_job.target_id
+    membership = models.users_in_rooms_table
+    if db_job.kind == DeletionKind.ROOM:
+        model: type[models.Room | models.User] = models.Room
+        owner, member, other = models.Message.room_id, membership.c.room_id, membership.c.user_id
+    else:
+        model = models.User
+        owner, member, other = models.Message.user_id, membership.c.user_id, membership.c.room_id
+    job = update(models.DeletionJob).where(models.DeletionJob.id == job_id)
+
+    messages = db.execute(
+        select(models.Message.id, models.Message.room_id).where(owner == target_id).limit(batch_size),
+    ).all()
+    if messages:
+        db.execute(delete(models.Message).where(models.Message.id.in_([message_id for message_id, _ in messages])))
+        db.execute(job.values(messages_deleted=models.DeletionJob.messages_deleted + len(messages)))
+        db.commit()
+        for room_id in {room_id for _, room_id in messages}:
+            recent_messages.invalidate(room_id)
+        return False
+
+    others = list(db.scalars(select(other).where(member == target_id).limit(batch_size)))
+    if others:
+        db.execute(delete(membership).where(member == target_id, other.in_(others)))
+        db.execute(job.values(memberships_deleted=models.DeletionJob.memberships_deleted + len(others)))
+        db.commit()
+        return False
+
+    db.execute(delete(model).where(model.id == target_id))
+    db.execute(job.values(status=DeletionStatus.DONE, completion_time=datetime.now(tz=timezone.utc)))
+    db.commit()
+    logger.info("Finished purging deleted %s %s", db_job.kind, target_id)
+    return True
+
+
+def revoke_token(db: Session, token_id: str, expires: int) -> None:
+    """Record that an access token may no longer be used, although it has not expired."""
+    db.merge(models.RevokedToken(id=token_id, expires=expires))
+    db.commit()
+
+
+def read_revoked_tokens(db: Session, now: int) -> list[tuple[str, int]]:
+    """
+    Fetch the revoked access tokens that have not expired yet.
+
+    Returns:
+        The ID and expiry time of each token.
+
+    """
+    query = select(models.RevokedToken.id, models.RevokedToken.expires).where(models.RevokedToken.expires > now)
+    return [(token_id, expires) for token_id, expires in db.execute(query)]
+
+
+def delete_expired_revocations(db: Session, now: int) -> None:
+    """Forget the revoked access tokens that have expired anyway."""
+    db.execute(delete(models.RevokedToken).where(models.RevokedToken.expires <= now))
     db.commit()
@@ -2,30 +2,113 @@
 
 from __future__ import annotations
 
-from typing import TYPE_CHECKING
+import logging
+from functools import partial
+from typing import TYPE_CHECKING, ParamSpec, TypeVar
 
-from sqlalchemy import create_engine
+import anyio
+import anyio.to_thread
+from anyio import CapacityLimiter
+from sqlalchemy import create_engine, event, make_url
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import StaticPool
 
 from eguivalet_server.config import (
-    SQLALCHEMY_DATABASE_URL,
+    DATABASE_THREAD_POOL_SIZE,
+    SQLITE_MAINTENANCE_INTERVAL,
+    SQLITE_PRAGMA_PROFILES,
+    SQLITE_PROFILE,
+    Settings,
+    settings,
 )
+from eguivalet_server.metrics import track_db_call
 
 if TYPE_CHECKING:
-    from collections.abc import Generator
+    from collections.abc import Callable, Generator
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL,
-    connect_args={
-        "check_same_thread": False,
-    },
-)
+    from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+P = ParamSpec("P")
+T = TypeVar("T")
+
+
+def create_database_engine(config: Settings) -> Engine:
+    """
+    Create an engine with a connection pool suited to the database backend.
+
+    Returns:
+        A database engine.
+
+    """
+    url = make_url(config.database_url)
+    pool_options: dict[str, object] = {
+        "pool_size": config.database_pool_size,
+        "max_overflow": config.database_max_overflow,
+        "pool_timeout": config.database_pool_timeout,
+    }
+
+    if url.get_backend_name() == "sqlite":
+        connect_args = {
+            "check_same_thread": False,
+        }
+        if url.database in {None, "", ":memory:"}:
+            # Every new connection would get an empty database of its own
+            return create_engine(url, connect_args=connect_args, poolclass=StaticPool)
+        return create_engine(url, connect_args=connect_args, **pool_options)
+
+    server_connect_args: dict[str, str] = {}
+    if url.get_backend_name() == "postgresql" and config.database_statement_timeout:
+        server_connect_args["options"] = f"-c statement_timeout={config.database_statement_timeout}"
+
+    return create_engine(
+        url,
+        connect_args=server_connect_args,
+        pool_recycle=config.database_pool_recycle,
+        # Connections to a database server can be dropped behind our back
+        pool_pre_ping=True,
+        **pool_options,
+    )
+
+
+engine = create_database_engine(settings)
+
+
+def configure_sqlite(sqlite_engine: Engine, profile: str) -> bool:
+    """
+    Apply a profile of SQLite settings to every connection the engine opens.
+
+    Returns:
+        True if the profile changes anything.
+
+    """
+    pragmas = SQLITE_PRAGMA_PROFILES[profile]
+    if sqlite_engine.dialect.name != "sqlite" or not pragmas:
+        return False
+
+    @event.listens_for(sqlite_engine, "connect")
+    def set_pragmas(dbapi_connection: object, _connection_record: object) -> None:
+        cursor = dbapi_connection.cursor()  # type: ignore[attr-defined]
+        try:
+            for name, value in pragmas.items():
+                cursor.execute(f"PRAGMA {name} = {value}")
+        finally:
+            cursor.close()
+
+    logger.info("Using the %s SQLite profile", profile)
+    return True
+
+
+sqlite_tuned = configure_sqlite(engine, SQLITE_PROFILE)
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
 
+db_thread_limiter = CapacityLimiter(DATABASE_THREAD_POOL_SIZE)
+
 
 def get_db() -> Generator[Session, None, None]:
     """
@@ -40,3 +123,37 @@ def get_db() -> Generator[Session, None, None]:
         yield db_session
     finally:
         db_session.close()
+
+
+async def run_in_db_pool(func: Callable[P, T], *args: P.args, **kwargs: P.kwargs) -> T:
+    """
+    Run a blocking database call in the bounded database thread pool.
+
+    The event loop keeps serving other requests while the call runs, and at most
+    `DATABASE_THREAD_POOL_SIZE` calls hit the database at the same time. The
+    call is timed for the metrics, under the name of the function.
+
+    Returns:
+        Whatever the given function returns.
+
+    """
+    with track_db_call(func):
+        return await anyio.to_thread.run_sync(partial(func, *args, **kwargs), limiter=db_thread_limiter)
+
+
+def run_sqlite_maintenance(sqlite_engine: Engine) -> None:
+    """Fold the write-ahead log back into the database and refresh the query planner statistics."""
+    with sqlite_engine.connect() as connection:
+        # PASSIVE never waits for readers or blocks writers
+        connection.exec_driver_sql("PRAGMA wal_checkpoint(PASSIVE)")
+        connection.exec_driver_sql("PRAGMA optimize")
+
+
+async def sqlite_maintenance_loop(sqlite_engine: Engine, interval: float = SQLITE_MAINTENANCE_INTERVAL) -> None:
+    """Run SQLite maintenance periodically until cancelled."""
+    while True:
+        await anyio.sleep(interval)
+        try:
+            await run_in_db_pool(run_sqlite_maintenance, sqlite_engine)
+        except Exception:
+            logger.exception("SQLite maintenance failed")
@@ -0,0 +1,247 @@
+"""Starts the server, either as a pool of production workers or for development."""
+
+from __future__ import annotations
+
+import argparse
+import logging
+import os
+import secrets
+import socket
+import sys
+import tempfile
+from contextlib import contextmanager, suppress
+from typing import TYPE_CHECKING
+
+import uvicorn
+from anyio.from_thread import start_blocking_portal
+from uvicorn.supervisors import ChangeReload, Multiprocess
+
+from eguivalet_server import models
+from eguivalet_server.broker import BrokerHub
+from eguivalet_server.config import PROJECT_DIR, settings
+from eguivalet_server.database import engine
+from eguivalet_server.logger import logging_pipeline
+
+if TYPE_CHECKING:
+    from collections.abc import Generator, Sequence
+
+logger = logging.getLogger(__name__)
+
+APP = "eguivalet_server.main:app"
+TOKEN_SECRET_VARIABLE = "EGUIVALET_TOKEN_SECRET"  # ruff:ignore[hardcoded-password-string]
+EVENT_BROKER_VARIABLE = "EGUIVALET_EVENT_BROKER"
+EVENT_BROKER_SOCKET_VARIABLE = "EGUIVALET_EVENT_BROKER_SOCKET"
+DATABASE_READY_VARIABLE = "EGUIVALET_DATABASE_READY"
+
+
+def default_workers() -> int:
+    """
+    Work out how many server processes to run when none was configured.
+
+    Returns:
+        The number of CPUs this process may run on.
+
+    """
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def parse_args(argv: Sequence[str] | None = None) -> argparse.Namespace:
+    """
+    Read the command line options, falling back to the deployment settings.
+
+    Returns:
+        The parsed options.
+
+    """
+    parser = argparse.ArgumentParser(prog="eguivalet_server", description="Run the EguiValet messaging server.")
+    parser.add_argument("--host", default=settings.host, help="address to listen on (default: %(default)s)")
+    parser.add_argument("--port", type=int, default=settings.port, help="port to listen on (default: %(default)s)")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=settings.workers or default_workers(),
+        help="number of server processes (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--reload",
+        action="store_true",
+        help="development mode; a single process that restarts whenever the code changes",
+    )
+    parser.add_argument(
+        "--rebuild-search-index",
+        action="store_true",
+        help="create or rebuild the message search index from the existing messages, then exit",
+    )
+    args = parser.parse_args(argv)
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    return args
+
+
+def build_config(args: argparse.Namespace) -> uvicorn.Config:
+    """
+    Create the Uvicorn configuration for the given options.
+
+    uvloop and httptools are used when they are installed, and shutting down
+    stops accepting connections before giving open requests time to finish.
+
+    Returns:
+        The server configuration.
+
+    """
+    return uvicorn.Config(
+        APP,
+        host=args.host,
+        port=args.port,
+        workers=1 if args.reload else args.workers,
+        reload=args.reload,
+        reload_dirs=[str(PROJECT_DIR)] if args.reload else None,
+        loop="auto",
+        http="auto",
+        backlog=settings.backlog,
+        timeout_keep_alive=int(settings.keep_alive_timeout),
+        timeout_graceful_shutdown=int(settings.graceful_shutdown_timeout),
+        log_level=logging.INFO,
+        # The workers set up logging when they import the app
+        log_config=None,
+        use_colors=args.reload,
+    )
+
+
+def bind_socket(host: str, port: int, backlog: int) -> socket.socket:
+    """
+    Open the listening socket shared by every worker.
+
+    SO_REUSEPORT lets a replacement server bind the same port while the old
+    one is still draining its connections, so restarts drop no requests.
+
+    Returns:
+        The bound, listening socket.
+
+    """
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if hasattr(socket, "SO_REUSEPORT"):
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def initialise_database() -> None:
+    """Create missing tables once, so the workers do not race each other to do it."""
+    logger.info("Initialising database")
+    models.Base.metadata.create_all(bind=engine)
+    engine.dispose()
+    # Tells the workers they need not do it themselves
+    os.environ[DATABASE_READY_VARIABLE] = "1"
+
+
+def rebuild_search_index() -> bool:
+    """
+    Rebuild the message search index from the messages, to repair it.
+
+    Returns:
+        False if the database has no full-text search this project supports.
+
+    """
+    logger.info("Rebuilding the message search index")
+    with engine.begin() as connection:
+        rebuilt = models.rebuild_search_index(connection)
+    engine.dispose()
+    if not rebuilt:
+        logger.error("The %s database has no supported full-text search", engine.dialect.name)
+    return rebuilt
+
+
+def share_token_secret() -> None:
+    """Give every worker the same token secret, making one up for this run if none was configured."""
+    if settings.token_secret is None and TOKEN_SECRET_VARIABLE not in os.environ:
+        logger.warning("No token secret configured; access tokens will not outlive this run")
+        # The workers read their settings from the environment they inherit
+        os.environ[TOKEN_SECRET_VARIABLE] = secrets.token_urlsafe(32)
+
+
+def share_event_broker(workers: int) -> str | None:
+    """
+    Tell every worker how to pass room events to the others.
+
+    Unless another broker was configured, several workers use a Unix socket
+    broker, run by this process, and a single worker needs none.
+
+    Returns:
+        The path of the Unix socket broker to run, if there is one.
+
+    """
+    broker = settings.event_broker or ("unix" if workers > 1 else "local")
+    os.environ[EVENT_BROKER_VARIABLE] = broker
+    if broker != "unix":
+        return None
+    path = settings.event_broker_socket or os.path.join(tempfile.gettempdir(), f"eguivalet-{os.getpid()}.sock")  # ruff:ignore[os-path-join]
+    os.environ[EVENT_BROKER_SOCKET_VARIABLE] = path
+    return path
+
+
+@contextmanager
+def running_broker_hub(path: str | None) -> Generator[None, None, None]:
+    """Run a Unix socket broker for the workers, in a thread of this process, for the duration of the context."""
+    if path is None:
+        yield
+        return
+    with start_blocking_portal() as portal:
+        hub, _ = portal.start_task(BrokerHub().serve, path)
+        try:
+            yield
+        finally:
+            hub.cancel()
+            with suppress(FileNotFoundError):
+                os.unlink(path)  # ruff:ignore[os-unlink]
+
+
+def serve(config: uvicorn.Config, sock: socket.socket) -> bool:
+    """
+    Serve on the socket until a shutdown signal arrives.
+
+    Returns:
+        False if a single-process server failed to start.
+
+    """
+    server = uvicorn.Server(config)
+    with suppress(KeyboardInterrupt):
+        if config.should_reload:
+            ChangeReload(config, target=server.run, sockets=[sock]).run()
+        elif config.workers > 1:
+            # The supervisor restarts crashed workers and passes SIGTERM on,
+            # letting each one drain its connections
+            Multiprocess(config, sockets=[sock]).run()
+        else:
+            server.run(sockets=[sock])
+            return server.started
+    return True
+
+
+def main(argv: Sequence[str] | None = None) -> None:
+    """Run the server until it is told to stop."""
+    logging_pipeline.start()
+    args = parse_args(argv)
+    config = build_config(args)
+    initialise_database()
+    if args.rebuild_search_index:
+        sys.exit(0 if rebuild_search_index() else 1)
+    share_token_secret()
+    broker_socket = share_event_broker(config.workers)
+
+    sock = bind_socket(config.host, config.port, config.backlog)
+    logger.info("Listening on %s:%d with %d worker(s)", config.host, sock.getsockname()[1], config.workers)
+    try:
+        with running_broker_hub(broker_socket):
+            started = serve(config, sock)
+    finally:
+        sock.close()
+
+    if not started:
+        sys.exit(1)
@@ -0,0 +1,237 @@
+"""Sets up logging that stays off the request path: records are queued, and written by a background thread."""
+
+from __future__ import annotations
+
+import atexit
+import itertools
+import json
+import logging
+import logging.config
+import queue
+import uuid
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import TYPE_CHECKING
+
+from starlette.datastructures import MutableHeaders
+
+from eguivalet_server.config import (
+    LOG_CONFIG,
+    LOG_QUEUE_SIZE,
+    LOG_REDACTED_LOGGERS,
+    LOG_REDACTED_REGEX,
+    LOG_SAMPLE_RATE,
+    LOG_SAMPLED_MESSAGES,
+    REQUEST_ID_HEADER,
+    REQUEST_ID_REGEX,
+)
+
+if TYPE_CHECKING:
+    import re
+    from collections.abc import Iterable
+    from pathlib import Path
+
+    from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+logger = logging.getLogger(__name__)
+
+# The ID of the request being handled, included in every record logged while handling it
+request_id: ContextVar[str | None] = ContextVar("request_id", default=None)
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats records as single-line JSON objects."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        """
+        Format a record.
+
+        Returns:
+            The record as a JSON object.
+
+        """
+        entry: dict[str, object] = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "process": record.process,
+        }
+        if getattr(record, "request_id", None) is not None:
+            entry["request_id"] = record.request_id
+        if getattr(record, "sample_rate", None) is not None:
+            entry["sample_rate"] = record.sample_rate
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class RequestIdFilter(logging.Filter):
+    """Tags records with the ID of the request they were logged for."""
+
+    def filter(self, record: logging.LogRecord) -> bool:  # ruff:ignore[no-self-use]
+        """
+        Tag a record.
+
+        Returns:
+            True, as no records are dropped.
+
+        """
+        record.request_id = request_id.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps only a fraction of the given high-frequency messages, and every other message."""
+
+    def __init__(self, messages: Iterable[str], rate: float) -> None:
+        """Keep `rate` of the records whose unformatted message is one of `messages`."""
+        super().__init__()
+        self.rate = rate
+        self.every = round(1 / rate) if rate > 0 else 0
+        self._counters = {message: itertools.count() for message in messages}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        """
+        Decide whether to keep a record; the first of each message is always kept.
+
+        Returns:
+            True if the record should be logged.
+
+        """
+        counter = self._counters.get(record.msg) if isinstance(record.msg, str) else None
+        if counter is None:
+            return True
+        if not self.every or next(counter) % self.every:
+            return False
+        record.sample_rate = self.rate
+        return True
+
+
+class RedactingFilter(logging.Filter):
+    """Hides the secrets in messages, such as access tokens in logged URLs."""
+
+    def __init__(self, pattern: re.Pattern[str] = LOG_REDACTED_REGEX) -> None:
+        """Replace whatever matches `pattern`."""
+        super().__init__()
+        self.pattern = pattern
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        """
+        Redact a record.
+
+        Returns:
+            True, as no records are dropped.
+
+        """
+        message = record.getMessage()
+        redacted = self.pattern.sub("[redacted]", message)
+        if redacted != message:
+            record.msg = redacted
+            record.args = None
+        return True
+
+
+class DroppingQueueHandler(QueueHandler):
+    """Queues records for the listener thread, dropping them rather than waiting when the queue is full."""
+
+    def __init__(self, log_queue: queue.Queue[logging.LogRecord]) -> None:
+        """Queue records onto `log_queue`."""
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:  # ruff:ignore[no-self-use]
+        """
+        Merge the message with its arguments, leaving the rest of the formatting to the listener thread.
+
+        Returns:
+            The record.
+
+        """
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        """Queue a record, unless the queue is full."""
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class LoggingPipeline:
+    """Moves the log handlers from `logging.conf` behind a queue."""
+
+    def __init__(self) -> None:
+        """Create a pipeline; nothing changes until it is started."""
+        self.handler: DroppingQueueHandler | None = None
+        self.listener: QueueListener | None = None
+
+    def start(self, config_file: Path = LOG_CONFIG) -> None:
+        """Configure logging from the file, and hand its root handlers to a background thread."""
+        if self.listener is not None:
+            return
+        logging.config.fileConfig(config_file, disable_existing_loggers=False)
+
+        logging.logMultiprocessing = False
+
+        root = logging.getLogger()
+        log_queue: queue.Queue[logging.LogRecord] = queue.Queue(LOG_QUEUE_SIZE)
+        self.handler = DroppingQueueHandler(log_queue)
+        # Handler filters run in the thread doing the logging, where the request ID is still known
+        self.handler.addFilter(RequestIdFilter())
+        self.listener = QueueListener(log_queue, *root.handlers, respect_handler_level=True)
+        root.handlers = [self.handler]
+
+        for name, messages in LOG_SAMPLED_MESSAGES.items():
+            logging.getLogger(name).addFilter(SamplingFilter(messages, LOG_SAMPLE_RATE))
+        for name in LOG_REDACTED_LOGGERS:
+            logging.getLogger(name).addFilter(RedactingFilter())
+
+        self.listener.start()
+        atexit.register(self.stop)
+
+    def stop(self) -> None:
+        """Write out the queued records and stop the background thread."""
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+
+    @property
+    def dropped(self) -> int:
+        """The number of records dropped because the queue was full."""
+        return 0 if self.handler is None else self.handler.dropped
+
+
+logging_pipeline = LoggingPipeline()
+
+
+class RequestIdMiddleware:
+    """Gives every request an ID, used in its log records and returned in a response header."""
+
+    def __init__(self, app: ASGIApp) -> None:
+        """Wrap an ASGI application."""
+        self.app = app
+        self.header = REQUEST_ID_HEADER.lower().encode()
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        """Serve a request under the ID the client sent, or a new one."""
+        if scope["type"] not in {"http", "websocket"}:
+            await self.app(scope, receive, send)
+            return
+
+        sent = next((value.decode("latin-1") for name, value in scope["headers"] if name == self.header), "")
+        current = sent if REQUEST_ID_REGEX.match(sent) else uuid.uuid4().hex
+
+        async def send_with_id(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                MutableHeaders(scope=message).append(REQUEST_ID_HEADER, current)
+            await send(message)
+
+        token = request_id.set(current)
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            request_id.reset(token)
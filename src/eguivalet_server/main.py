@@ -1,53 +1,122 @@
 """Launches the messaging service."""
 
+from __future__ import annotations
+
+import asyncio
 import logging
-import logging.config
-import sys
+import os
+from contextlib import asynccontextmanager
+from typing import TYPE_CHECKING
 
 import tomli
-import uvicorn
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.openapi.utils import get_openapi
 
-from eguivalet_server import models
+from eguivalet_server import crud
+from eguivalet_server.auth import revocation_sync_loop
+from eguivalet_server.broadcast import room_broadcaster
+from eguivalet_server.coalescer import message_writer
 from eguivalet_server.config import (
-    HOST,
-    LOG_CONFIG,
-    PORT,
+    METRICS_ENABLED,
+    NEXT_CURSOR_HEADER,
+    NEXT_OFFSET_HEADER,
     PYPROJECT_TOML,
+    REQUEST_ID_HEADER,
 )
-from eguivalet_server.database import engine
+from eguivalet_server.database import db_thread_limiter, engine, sqlite_maintenance_loop, sqlite_tuned
+from eguivalet_server.launcher import DATABASE_READY_VARIABLE, initialise_database
+from eguivalet_server.logger import RequestIdMiddleware, logging_pipeline
+from eguivalet_server.metrics import CallbackCounter, CallbackGauge, MetricsMiddleware, instrument_engine, registry
 from eguivalet_server.openapi_extension import add_examples
+from eguivalet_server.purger import purger
+from eguivalet_server.query_monitor import QueryMonitorMiddleware, query_monitor
 from eguivalet_server.routes import router
+from eguivalet_server.routes.api.v1.rooms import receive_room_event
+
+if TYPE_CHECKING:
+    from collections.abc import AsyncGenerator
 
 project_metadata = tomli.loads(PYPROJECT_TOML.read_text())
 
 
 # Setup loggers
-logging.config.fileConfig(LOG_CONFIG, disable_existing_loggers=False)
+logging_pipeline.start()
 logger = logging.getLogger(__name__)
 
-if "pytest" not in sys.modules:
-    # Initialise the main database
-    logger.info("Initialising database")
-    models.Base.metadata.create_all(bind=engine)
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI) -> AsyncGenerator[None, None]:
+    """Run background services for as long as the server is up."""
+    if not os.environ.get(DATABASE_READY_VARIABLE):
+        # Served directly, eg. by `uvicorn eguivalet_server.main:app`, rather than by the launcher
+        await asyncio.to_thread(initialise_database)
+    maintenance = asyncio.create_task(sqlite_maintenance_loop(engine)) if sqlite_tuned else None
+    revocation_sync = asyncio.create_task(revocation_sync_loop())
+    broker = room_broadcaster.broker
+    room_events = asyncio.create_task(broker.run(receive_room_event)) if broker is not None else None
+    purge = asyncio.create_task(purger.run())
+    try:
+        yield
+    finally:
+        if maintenance is not None:
+            maintenance.cancel()
+        if room_events is not None:
+            room_events.cancel()
+        revocation_sync.cancel()
+        purge.cancel()
+        # Don't leave anyone waiting for a commit that never comes
+        await message_writer.close()
+
 
 app = FastAPI(
+    lifespan=lifespan,
     swagger_ui_parameters={
         "filter": True,
         "syntaxHighlight.theme": "arta",
     },
 )
 
+app.add_middleware(RequestIdMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
     allow_credentials=True,
     allow_methods=["GET", "POST", "PUT", "DELETE"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER, NEXT_OFFSET_HEADER, REQUEST_ID_HEADER],
 )
 
+query_monitor.instrument(engine)
+app.add_middleware(QueryMonitorMiddleware, monitor=query_monitor)
+
+if METRICS_ENABLED:
+    # Added last, so it is the outermost middleware and times everything else
+    app.add_middleware(MetricsMiddleware)
+    instrument_engine(engine)
+    registry.register(CallbackGauge(
+        "db_threads_busy",
+        "Database calls currently running in the database thread pool.",
+        lambda: db_thread_limiter.borrowed_tokens,
+    ))
+    registry.register(CallbackGauge(
+        "log_records_dropped",
+        "Log records dropped because the logging thread fell behind.",
+        lambda: logging_pipeline.dropped,
+    ))
+    registry.register(CallbackCounter(
+        "cache_hits_total",
+        "Lookups answered by a process-local cache.",
+        ("cache",),
+        lambda: {(name,): cache.hits for name, cache in crud.CACHES.items()},
+    ))
+    registry.register(CallbackCounter(
+        "cache_misses_total",
+        "Lookups a process-local cache could not answer.",
+        ("cache",),
+        lambda: {(name,): cache.misses for name, cache in crud.CACHES.items()},
+    ))
+
 app.include_router(router)
 
 
@@ -82,12 +151,6 @@ def custom_openapi() -> dict[str, object]:
 app.openapi = custom_openapi  # type: ignore[method-assign]
 
 if __name__ == "__main__":
-    uvicorn.run(
-        "main:app",
-        host=HOST,
-        port=PORT,
-        reload=True,
-        log_level=logging.INFO,
-        log_config=str(LOG_CONFIG),
-        use_colors=True,
-    )
+    from eguivalet_server.launcher import main
+
+    main()
@@ -0,0 +1,417 @@
+"""Collects runtime metrics and exposes them in the Prometheus text format."""
+
+from __future__ import annotations
+
+import bisect
+import math
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import TYPE_CHECKING
+
+from sqlalchemy import event
+
+from eguivalet_server.config import METRICS_LATENCY_BUCKETS
+
+if TYPE_CHECKING:
+    from collections.abc import Callable, Generator, Iterable, Mapping, Sequence
+
+    from sqlalchemy.engine import Connection, Engine, ExceptionContext
+    from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def format_value(value: float) -> str:
+    """
+    Format a sample value the way Prometheus expects.
+
+    Returns:
+        The formatted value.
+
+    """
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+def format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    """
+    Format a label set, escaping the values.
+
+    Returns:
+        The label set in braces, or an empty string if there are no labels.
+
+    """
+    if not names:
+        return ""
+    pairs = (
+        '{}="{}"'.format(name, value.replace("\\", r"\\").replace('"', r"\"").replace("\n", r"\n"))
+        for name, value in zip(names, values, strict=True)
+    )
+    return "{" + ",".join(pairs) + "}"
+
+
+class Metric(ABC):
+    """Base class for metrics, holding one value per combination of label values."""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()) -> None:
+        """Create a metric; it only shows up once it has been registered."""
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+
+    @abstractmethod
+    def samples(self) -> Iterable[tuple[str, Sequence[str], Sequence[str], float]]:
+        """
+        List the current samples of the metric.
+
+        Returns:
+            Tuples of sample name, label names, label values and value.
+
+        """
+
+    def render(self) -> list[str]:
+        """
+        Render the metric in the Prometheus text format.
+
+        Returns:
+            The lines describing the metric.
+
+        """
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(
+            f"{name}{format_labels(label_names, label_values)} {format_value(value)}"
+            for name, label_names, label_values, value in self.samples()
+        )
+        return lines
+
+
+class Counter(Metric):
+    """A value that only ever goes up, such as the number of requests served."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()) -> None:
+        """Create a counter starting from zero."""
+        super().__init__(name, documentation, labels)
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, *label_values: str, amount: float = 1.0) -> None:
+        """Increase the counter of the given label values."""
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0.0) + amount
+
+    def value(self, *label_values: str) -> float:
+        """
+        Read the counter of the given label values.
+
+        Returns:
+            The current count.
+
+        """
+        with self._lock:
+            return self._values.get(label_values, 0.0)
+
+    def samples(self) -> Iterable[tuple[str, Sequence[str], Sequence[str], float]]:
+        """
+        List the counts of every label combination seen so far.
+
+        Returns:
+            Tuples of sample name, label names, label values and value.
+
+        """
+        with self._lock:
+            return [(self.name, self.labels, values, count) for values, count in sorted(self._values.items())]
+
+
+class Gauge(Counter):
+    """A value that can go up and down, such as the number of requests in progress."""
+
+    kind = "gauge"
+
+    def dec(self, *label_values: str, amount: float = 1.0) -> None:
+        """Decrease the gauge of the given label values."""
+        self.inc(*label_values, amount=-amount)
+
+    def set(self, value: float, *label_values: str) -> None:
+        """Replace the gauge of the given label values."""
+        with self._lock:
+            self._values[label_values] = value
+
+
+class CallbackGauge(Metric):
+    """A gauge whose value is read from somewhere else whenever it is scraped."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, callback: Callable[[], float | None]) -> None:
+        """Create a gauge reporting whatever `callback` returns; None hides it."""
+        super().__init__(name, documentation)
+        self.callback = callback
+
+    def samples(self) -> Iterable[tuple[str, Sequence[str], Sequence[str], float]]:
+        """
+        Read the current value.
+
+        Returns:
+            A single sample, or none if the value is not available.
+
+        """
+        value = self.callback()
+        return [] if value is None else [(self.name, (), (), value)]
+
+
+class CallbackCounter(Metric):
+    """Counters kept somewhere else, read whenever they are scraped."""
+
+    kind = "counter"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: Sequence[str],
+        callback: Callable[[], Mapping[tuple[str, ...], float]],
+    ) -> None:
+        """Create a counter reporting the counts `callback` returns, keyed by label values."""
+        super().__init__(name, documentation, labels)
+        self.callback = callback
+
+    def samples(self) -> Iterable[tuple[str, Sequence[str], Sequence[str], float]]:
+        """
+        Read the current counts.
+
+        Returns:
+            Tuples of sample name, label names, label values and value.
+
+        """
+        return [(self.name, self.labels, values, count) for values, count in sorted(self.callback().items())]
+
+
+class Histogram(Metric):
+    """Counts observations, such as request durations, in cumulative buckets."""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = METRICS_LATENCY_BUCKETS,
+    ) -> None:
+        """Create a histogram with the given bucket upper bounds."""
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        # Per label combination: observations per bucket (the last one being +Inf), and their sum
+        self._values: dict[tuple[str, ...], tuple[list[int], list[float]]] = {}
+
+    def observe(self, value: float, *label_values: str) -> None:
+        """Record an observation for the given label values."""
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.setdefault(label_values, ([0] * (len(self.buckets) + 1), [0.0]))
+            counts[index] += 1
+            total[0] += value
+
+    def count(self, *label_values: str) -> int:
+        """
+        Find out how many observations were recorded for the given label values.
+
+        Returns:
+            The number of observations.
+
+        """
+        with self._lock:
+            counts, _ = self._values.get(label_values, ([0], [0.0]))
+            return sum(counts)
+
+    def samples(self) -> Iterable[tuple[str, Sequence[str], Sequence[str], float]]:
+        """
+        List the bucket counts, sum and count of every label combination.
+
+        Returns:
+            Tuples of sample name, label names, label values and value.
+
+        """
+        bucket_labels = (*self.labels, "le")
+        bounds = [format_value(bound) for bound in (*self.buckets, math.inf)]
+        samples = []
+        with self._lock:
+            for values, (counts, total) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(bounds, counts, strict=True):
+                    cumulative += count
+                    samples.append((f"{self.name}_bucket", bucket_labels, (*values, bound), cumulative))
+                samples.extend((
+                    (f"{self.name}_sum", self.labels, values, total[0]),
+                    (f"{self.name}_count", self.labels, values, cumulative),
+                ))
+        return samples
+
+
+class MetricsRegistry:
+    """The set of metrics a scrape returns."""
+
+    def __init__(self) -> None:
+        """Create an empty registry."""
+        self._metrics: dict[str, Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: Metric) -> Metric:
+        """
+        Add a metric, replacing any earlier one of the same name.
+
+        Returns:
+            The metric.
+
+        """
+        with self._lock:
+            self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        """
+        Render every metric in the Prometheus text format.
+
+        Returns:
+            The scrape response body.
+
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = [line for metric in metrics for line in metric.render()]
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "Time spent serving HTTP requests.", ("method", "route", "status"),
+)
+HTTP_REQUESTS_IN_PROGRESS = Gauge("http_requests_in_progress", "HTTP requests currently being served.")
+DB_STATEMENT_DURATION = Histogram(
+    "db_statement_duration_seconds", "Time spent executing SQL statements.", ("operation",),
+)
+CRUD_CALL_DURATION = Histogram(
+    "crud_call_duration_seconds",
+    "Time spent in database calls, including waiting for a database thread.",
+    ("function",),
+)
+CRUD_DB_SECONDS = Counter(
+    "crud_db_seconds_total", "Time database calls spent executing SQL statements.", ("function",),
+)
+
+for _metric in (
+    HTTP_REQUEST_DURATION, HTTP_REQUESTS_IN_PROGRESS, DB_STATEMENT_DURATION, CRUD_CALL_DURATION, CRUD_DB_SECONDS,
+):
+    registry.register(_metric)
+
+
+# The SQL time of the database call in progress, if any. anyio copies the
+# context into its worker threads, so the cursor events running there can
+# add to the list of the call that started them.
+current_db_call: ContextVar[list[float] | None] = ContextVar("current_db_call", default=None)
+
+
+@contextmanager
+def track_db_call(func: Callable[..., object]) -> Generator[None, None, None]:
+    """Record how long a database call took, and how much of it was spent on SQL."""
+    name = getattr(func, "__name__", type(func).__name__)
+    sql_time = [0.0]
+    token = current_db_call.set(sql_time)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        CRUD_CALL_DURATION.observe(time.perf_counter() - started, name)
+        CRUD_DB_SECONDS.inc(name, amount=sql_time[0])
+        current_db_call.reset(token)
+
+
+def instrument_engine(engine: Engine, metrics_registry: MetricsRegistry = registry) -> None:
+    """Time every statement the engine executes, and report the state of its connection pool."""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def start_timer(conn: Connection, *_args: object) -> None:
+        conn.info.setdefault("statement_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def stop_timer(conn: Connection, _cursor: object, statement: str, *_args: object) -> None:
+        elapsed = time.perf_counter() - conn.info["statement_started"].pop()
+        operation = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "UNKNOWN"
+        DB_STATEMENT_DURATION.observe(elapsed, operation)
+        sql_time = current_db_call.get()
+        if sql_time is not None:
+            sql_time[0] += elapsed
+
+    @event.listens_for(engine, "handle_error")
+    def discard_timer(context: ExceptionContext) -> None:
+        if context.connection is not None and context.connection.info.get("statement_started"):
+            context.connection.info["statement_started"].pop()
+
+    pool = engine.pool
+    for name, documentation, reader in (
+        ("db_pool_size", "Connections the pool keeps open.", "size"),
+        ("db_pool_checked_out", "Connections currently in use.", "checkedout"),
+        ("db_pool_overflow", "Connections open beyond the pool size.", "overflow"),
+    ):
+        if hasattr(pool, reader):
+            metrics_registry.register(CallbackGauge(name, documentation, getattr(pool, reader)))
+
+
+def route_template(scope: Scope) -> str:
+    """
+    Work out the path template of the route that served a request.
+
+    Labelling requests with the raw path would give every room and message a
+    time series of its own. The router stores the matched route in the scope,
+    but routes of included routers only know their own part of the template,
+    so the prefix is taken from the actual path.
+
+    Returns:
+        The template, eg. "/api/v1/rooms/{room_id}", or "unmatched".
+
+    """
+    template = getattr(scope.get("route"), "path", None)
+    if template is None:
+        return "unmatched"
+    prefix = scope["path"].rsplit("/", template.count("/"))[0]
+    return prefix + template
+
+
+class MetricsMiddleware:
+    """Times each HTTP request, labelled with its route template rather than its path."""
+
+    def __init__(self, app: ASGIApp) -> None:
+        """Wrap an ASGI application."""
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        """Serve a request, recording its duration and status."""
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_with_status(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        HTTP_REQUESTS_IN_PROGRESS.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            HTTP_REQUESTS_IN_PROGRESS.dec()
+            elapsed = time.perf_counter() - started
+            HTTP_REQUEST_DURATION.observe(elapsed, scope["method"], route_template(scope), str(status))
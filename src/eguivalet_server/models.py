@@ -2,7 +2,21 @@
 
 import uuid
 
-from sqlalchemy import Boolean, Column, DateTime, ForeignKey, Integer, String, Table
+from sqlalchemy import (
+    Boolean,
+    Column,
+    DateTime,
+    ForeignKey,
+    Index,
+    Integer,
+    MetaData,
+    String,
+    Table,
+    event,
+    inspect,
+    true,
+)
+from sqlalchemy.engine import Connection
 from sqlalchemy.orm import relationship
 from sqlalchemy_utils import UUIDType
 
@@ -11,7 +25,10 @@
     MAX_MESSAGE_LENGTH,
     MAX_PASSWORD_HASH_LENGTH,
     MAX_USERNAME_LENGTH,
+    POSTGRESQL_SEARCH_CONFIG,
+    TOKEN_ID_LENGTH,
     AccessLevel,
+    DeletionStatus,
 )
 from eguivalet_server.database import Base
 
@@ -23,6 +40,8 @@
     Base.metadata,
     Column("user_id", ForeignKey("users.id"), primary_key=True),
     Column("room_id", ForeignKey("rooms.id"), primary_key=True),
+    # The primary key covers listing a user's rooms; this covers listing a room's members in order
+    Index("ix_users_in_rooms_room_id_user_id", "room_id", "user_id"),
 )
 
 
@@ -38,15 +57,28 @@ class Room(Base):
     name = Column(String(MAX_MESSAGE_LENGTH))
     public = Column(Boolean, default=True)
     owner = Column(UUIDType(binary=False), nullable=True, default=None)
+    # Set once deleted; the row goes once its messages and memberships have been purged
+    deletion_time = Column(DateTime, nullable=True, default=None)
 
     messages = relationship("Message", back_populates="room")
     users = relationship("User", secondary=users_in_rooms_table, backref="chatrooms")
 
+    __table_args__ = (
+        # Only public rooms are ever listed, so there's no point indexing the rest
+        Index("ix_rooms_public", "id", sqlite_where=public == true(), postgresql_where=public == true()),
+    )
+
 
 class Message(Base):
     """A database model for messages."""
 
     __tablename__ = "messages"
+    __table_args__ = (
+        # Matches the (creation_time, id) order used for paging through a room's history
+        Index("ix_messages_room_id_creation_time_id", "room_id", "creation_time", "id"),
+        # Finds the messages of a deleted user
+        Index("ix_messages_user_id", "user_id"),
+    )
 
     id = Column(UUIDType(binary=False), primary_key=True, index=True, default=uuid.uuid4)
     user_id: Column[uuid.UUID] = Column(ForeignKey("users.id"))  # type: ignore[assignment]
@@ -58,6 +90,109 @@ class Message(Base):
     room = relationship("Room", back_populates="messages")
 
 
+# Full-text search over message text, kept up to date by the database itself so
+# that every way of writing messages, batches and room deletions included, is covered
+
+SEARCH_INDEX_DDL = {
+    # The room ID is indexed too, so a search only reads the postings of one room
+    "sqlite": [
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+            message, room_id, content='messages', content_rowid='rowid', tokenize='unicode61 remove_diacritics 2'
+        )
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+            INSERT INTO messages_fts (rowid, message, room_id) VALUES (new.rowid, new.message, new.room_id);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN
+            INSERT INTO messages_fts (messages_fts, rowid, message, room_id)
+            VALUES ('delete', old.rowid, old.message, old.room_id);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF message, room_id ON messages BEGIN
+            INSERT INTO messages_fts (messages_fts, rowid, message, room_id)
+            VALUES ('delete', old.rowid, old.message, old.room_id);
+            INSERT INTO messages_fts (rowid, message, room_id) VALUES (new.rowid, new.message, new.room_id);
+        END
+        """,
+    ],
+    "postgresql": [
+        f"""
+        ALTER TABLE messages ADD COLUMN IF NOT EXISTS search_vector tsvector
+        GENERATED ALWAYS AS (to_tsvector('{POSTGRESQL_SEARCH_CONFIG}', coalesce(message, ''))) STORED
+        """,
+        "CREATE INDEX IF NOT EXISTS ix_messages_search_vector ON messages USING GIN (search_vector)",
+    ],
+}
+SEARCH_INDEX_REBUILD = {
+    "sqlite": "INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')",
+    "postgresql": "REINDEX INDEX ix_messages_search_vector",
+}
+
+
+def create_search_index(connection: Connection) -> bool:
+    """
+    Create the full-text search index and what keeps it up to date, unless they exist already.
+
+    Returns:
+        False if the database has no full-text search this project supports.
+
+    """
+    statements = SEARCH_INDEX_DDL.get(connection.dialect.name)
+    if statements is None:
+        return False
+    for statement in statements:
+        connection.exec_driver_sql(statement)
+    return True
+
+
+def has_search_index(connection: Connection) -> bool:
+    """
+    Tell whether the full-text search index has been created.
+
+    Returns:
+        True if it exists, or if the database has no full-text search this project supports.
+
+    """
+    inspector = inspect(connection)
+    if connection.dialect.name == "sqlite":
+        return inspector.has_table("messages_fts")
+    if connection.dialect.name == "postgresql":
+        return "search_vector" in {column["name"] for column in inspector.get_columns("messages")}
+    return True
+
+
+def rebuild_search_index(connection: Connection) -> bool:
+    """
+    Create the full-text search index if needed, and fill it from the existing messages.
+
+    Returns:
+        False if the database has no full-text search this project supports.
+
+    """
+    if not create_search_index(connection):
+        return False
+    connection.exec_driver_sql(SEARCH_INDEX_REBUILD[connection.dialect.name])
+    return True
+
+
+@event.listens_for(Message.__table__, "after_create")
+def create_search_index_with_table(_target: Table, connection: Connection, **_kwargs: object) -> None:
+    """Index the messages table from the start."""
+    create_search_index(connection)
+
+
+@event.listens_for(Message.__table__, "before_drop")
+def drop_search_index_with_table(_target: Table, connection: Connection, **_kwargs: object) -> None:
+    """Drop the SQLite index along with its table, as it would otherwise point at rows that are gone."""
+    if connection.dialect.name == "sqlite":
+        connection.exec_driver_sql("DROP TABLE IF EXISTS messages_fts")
+
+
 class User(Base):
     """A database model for users."""
 
@@ -68,3 +203,77 @@ class User(Base):
     email = Column(String(MAX_EMAIL_ADDRESS_LENGTH), unique=True)
     password_hash = Column(String(MAX_PASSWORD_HASH_LENGTH))
     global_access_level = Column(Integer, default=AccessLevel.BASIC)
+    # Set once deleted; the row goes once their messages and memberships have been purged
+    deletion_time = Column(DateTime, nullable=True, default=None)
+
+
+class RevokedToken(Base):
+    """A database model for access tokens logged out of before they expire."""
+
+    __tablename__ = "revoked_tokens"
+
+    id = Column(String(TOKEN_ID_LENGTH), primary_key=True)
+    expires = Column(Integer, index=True)  # UNIX time, as in the token; the row is useless afterwards
+
+
+class DeletionJob(Base):
+    """A database model for purging what a deleted room or user leaves behind, in the background."""
+
+    __tablename__ = "deletion_jobs"
+
+    id = Column(UUIDType(binary=False), primary_key=True, default=uuid.uuid4)
+    kind = Column(String(16))  # A DeletionKind
+    target_id = Column(UUIDType(binary=False))  # ID of the room or user
+    requester_id = Column(UUIDType(binary=False))  # ID of the user who deleted it, the only one shown the job
+    status = Column(String(16), default=DeletionStatus.PENDING)
+    messages_deleted = Column(Integer, default=0)
+    memberships_deleted = Column(Integer, default=0)
+    creation_time = Column(DateTime)
+    completion_time = Column(DateTime, nullable=True, default=None)
+
+    __table_args__ = (
+        # The latest job of a room or user, and the pending jobs oldest first, are read in index order
+        Index("ix_deletion_jobs_target_id_creation_time", "target_id", "creation_time"),
+        Index("ix_deletion_jobs_status_creation_time", "status", "creation_time"),
+    )
+
+
+# Columns and indexes added to tables after their first release, which
+# `create_all` leaves out as it only creates missing tables
+
+LATE_COLUMNS = (Room.__table__.c.deletion_time, User.__table__.c.deletion_time)
+LATE_INDEX_NAMES = frozenset(
+    {
+        "ix_messages_room_id_creation_time_id",
+        "ix_messages_user_id",
+        "ix_rooms_public",
+        "ix_users_in_rooms_room_id_user_id",
+    },
+)
+LATE_INDEXES = tuple(
+    index
+    for table in (Message.__table__, Room.__table__, users_in_rooms_table)
+    for index in table.indexes
+    if index.name in LATE_INDEX_NAMES
+)
+
+
+def upgrade_schema(connection: Connection) -> None:
+    """Add the columns and indexes a database created by an older version is missing, and index its messages."""
+    inspector = inspect(connection)
+    for column in LATE_COLUMNS:
+        table_name = column.table.name
+        if column.name not in {existing["name"] for existing in inspector.get_columns(table_name)}:
+            column_type = column.type.compile(dialect=connection.dialect)
+            connection.exec_driver_sql(f"ALTER TABLE {table_name} ADD COLUMN {column.name} {column_type}")
+    for index in LATE_INDEXES:
+        index.create(connection, checkfirst=True)
+    # A new messages table is indexed as it is created, but an old one holds messages to index
+    if not has_search_index(connection):
+        rebuild_search_index(connection)
+
+
+@event.listens_for(Base.metadata, "after_create")
+def upgrade_schema_with_tables(_target: MetaData, connection: Connection, **_kwargs: object) -> None:
+    """Bring the existing tables up to date whenever the missing ones are created."""
+    upgrade_schema(connection)
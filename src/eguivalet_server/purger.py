@@ -0,0 +1,98 @@
+"""
+Purges what deleted rooms and users leave behind, in the background.
+
+A busy room can hold millions of messages. Deleting them in the request
+would hold a write transaction, and with SQLite every other writer, for as
+long as that takes. Instead, the room or user is marked as deleted at once
+and a deletion job is queued; the purger then deletes the rest in small
+batches, each in a transaction of its own, pausing between them. Jobs are
+kept in the database, so a purge cut short by a restart resumes later.
+"""
+
+from __future__ import annotations
+
+import logging
+from typing import TYPE_CHECKING
+
+import anyio
+
+from eguivalet_server import crud
+from eguivalet_server.config import DELETION_BATCH_PAUSE, DELETION_BATCH_SIZE, DELETION_POLL_INTERVAL
+from eguivalet_server.database import SessionLocal, run_in_db_pool
+
+if TYPE_CHECKING:
+    from collections.abc import Callable
+    from uuid import UUID
+
+    from sqlalchemy.orm import Session
+
+logger = logging.getLogger(__name__)
+
+
+class Purger:
+    """Works through the pending deletion jobs, one batch at a time."""
+
+    def __init__(
+        self,
+        session_factory: Callable[[], Session] = SessionLocal,
+        batch_size: int = DELETION_BATCH_SIZE,
+        pause: float = DELETION_BATCH_PAUSE,
+        poll_interval: float = DELETION_POLL_INTERVAL,
+    ) -> None:
+        """Create a purger using sessions from `session_factory`."""
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.pause = pause
+        self.poll_interval = poll_interval
+        self._wake: anyio.Event | None = None
+
+    def wake(self) -> None:
+        """Start on a newly queued job now, rather than at the next poll."""
+        if self._wake is not None:
+            self._wake.set()
+
+    def purge_batch(self, job_id: UUID) -> bool:
+        """
+        Purge the next batch of a job.
+
+        Returns:
+            True once the job has finished.
+
+        """
+        with self.session_factory() as db:
+            return crud.purge_deletion_batch(db, job_id, self.batch_size)
+
+    def pending(self) -> list[UUID]:
+        """
+        Find the jobs left to do.
+
+        Returns:
+            The job IDs, oldest first.
+
+        """
+        with self.session_factory() as db:
+            return crud.read_pending_deletions(db)
+
+    async def purge(self, job_id: UUID) -> None:
+        """Purge a job batch by batch, until it has finished."""
+        while not await run_in_db_pool(self.purge_batch, job_id):  # ruff:ignore[async-busy-wait]
+            await anyio.sleep(self.pause)
+
+    async def purge_pending(self) -> None:
+        """Purge every pending job, oldest first."""
+        for job_id in await run_in_db_pool(self.pending):
+            await self.purge(job_id)
+
+    async def run(self) -> None:
+        """Purge pending jobs whenever woken, or every poll interval, until cancelled."""
+        while True:
+            self._wake = anyio.Event()
+            try:
+                await self.purge_pending()
+            except Exception:
+                logger.exception("Purging deleted rooms and users failed")
+            with anyio.move_on_after(self.poll_interval):
+                await self._wake.wait()
+
+
+purger = Purger()
@@ -0,0 +1,240 @@
+"""Logs slow SQL statements, and requests that run the same statement over and over."""
+
+from __future__ import annotations
+
+import inspect
+import logging
+import random
+import re
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from sqlalchemy import event
+
+from eguivalet_server.config import (
+    PROJECT_DIR,
+    QUERY_SAMPLE_RATE,
+    REPEATED_QUERY_THRESHOLD,
+    ROOT_DIR,
+    SLOW_QUERY_THRESHOLD,
+)
+
+if TYPE_CHECKING:
+    from collections.abc import Generator
+
+    from sqlalchemy.engine import Connection, Engine, ExceptionContext
+    from starlette.types import ASGIApp, Receive, Scope, Send
+
+logger = logging.getLogger(__name__)
+
+MAX_LOGGED_PARAMETERS_LENGTH = 500
+EXPLAINABLE = ("SELECT", "UPDATE", "DELETE", "WITH")
+IN_LIST = re.compile(r"\((?:\s*\?\s*,)+\s*\?\s*\)")
+WHITESPACE = re.compile(r"\s+")
+
+
+class RepeatedQueryError(RuntimeError):
+    """Raised in strict mode when a request runs the same statement too many times."""
+
+
+@dataclass
+class TrackedQueries:
+    """The statements run while handling one request."""
+
+    name: str
+    counts: Counter[str] = field(default_factory=Counter)
+
+
+current_queries: ContextVar[TrackedQueries | None] = ContextVar("current_queries", default=None)
+
+
+def normalise(statement: str) -> str:
+    """
+    Reduce a statement to its shape, so statements differing only in list lengths compare equal.
+
+    Returns:
+        The normalised statement.
+
+    """
+    return IN_LIST.sub("(?)", WHITESPACE.sub(" ", statement).strip())
+
+
+@contextmanager
+def track_queries(name: str) -> Generator[TrackedQueries, None, None]:
+    """
+    Count the statements run inside the block, regardless of any sample rate.
+
+    Yields:
+        The statement counts.
+
+    """
+    queries = TrackedQueries(name)
+    token = current_queries.set(queries)
+    try:
+        yield queries
+    finally:
+        current_queries.reset(token)
+
+
+def find_call_site() -> str:
+    """
+    Find the line of project code, rather than library code, that ran the statement being executed.
+
+    Returns:
+        A "path:line in function" description, or "unknown".
+
+    """
+    frame = inspect.currentframe()
+    while frame is not None:
+        path = Path(frame.f_code.co_filename)
+        if (
+            ROOT_DIR in path.parents
+            and "site-packages" not in path.parts
+            and path not in {Path(__file__), PROJECT_DIR / "metrics.py"}
+        ):
+            return f"{path.relative_to(ROOT_DIR)}:{frame.f_lineno} in {frame.f_code.co_name}"
+        frame = frame.f_back
+    return "unknown"
+
+
+class QueryMonitor:
+    """
+    Watches the statements executed by instrumented engines.
+
+    Statements slower than `slow_threshold` seconds are logged with their
+    parameters, call site and query plan. A sample of requests (`sample_rate`
+    of them) also counts its statements, and warns the first time any one of
+    them runs more than `repeated_threshold` times, which is what lazy loading
+    relationships in a loop looks like. In `strict` mode that raises instead.
+    """
+
+    def __init__(
+        self,
+        slow_threshold: float = SLOW_QUERY_THRESHOLD,
+        sample_rate: float = QUERY_SAMPLE_RATE,
+        repeated_threshold: int = REPEATED_QUERY_THRESHOLD,
+        *,
+        strict: bool = False,
+    ) -> None:
+        """Create a monitor; a slow threshold of zero turns the slow query log off."""
+        self.slow_threshold = slow_threshold
+        self.sample_rate = sample_rate
+        self.repeated_threshold = repeated_threshold
+        self.strict = strict
+
+    def should_track(self) -> bool:
+        """
+        Decide whether to count the statements of a request.
+
+        Returns:
+            True for roughly `sample_rate` of requests.
+
+        """
+        return self.sample_rate >= 1 or random.random() < self.sample_rate  # ruff:ignore[suspicious-non-cryptographic-random-usage]
+
+    def instrument(self, engine: Engine) -> None:
+        """Watch every statement the engine executes."""
+
+        @event.listens_for(engine, "before_cursor_execute")
+        def start_timer(conn: Connection, *_args: object) -> None:
+            conn.info.setdefault("query_monitor_started", []).append(time.perf_counter())
+
+        @event.listens_for(engine, "after_cursor_execute")
+        def check_statement(
+            conn: Connection, _cursor: object, statement: str, parameters: object, *_args: object,
+        ) -> None:
+            elapsed = time.perf_counter() - conn.info["query_monitor_started"].pop()
+            if self.slow_threshold and elapsed >= self.slow_threshold:
+                log_slow_query(conn, statement, parameters, elapsed)
+            queries = current_queries.get()
+            if queries is not None:
+                self.count(queries, statement)
+
+        @event.listens_for(engine, "handle_error")
+        def discard_timer(context: ExceptionContext) -> None:
+            if context.connection is not None and context.connection.info.get("query_monitor_started"):
+                context.connection.info["query_monitor_started"].pop()
+
+    def count(self, queries: TrackedQueries, statement: str) -> None:
+        """
+        Count a statement, and complain once it has run too many times.
+
+        Raises:
+            RepeatedQueryError: If the statement ran too many times in strict mode.
+
+        """
+        shape = normalise(statement)
+        queries.counts[shape] += 1
+        if queries.counts[shape] != self.repeated_threshold + 1:
+            return
+
+        message = "%s ran the same statement more than %d times, last from %s: %s"
+        args = (queries.name, self.repeated_threshold, find_call_site(), shape)
+        if self.strict:
+            raise RepeatedQueryError(message % args)
+        logger.warning(message, *args)
+
+
+def log_slow_query(conn: Connection, statement: str, parameters: object, elapsed: float) -> None:
+    """Log a slow statement, along with how the database executed it."""
+    logged_parameters = repr(parameters)
+    if len(logged_parameters) > MAX_LOGGED_PARAMETERS_LENGTH:
+        logged_parameters = logged_parameters[:MAX_LOGGED_PARAMETERS_LENGTH] + "..."
+    logger.warning(
+        "Slow query (%.1f ms) from %s: %s; parameters: %s; plan: %s",
+        elapsed * 1000,
+        find_call_site(),
+        normalise(statement),
+        logged_parameters,
+        explain(conn, statement, parameters),
+    )
+
+
+def explain(conn: Connection, statement: str, parameters: object) -> str:
+    """
+    Ask the database how it executes a statement.
+
+    Returns:
+        The query plan on a single line, or why it is not available.
+
+    """
+    if not statement.lstrip().upper().startswith(EXPLAINABLE) or isinstance(parameters, list):
+        return "not available"
+
+    prefix = "EXPLAIN QUERY PLAN" if conn.dialect.name == "sqlite" else "EXPLAIN"
+    cursor = conn.connection.dbapi_connection.cursor()  # type: ignore[union-attr]
+    try:
+        cursor.execute(f"{prefix} {statement}", parameters)
+        return " | ".join(str(row[-1]) for row in cursor.fetchall())
+    except Exception as err:  # ruff:ignore[blind-except]
+        # Never let the diagnostics break the query they are about
+        return f"not available ({err})"
+    finally:
+        cursor.close()
+
+
+class QueryMonitorMiddleware:
+    """Counts the statements of a sample of HTTP requests."""
+
+    def __init__(self, app: ASGIApp, monitor: QueryMonitor) -> None:
+        """Wrap an ASGI application."""
+        self.app = app
+        self.monitor = monitor
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        """Serve a request, counting its statements if it was picked."""
+        if scope["type"] != "http" or not self.monitor.should_track():
+            await self.app(scope, receive, send)
+            return
+
+        # The database threads get a copy of this context, so they count into the same object
+        with track_queries(f"{scope['method']} {scope['path']}"):
+            await self.app(scope, receive, send)
+
+
+query_monitor = QueryMonitor()
@@ -4,7 +4,7 @@
 
 from fastapi import APIRouter
 
-from eguivalet_server.routes.api.v1 import rooms, users
+from eguivalet_server.routes.api.v1 import deletions, rooms, users
 
 logger = logging.getLogger(__name__)
 
@@ -13,4 +13,6 @@
 )
 
 router.include_router(rooms.router)
+router.include_router(rooms.websocket_router)
 router.include_router(users.router)
+router.include_router(deletions.router)
@@ -0,0 +1,59 @@
+"""Implements routes for following the deletion of rooms and users."""
+
+import logging
+from typing import Annotated
+from uuid import UUID
+
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, status
+from sqlalchemy.orm import Session
+
+from eguivalet_server import crud
+from eguivalet_server.auth import CurrentUser, get_current_user
+from eguivalet_server.database import get_db, run_in_db_pool
+from eguivalet_server.models import DeletionJob as DeletionJobModel
+from eguivalet_server.purger import purger
+from eguivalet_server.schemas import DeletionJob
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(
+    prefix="/deletions",
+    dependencies=[Depends(get_current_user)],
+)
+
+
+def accept_deletion(db_job: DeletionJobModel, request: Request, response: Response) -> DeletionJobModel:
+    """
+    Point the response to a deletion request at its job, and start purging.
+
+    Returns:
+        The deletion job.
+
+    """
+    response.headers["Location"] = str(request.url_for("get_deletion_job", job_id=db_job.id))
+    purger.wake()
+    return db_job
+
+
+@router.get("/{job_id}", status_code=status.HTTP_200_OK, response_model=DeletionJob)
+async def get_deletion_job(
+    job_id: UUID, current_user: CurrentUser, db: Annotated[Session, Depends(get_db)],
+) -> DeletionJobModel:
+    """
+    Fetch how far the purge of a deleted room or user has got.
+
+    Returns:
+        Deletion job object.
+
+    Raises:
+        HTTPException: If the job does not exist, or was started by another user.
+
+    """
+    logger.info("GET deletion job %s", job_id)
+
+    db_job = await run_in_db_pool(crud.read_deletion_job, db, job_id)
+    # Other users' jobs are hidden rather than refused, as they would tell what was deleted
+    if db_job is None or db_job.requester_id != current_user:
+        logger.error("Deletion job does not exist")
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Deletion job not found")
+    return db_job
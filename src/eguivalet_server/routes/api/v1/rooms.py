@@ -1,42 +1,169 @@
 """Implements room routes."""
 
 import logging
+from collections.abc import AsyncGenerator
+from functools import lru_cache
 from typing import Annotated
 from uuid import UUID
 
-from fastapi import APIRouter, Depends, HTTPException, status
+import anyio
+from fastapi import (
+    APIRouter,
+    Depends,
+    Header,
+    HTTPException,
+    Query,
+    Request,
+    Response,
+    WebSocket,
+    WebSocketDisconnect,
+    status,
+)
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
+from starlette.types import Receive, Scope, Send
 
 from eguivalet_server import crud
-from eguivalet_server.database import get_db
+from eguivalet_server.auth import CurrentUser, InvalidTokenError, get_current_user, verify_token
+from eguivalet_server.broadcast import Subscription, room_broadcaster
+from eguivalet_server.coalescer import message_writer
+from eguivalet_server.config import (
+    DEFAULT_MEMBERSHIP_PAGE_SIZE,
+    DEFAULT_MESSAGE_PAGE_SIZE,
+    DEFAULT_SEARCH_PAGE_SIZE,
+    EVENT_STREAM_KEEPALIVE_INTERVAL,
+    MAX_LONG_POLL_WAIT,
+    MAX_MEMBERSHIP_PAGE_SIZE,
+    MAX_MESSAGE_LENGTH,
+    MAX_MESSAGE_PAGE_SIZE,
+    MAX_SEARCH_OFFSET,
+    MAX_SEARCH_PAGE_SIZE,
+    MESSAGE_WRITE_COALESCING,
+    NEXT_CURSOR_HEADER,
+    NEXT_OFFSET_HEADER,
+    ROOM_SUBSCRIBER_QUEUE_SIZE,
+    AccessLevel,
+    RoomEventType,
+)
+from eguivalet_server.database import get_db, run_in_db_pool
+from eguivalet_server.models import DeletionJob as DeletionJobModel
 from eguivalet_server.models import Message as MessageModel
 from eguivalet_server.models import Room as RoomModel
-from eguivalet_server.schemas import Message, Room
+from eguivalet_server.models import User as UserModel
+from eguivalet_server.routes.api.v1.deletions import accept_deletion
+from eguivalet_server.schemas import DeletionJob, Message, MessageBatch, MessageBatchResult, Room, RoomEvent, User
+from eguivalet_server.serialization import RowsResponse
+from eguivalet_server.utility import (
+    MessageCursor,
+    decode_cursor,
+    decode_id_cursor,
+    encode_cursor,
+    encode_id_cursor,
+    etag_matches,
+)
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter(
     prefix="/rooms",
+    dependencies=[Depends(get_current_user)],
 )
+# WebSockets cannot send an Authorization header, so they are authenticated separately
+websocket_router = APIRouter(
+    prefix="/rooms",
+)
+
+
+def message_event(
+    event: RoomEventType, room_id: UUID, message_id: UUID, message: MessageModel | Message | None = None,
+) -> RoomEvent:
+    """
+    Describe something that happened to a message.
+
+    Returns:
+        The event, with the cursor of the message if it is a new one.
+
+    """
+    return RoomEvent(
+        event=event,
+        room_id=room_id,
+        message_id=message_id,
+        message=Message.model_validate(message, from_attributes=True) if message is not None else None,
+        cursor=(
+            encode_cursor(message.creation_time, message_id)
+            if event == RoomEventType.MESSAGE_CREATED and message is not None
+            else None
+        ),
+    )
+
+
+def publish_message_event(
+    event: RoomEventType, room_id: UUID, message_id: UUID, message: MessageModel | Message | None = None,
+) -> None:
+    """Push a message event to everyone subscribed to the room."""
+    if not room_broadcaster.has_audience(room_id):
+        return
+
+    room_broadcaster.publish(room_id, message_event(event, room_id, message_id, message).model_dump_json())
+
+
+def receive_room_event(room_id: UUID, payload: str) -> None:
+    """Pass on an event published by another worker to the subscribers in this one."""
+    # The change was not made through this worker, so its cached messages of the room may not show it
+    crud.recent_messages.invalidate(room_id)
+    room_broadcaster.deliver(room_id, payload)
 
 
-@router.get("/", status_code=status.HTTP_200_OK, response_model=list[Room])
-async def get_public_rooms(db: Annotated[Session, Depends(get_db)]) -> list[RoomModel]:
+async def check_readable(db: Session, room_id: UUID, user_id: UUID) -> bool:
+    """
+    Make sure a user may read the messages and members of a room.
+
+    Returns:
+        True if the room exists, False if not.
+
+    Raises:
+        HTTPException: If the room is private and the user is not a member.
+
+    """
+    readable = await run_in_db_pool(crud.can_read, db, room_id, user_id)
+    if readable is False:
+        logger.error("Reader is not a member of the private room")
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not allowed to read the room")
+    return readable is not None
+
+
+@router.get(
+    "/",
+    status_code=status.HTTP_200_OK,
+    response_model=list[Room],
+    responses={status.HTTP_304_NOT_MODIFIED: {"description": "The public rooms have not changed"}},
+)
+async def get_public_rooms(
+    db: Annotated[Session, Depends(get_db)],
+    if_none_match: Annotated[str | None, Header()] = None,
+) -> Response:
     """
     Fetch the public rooms.
 
+    The response carries an ETag; sending it back in `If-None-Match` gets an
+    empty 304 response for as long as the list stays the same.
+
     Returns:
         A list of Room objects.
 
     """
     logger.info("GET public chatrooms")
 
-    rooms = crud.read_public_rooms(db)
+    public_rooms = await run_in_db_pool(crud.read_public_rooms_cached, db)
+
+    if if_none_match is not None and etag_matches(if_none_match, public_rooms.etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": public_rooms.etag})
 
-    if not rooms:
+    if not public_rooms.rooms:
         logger.info("No public rooms found")
 
-    return rooms
+    # Encoded once when the list was cached, rather than on every request
+    return Response(public_rooms.body, media_type="application/json", headers={"ETag": public_rooms.etag})
 
 
 @router.post("/", status_code=status.HTTP_200_OK, response_model=Room)
@@ -53,14 +180,17 @@ async def post_new_room(room: Room, db: Annotated[Session, Depends(get_db)]) ->
     """
     logger.info("POST new chatroom")
 
-    if crud.read_room(db, room_id=room.id) is not None:
+    # A deleted room keeps its ID until it has been purged
+    if await run_in_db_pool(crud.read_room, db, room_id=room.id, include_deleted=True) is not None:
         logger.error("Room already exists")
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Room already exists")
-    return crud.create_room(db, room=room)
+    return await run_in_db_pool(crud.create_room, db, room=room)
 
 
 @router.get("/{room_id}", status_code=status.HTTP_200_OK, response_model=Room)
-async def get_room_by_id(room_id: UUID, db: Annotated[Session, Depends(get_db)]) -> RoomModel:
+async def get_room_by_id(
+    room_id: UUID, current_user: CurrentUser, db: Annotated[Session, Depends(get_db)],
+) -> RoomModel:
     """
     Fetch the specified room.
 
@@ -68,12 +198,16 @@ async def get_room_by_id(room_id: UUID, db: Annotated[Session, Depends(get_db)])
         Room object.
 
     Raises:
-        HTTPException: If the room does not exist.
+        HTTPException: If the room does not exist, or is private and the user is not a member.
 
     """
     logger.info("GET chatroom by ID: %s", room_id)
 
-    db_room = crud.read_room(db, room_id)
+    # Private rooms are hidden from those who may not read them, rather than refused
+    if not await run_in_db_pool(crud.can_read, db, room_id, current_user):
+        logger.error("Room does not exist")
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Room not found")
+    db_room = await run_in_db_pool(crud.read_room, db, room_id)
     if db_room is None:
         logger.error("Room does not exist")
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Room not found")
@@ -81,52 +215,258 @@ async def get_room_by_id(room_id: UUID, db: Annotated[Session, Depends(get_db)])
 
 
 @router.post("/{room_id}", status_code=status.HTTP_200_OK, response_model=Message)
-async def post_message_by_id(room_id: UUID, message: Message, db: Annotated[Session, Depends(get_db)]) -> MessageModel:
+async def post_message_by_id(
+    room_id: UUID, message: Message, current_user: CurrentUser, db: Annotated[Session, Depends(get_db)],
+) -> MessageModel | Message:
     """
-    Send a message to the room.
+    Send a message to the room, as the logged in user.
 
     Returns:
         Created message object.
 
     Raises:
-        HTTPException: If the message ID already exists in the room.
+        HTTPException: If the message is from someone else, the room does
+            not exist, the sender may not post in it, or the message ID
+            already exists.
 
     """
     logger.info("POST to chatroom ID: %s", room_id)
 
-    if crud.read_message(db, room_id=room_id, message_id=message.id):
+    if message.user_id != current_user:
+        logger.error("Sender is not the logged in user")
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not allowed to post as another user")
+
+    allowed = await run_in_db_pool(crud.can_post, db, room_id, message.user_id)
+    if allowed is None:
+        logger.error("Room does not exist")
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Room not found")
+    if not allowed:
+        logger.error("Sender may not post in the room")
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not allowed to post in the room")
+
+    if await run_in_db_pool(crud.read_message, db, room_id=room_id, message_id=message.id):
         logger.error("Message already exists")
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Message already exists")
-    return crud.create_message(db, message, room_id)
 
+    if MESSAGE_WRITE_COALESCING:
+        if not await message_writer.submit((room_id, message)):
+            logger.error("Message already exists")
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Message already exists")
+        publish_message_event(RoomEventType.MESSAGE_CREATED, room_id, message.id, message)
+        return message
+
+    db_message = await run_in_db_pool(crud.create_message, db, message, room_id)
+    publish_message_event(RoomEventType.MESSAGE_CREATED, room_id, db_message.id, db_message)
+    return db_message
+
+
+@router.post("/{room_id}/messages:batch", status_code=status.HTTP_200_OK)
+async def post_message_batch(
+    room_id: UUID, batch: MessageBatch, current_user: CurrentUser, db: Annotated[Session, Depends(get_db)],
+) -> list[MessageBatchResult]:
+    """
+    Send several messages to the room at once, as the logged in user.
+
+    All of the messages are written in a single transaction. Messages whose
+    ID already exists, whose sender is someone else, or whose sender may not
+    post in the room, are skipped rather than failing the whole batch.
+
+    Returns:
+        The outcome of each message, in the order they were sent.
+
+    Raises:
+        HTTPException: If the room does not exist.
+
+    """
+    logger.info("POST %d messages to chatroom ID: %s", len(batch.messages), room_id)
+
+    posters = await run_in_db_pool(crud.read_posters, db, room_id, [current_user])
+    if posters is None:
+        logger.error("Room does not exist")
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Room not found")
+
+    allowed = [message for message in batch.messages if message.user_id in posters]
+    created = iter(await run_in_db_pool(crud.create_messages, db, [(room_id, message) for message in allowed]))
+
+    results = []
+    for message in batch.messages:
+        if message.user_id != current_user:
+            detail: str | None = "Not allowed to post as another user"
+        elif message.user_id not in posters:
+            detail = "Not allowed to post in the room"
+        elif next(created):
+            publish_message_event(RoomEventType.MESSAGE_CREATED, room_id, message.id, message)
+            detail = None
+        else:
+            detail = "Message already exists"
+        results.append(MessageBatchResult(id=message.id, created=detail is None, detail=detail))
+    return results
+
+
+@router.delete("/{room_id}", status_code=status.HTTP_202_ACCEPTED, response_model=DeletionJob)
+async def delete_room_by_id(
+    room_id: UUID,
+    current_user: CurrentUser,
+    request: Request,
+    response: Response,
+    db: Annotated[Session, Depends(get_db)],
+) -> DeletionJobModel:
+    """
+    Delete the specified room.
+
+    The room is gone at once; its messages and memberships are purged in
+    the background, which the job in the Location header tracks.
+
+    Returns:
+        Deletion job object.
+
+    Raises:
+        HTTPException: If the room does not exist, or the user is neither its
+            owner nor an administrator.
 
-@router.delete("/{room_id}", status_code=status.HTTP_204_NO_CONTENT)
-async def delete_room_by_id(room_id: UUID, db: Annotated[Session, Depends(get_db)]) -> None:
-    """Delete the specified room."""
+    """
     logger.info("DELETE chatroom by ID: %s", room_id)
 
-    crud.delete_room(db, room_id=room_id)
+    # A deleted room can be deleted again, to find its deletion job
+    db_room = await run_in_db_pool(crud.read_room, db, room_id, include_deleted=True)
+    if db_room is None:
+        logger.error("Room does not exist")
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Room not found")
+    if db_room.owner != current_user and (
+        await run_in_db_pool(crud.read_access_level_cached, db, current_user) != AccessLevel.ADMINISTRATOR
+    ):
+        logger.error("Not allowed to delete the room")
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not allowed to delete the room")
+
+    db_job = await run_in_db_pool(crud.delete_room, db, room_id=room_id, requester_id=current_user)
+    if db_job is None:
+        logger.error("Room does not exist")
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Room not found")
+    return accept_deletion(db_job, request, response)
+
+
+async def wait_for_messages(
+    db: Session, room_id: UUID, after: MessageCursor, limit: int, wait: float,
+) -> list[crud.MessageRow]:
+    """
+    Fetch the messages of a room after a cursor, waiting for one if there are none yet.
+
+    Returns:
+        List of message rows, oldest first; empty if none arrived in `wait` seconds.
+
+    """
+    deadline = anyio.current_time() + wait
+    # Subscribed before reading, so a message sent in between is not missed
+    with room_broadcaster.subscribe(room_id) as subscription:
+        while not (db_messages := await run_in_db_pool(crud.read_message_rows, db, room_id, after=after, limit=limit)):
+            # Don't hold on to a pooled connection while waiting
+            await run_in_db_pool(db.close)
+            # Any event will do; edits and deletions just mean reading again
+            with anyio.move_on_after(deadline - anyio.current_time()) as timeout:
+                await subscription.get()
+            if timeout.cancelled_caught:
+                break
+    return db_messages
 
 
 @router.get("/{room_id}/messages", status_code=status.HTTP_200_OK, response_model=list[Message])
-async def get_messages(room_id: UUID, db: Annotated[Session, Depends(get_db)]) -> list[MessageModel]:
+async def get_messages(
+    room_id: UUID,
+    current_user: CurrentUser,
+    db: Annotated[Session, Depends(get_db)],
+    before: Annotated[str | None, Query(description="Only return messages older than this cursor")] = None,
+    after: Annotated[str | None, Query(description="Only return messages newer than this cursor")] = None,
+    limit: Annotated[int, Query(ge=1, le=MAX_MESSAGE_PAGE_SIZE)] = DEFAULT_MESSAGE_PAGE_SIZE,
+    wait: Annotated[
+        float, Query(ge=0, le=MAX_LONG_POLL_WAIT, description="Seconds to wait for a message newer than `after`"),
+    ] = 0,
+) -> RowsResponse:
     """
-    Fetch the specified message.
+    Fetch a page of messages from the specified room.
+
+    Without cursors, the newest messages are returned. The cursor for the
+    next page in the same direction is sent in the `X-Next-Cursor` header:
+    older messages for `before` (only when the page was full), newer ones
+    for `after`.
+
+    With `after` and `wait`, the request is held until a newer message
+    arrives or `wait` seconds have passed, so clients can long-poll for new
+    messages instead of polling repeatedly.
 
     Returns:
-        List of messages from the specified room.
+        List of messages from the specified room, oldest first; none if the
+        room does not exist.
+
+    Raises:
+        HTTPException: If a cursor is malformed, or the room is private and
+            the user is not a member.
 
     """
     logger.info("GET messages from room ID: %s", room_id)
 
-    db_messages = crud.read_messages(db, room_id=room_id)
+    try:
+        before_cursor = decode_cursor(before) if before is not None else None
+        after_cursor = decode_cursor(after) if after is not None else None
+    except ValueError as err:
+        logger.warning("Invalid message cursor")
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor") from err
+
+    if not await check_readable(db, room_id, current_user):
+        # Including deleted rooms, whose messages may not have been purged yet
+        return RowsResponse([])
+    if after_cursor is not None and wait:
+        db_messages = await wait_for_messages(db, room_id, after_cursor, limit, wait)
+    else:
+        db_messages = await run_in_db_pool(
+            crud.read_message_rows, db, room_id=room_id, before=before_cursor, after=after_cursor, limit=limit,
+        )
+    headers = {}
     if not db_messages:
         logger.info("No messages found")
+    elif after_cursor is not None:
+        headers[NEXT_CURSOR_HEADER] = encode_cursor(db_messages[-1].creation_time, db_messages[-1].id)
+    elif len(db_messages) == limit:
+        headers[NEXT_CURSOR_HEADER] = encode_cursor(db_messages[0].creation_time, db_messages[0].id)
+    # Long histories would spend more time in validating and dumping models than in the database
+    return RowsResponse(db_messages, headers=headers)
+
+
+# Declared before the message ID route, which would otherwise take "search" for an ID
+@router.get("/{room_id}/messages/search", status_code=status.HTTP_200_OK, response_model=list[Message])
+async def search_messages(
+    room_id: UUID,
+    q: Annotated[str, Query(min_length=1, max_length=MAX_MESSAGE_LENGTH, description="Words to look for")],
+    current_user: CurrentUser,
+    response: Response,
+    db: Annotated[Session, Depends(get_db)],
+    offset: Annotated[int, Query(ge=0, le=MAX_SEARCH_OFFSET)] = 0,
+    limit: Annotated[int, Query(ge=1, le=MAX_SEARCH_PAGE_SIZE)] = DEFAULT_SEARCH_PAGE_SIZE,
+) -> list[MessageModel]:
+    """
+    Find the messages of the specified room containing every given word, best match first.
+
+    When the page is full, the offset of the next one is sent in the
+    `X-Next-Offset` header. Private rooms can only be searched by their
+    members.
+
+    Returns:
+        List of matching messages; none if the room does not exist.
+
+    """
+    logger.info("GET message search in room ID: %s", room_id)
+
+    if not await check_readable(db, room_id, current_user):
+        return []
+    db_messages = await run_in_db_pool(crud.search_messages, db, room_id, q, limit=limit, offset=offset)
+    if len(db_messages) == limit and offset + limit <= MAX_SEARCH_OFFSET:
+        response.headers[NEXT_OFFSET_HEADER] = str(offset + limit)
     return db_messages
 
 
 @router.get("/{room_id}/messages/{message_id}", status_code=status.HTTP_200_OK, response_model=Message)
-async def get_message_by_id(room_id: UUID, message_id: UUID, db: Annotated[Session, Depends(get_db)]) -> MessageModel:
+async def get_message_by_id(
+    room_id: UUID, message_id: UUID, current_user: CurrentUser, db: Annotated[Session, Depends(get_db)],
+) -> MessageModel:
     """
     Fetch the specified message.
 
@@ -134,42 +474,357 @@ async def get_message_by_id(room_id: UUID, message_id: UUID, db: Annotated[Sessi
         Message object.
 
     Raises:
-        HTTPException: If the specified message cannot be found.
+        HTTPException: If the specified message cannot be found, or the room
+            is private and the user is not a member.
 
     """
     logger.info("GET message by ID: %s", message_id)
 
-    db_message = crud.read_message(db, room_id=room_id, message_id=message_id)
+    if not await check_readable(db, room_id, current_user):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Message not found")
+    db_message = await run_in_db_pool(crud.read_message, db, room_id=room_id, message_id=message_id)
     if db_message is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Message not found")
     return db_message
 
 
+async def check_author(
+    db: Session, room_id: UUID, message_id: UUID, current_user: UUID, author: UUID | None = None,
+) -> None:
+    """
+    Make sure a message exists and was sent by the logged in user, who is not handing it to someone else.
+
+    Raises:
+        HTTPException: If the message is not found, or the user did not send it.
+
+    """
+    db_message = await run_in_db_pool(crud.read_message, db, room_id=room_id, message_id=message_id)
+    if db_message is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Message not found")
+    if db_message.user_id != current_user or author not in {None, current_user}:
+        logger.error("Not allowed to change another user's message")
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN, detail="Not allowed to change another user's message",
+        )
+
+
 @router.put("/{room_id}/messages/{message_id}", status_code=status.HTTP_200_OK, response_model=Message)
 async def put_message_by_id(
-    room_id: UUID, message_id: UUID, message: Message, db: Annotated[Session, Depends(get_db)],
+    room_id: UUID,
+    message_id: UUID,
+    message: Message,
+    current_user: CurrentUser,
+    db: Annotated[Session, Depends(get_db)],
 ) -> MessageModel:
     """
-    Edit the specified message.
+    Edit the specified message, sent by the logged in user.
 
     Returns:
         Updated message object.
 
     Raises:
-        HTTPException: If the message is not found.
+        HTTPException: If the message is not found, its ID does not match
+            the path, or it was sent by someone else.
 
     """
     logger.info("PUT message by ID: %s", message_id)
 
-    db_message = crud.update_message(db, message=message, room_id=room_id)
+    if message.id != message_id:
+        logger.error("Message ID does not match the path")
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Message ID does not match the path")
+    await check_author(db, room_id, message_id, current_user, message.user_id)
+
+    db_message = await run_in_db_pool(crud.update_message, db, message=message, room_id=room_id)
     if db_message is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Message not found")
+
+    publish_message_event(RoomEventType.MESSAGE_EDITED, room_id, db_message.id, db_message)
     return db_message
 
 
 @router.delete("/{room_id}/messages/{message_id}", status_code=status.HTTP_204_NO_CONTENT)
-async def delete_message_by_id(room_id: UUID, message_id: UUID, db: Annotated[Session, Depends(get_db)]) -> None:
-    """Delete the specified message."""
+async def delete_message_by_id(
+    room_id: UUID, message_id: UUID, current_user: CurrentUser, db: Annotated[Session, Depends(get_db)],
+) -> None:
+    """Delete the specified message, sent by the logged in user."""
     logger.info("DELETE message by ID: %s", message_id)
 
-    crud.delete_message(db, room_id=room_id, message_id=message_id)
+    await check_author(db, room_id, message_id, current_user)
+    if await run_in_db_pool(crud.delete_message, db, room_id=room_id, message_id=message_id):
+        publish_message_event(RoomEventType.MESSAGE_DELETED, room_id, message_id)
+
+
+@router.get("/{room_id}/members", status_code=status.HTTP_200_OK, response_model=list[User])
+async def get_room_members(
+    room_id: UUID,
+    current_user: CurrentUser,
+    response: Response,
+    db: Annotated[Session, Depends(get_db)],
+    after: Annotated[str | None, Query(description="Only return members after this cursor")] = None,
+    limit: Annotated[int, Query(ge=1, le=MAX_MEMBERSHIP_PAGE_SIZE)] = DEFAULT_MEMBERSHIP_PAGE_SIZE,
+) -> list[UserModel]:
+    """
+    Fetch a page of the members of the specified room.
+
+    When the page is full, the cursor for the next one is sent in the
+    `X-Next-Cursor` header.
+
+    Returns:
+        List of users, ordered by ID.
+
+    Raises:
+        HTTPException: If the cursor is malformed, the room does not exist, or
+            it is private and the user is not a member.
+
+    """
+    logger.info("GET members of room ID: %s", room_id)
+
+    try:
+        after_id = decode_id_cursor(after) if after is not None else None
+    except ValueError as err:
+        logger.warning("Invalid member cursor")
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor") from err
+
+    if not await check_readable(db, room_id, current_user):
+        logger.error("Room does not exist")
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Room not found")
+    db_users = await run_in_db_pool(crud.read_room_members, db, room_id, after=after_id, limit=limit)
+
+    if len(db_users) == limit:
+        response.headers[NEXT_CURSOR_HEADER] = encode_id_cursor(db_users[-1].id)
+    return db_users
+
+
+async def check_member_change(
+    db: Session, room_id: UUID, user_id: UUID, current_user: UUID, *, joining: bool,
+) -> None:
+    """
+    Make sure the logged in user may add or remove a member of a room.
+
+    Users may join public rooms and leave any room themselves. Anything else
+    is up to the owner of the room, so private rooms are joined by invitation.
+
+    Raises:
+        HTTPException: If the room does not exist, or the change is not the user's to make.
+
+    """
+    db_room = await run_in_db_pool(crud.read_room, db, room_id)
+    if db_room is None:
+        logger.error("Room does not exist")
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Room not found")
+    if current_user != db_room.owner and (user_id != current_user or (joining and not db_room.public)):
+        logger.error("Not allowed to change the members of the room")
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN, detail="Not allowed to change the members of the room",
+        )
+
+
+@router.put("/{room_id}/members/{user_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def put_room_member(
+    room_id: UUID, user_id: UUID, current_user: CurrentUser, db: Annotated[Session, Depends(get_db)],
+) -> None:
+    """
+    Add a user to the members of the specified room.
+
+    Raises:
+        HTTPException: If the room or the user does not exist, or the user
+            may not be added by the logged in user.
+
+    """
+    logger.info("PUT member %s to chatroom ID: %s", user_id, room_id)
+
+    await check_member_change(db, room_id, user_id, current_user, joining=True)
+    if await run_in_db_pool(crud.read_user, db, user_id) is None:
+        logger.error("User does not exist")
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
+    await run_in_db_pool(crud.add_member, db, room_id, user_id)
+
+
+@router.delete("/{room_id}/members/{user_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def delete_room_member(
+    room_id: UUID, user_id: UUID, current_user: CurrentUser, db: Annotated[Session, Depends(get_db)],
+) -> None:
+    """Remove a user from the members of the specified room, if the logged in user may."""
+    logger.info("DELETE member %s from chatroom ID: %s", user_id, room_id)
+
+    await check_member_change(db, room_id, user_id, current_user, joining=False)
+    await run_in_db_pool(crud.remove_member, db, room_id, user_id)
+
+
+async def forward_room_events(websocket: WebSocket, subscription: Subscription) -> None:
+    """Send queued room events to the client until it falls behind."""
+    while (payload := await subscription.get()) is not None:
+        await websocket.send_text(payload)
+    await websocket.close(code=status.WS_1013_TRY_AGAIN_LATER, reason="Subscriber fell behind")
+
+
+def format_server_sent_event(room_event: RoomEvent, payload: str) -> str:
+    """
+    Format a room event for an event stream.
+
+    Only new messages get an ID, which is their cursor. Browsers send the last
+    one back in the `Last-Event-ID` header when reconnecting, so the messages
+    missed in between can be sent first.
+
+    Returns:
+        The event in the `text/event-stream` format.
+
+    """
+    event_id = f"id: {room_event.cursor}\n" if room_event.cursor is not None else ""
+    return f"{event_id}event: {room_event.event.value}\ndata: {payload}\n\n"
+
+
+# Every subscriber gets the same payload, so each event is only parsed once however many streams it goes to
+@lru_cache(maxsize=ROOM_SUBSCRIBER_QUEUE_SIZE)
+def server_sent_event(payload: str) -> str:
+    """
+    Format a serialised room event for an event stream.
+
+    Returns:
+        The event in the `text/event-stream` format.
+
+    """
+    return format_server_sent_event(RoomEvent.model_validate_json(payload), payload)
+
+
+async def stream_room_events(
+    db: Session, subscription: Subscription, after: MessageCursor | None = None,
+) -> AsyncGenerator[str, None]:
+    """
+    Send the messages of a room after a cursor, then its events as they happen, until the client falls behind.
+
+    Yields:
+        Server-sent events, and comments to keep the connection open when nothing happens.
+
+    """
+    room_id = subscription.room_id
+    while after is not None:
+        db_messages = await run_in_db_pool(crud.read_messages, db, room_id, after=after, limit=MAX_MESSAGE_PAGE_SIZE)
+        for db_message in db_messages:
+            room_event = message_event(RoomEventType.MESSAGE_CREATED, room_id, db_message.id, db_message)
+            yield format_server_sent_event(room_event, room_event.model_dump_json())
+        after = (
+            MessageCursor(db_messages[-1].creation_time, db_messages[-1].id)
+            if len(db_messages) == MAX_MESSAGE_PAGE_SIZE
+            else None
+        )
+    # The stream may stay open for hours; don't hold on to a pooled connection
+    await run_in_db_pool(db.close)
+
+    while True:
+        with anyio.move_on_after(EVENT_STREAM_KEEPALIVE_INTERVAL) as idle:
+            payload = await subscription.get()
+        if idle.cancelled_caught:
+            # Also how a client that went away is noticed, as sending to it fails
+            yield ": keep-alive\n\n"
+        elif payload is None:
+            logger.warning("Event stream of room ID %s fell behind", room_id)
+            return
+        else:
+            yield server_sent_event(payload)
+
+
+class RoomEventStream(StreamingResponse):
+    """Streams the events of a room, subscribed to for exactly as long as the response is being sent."""
+
+    media_type = "text/event-stream"
+
+    def __init__(self, db: Session, room_id: UUID, after: MessageCursor | None = None) -> None:
+        """Prepare to stream the events of a room, first catching up with the messages after the cursor."""
+        # Stop proxies from caching the stream, or buffering it before passing it on
+        super().__init__((), headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+        self.db = db
+        self.room_id = room_id
+        self.after = after
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        """Send the stream."""
+        # Subscribed before catching up, so nothing is missed in between; a message may be sent twice instead
+        with room_broadcaster.subscribe(self.room_id) as subscription:
+            self.body_iterator = stream_room_events(self.db, subscription, self.after)
+            await super().__call__(scope, receive, send)
+
+
+@router.get(
+    "/{room_id}/events",
+    status_code=status.HTTP_200_OK,
+    response_class=RoomEventStream,
+    responses={status.HTTP_200_OK: {"description": "A stream of room events"}},
+)
+async def get_room_events(
+    room_id: UUID,
+    current_user: CurrentUser,
+    db: Annotated[Session, Depends(get_db)],
+    last_event_id: Annotated[str | None, Header(description="The last event received before reconnecting")] = None,
+    after: Annotated[str | None, Query(description="First send the messages newer than this cursor")] = None,
+) -> RoomEventStream:
+    """
+    Stream the message events of the specified room as server-sent events.
+
+    For clients that cannot use the WebSocket, such as those behind proxies
+    that drop them. Each event holds the same JSON as a WebSocket message.
+
+    Returns:
+        The event stream.
+
+    Raises:
+        HTTPException: If the room does not exist, a cursor is malformed, or
+            the room is private and the user is not a member.
+
+    """
+    logger.info("GET event stream of room ID: %s", room_id)
+
+    cursor = last_event_id or after
+    try:
+        after_cursor = decode_cursor(cursor) if cursor is not None else None
+    except ValueError as err:
+        logger.warning("Invalid message cursor")
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor") from err
+
+    if not await check_readable(db, room_id, current_user):
+        logger.error("Room does not exist")
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Room not found")
+
+    return RoomEventStream(db, room_id, after_cursor)
+
+
+@websocket_router.websocket("/{room_id}/ws")
+async def room_events_websocket(
+    websocket: WebSocket,
+    room_id: UUID,
+    db: Annotated[Session, Depends(get_db)],
+    access_token: Annotated[str, Query(description="An access token from logging in")] = "",
+) -> None:
+    """Push message events of the specified room to the client as they happen."""
+    logger.info("WebSocket subscription to room ID: %s", room_id)
+
+    try:
+        claims = verify_token(access_token)
+    except InvalidTokenError as err:
+        logger.warning("Rejected access token: %s", err)
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Not authenticated")
+        return
+
+    readable = await run_in_db_pool(crud.can_read, db, room_id, claims.user_id)
+    # The connection may stay open for hours; don't hold on to a pooled connection
+    await run_in_db_pool(db.close)
+    if readable is None:
+        logger.error("Room does not exist")
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Room not found")
+        return
+    if not readable:
+        logger.error("Subscriber is not a member of the private room")
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Not allowed to read the room")
+        return
+
+    await websocket.accept()
+    with room_broadcaster.subscribe(room_id) as subscription:
+        async with anyio.create_task_group() as task_group:
+            task_group.start_soon(forward_room_events, websocket, subscription)
+            try:
+                while True:
+                    # Clients have nothing to say, but reading notices disconnects
+                    await websocket.receive_text()
+            except WebSocketDisconnect:
+                logger.info("WebSocket unsubscribed from room ID: %s", room_id)
+            task_group.cancel_scope.cancel()
@@ -3,17 +3,32 @@
 from __future__ import annotations
 
 import logging
+import time
 from typing import TYPE_CHECKING, Annotated
 from uuid import UUID  # ruff:ignore[typing-only-standard-library-import]
 
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
 from sqlalchemy.orm import Session  # ruff:ignore[typing-only-third-party-import]
 
 from eguivalet_server import crud
-from eguivalet_server.database import get_db
-from eguivalet_server.schemas import User, UserCreate
+from eguivalet_server.auth import (
+    CurrentUser,
+    TokenClaims,
+    get_current_user,
+    get_token_claims,
+    issue_token,
+    revoke,
+)
+from eguivalet_server.config import DEFAULT_MEMBERSHIP_PAGE_SIZE, MAX_MEMBERSHIP_PAGE_SIZE, NEXT_CURSOR_HEADER
+from eguivalet_server.database import get_db, run_in_db_pool
+from eguivalet_server.routes.api.v1.deletions import accept_deletion
+from eguivalet_server.schemas import AccessToken, DeletionJob, Room, User, UserCreate, UserLogin
+from eguivalet_server.security import hash_password_async, needs_rehash, verify_password_async
+from eguivalet_server.utility import decode_id_cursor, encode_id_cursor
 
 if TYPE_CHECKING:
+    from eguivalet_server.models import DeletionJob as DeletionJobModel
+    from eguivalet_server.models import Room as RoomModel
     from eguivalet_server.models import User as UserModel
 
 logger = logging.getLogger(__name__)
@@ -37,40 +52,62 @@ async def post_new_user(user: UserCreate, db: Annotated[Session, Depends(get_db)
     """
     logger.info("POST new user")
 
-    if crud.read_user(db, user_id=user.id) is not None:
+    # A deleted user keeps their ID and email address until they have been purged
+    if await run_in_db_pool(crud.read_user, db, user_id=user.id, include_deleted=True) is not None:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="User already exists")
-    if crud.read_user_by_email(db, email=user.email) is not None:
+    if await run_in_db_pool(crud.read_user_by_email, db, email=user.email, include_deleted=True) is not None:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="User already exists")
-    return crud.create_user(db, user=user)
+
+    # Hashing may have to wait its turn; don't hold on to a pooled connection meanwhile
+    await run_in_db_pool(db.close)
+    password_hash = await hash_password_async(user.password.get_secret_value())
+    return await run_in_db_pool(crud.create_user, db, user=user, password_hash=password_hash)
 
 
-@router.post("/login", status_code=status.HTTP_200_OK, response_model=User)
-async def post_login_user(user: User) -> User:
+@router.post("/login", status_code=status.HTTP_200_OK, response_model=AccessToken)
+async def post_login_user(credentials: UserLogin, db: Annotated[Session, Depends(get_db)]) -> AccessToken:
     """
     Log the user in.
 
     Returns:
-        User object.
+        An access token for the other routes.
+
+    Raises:
+        HTTPException: If the email address or the password is wrong.
 
     """
-    logger.info("POST login user %s", user.username)
-    return user
+    db_user = await run_in_db_pool(crud.read_user_by_email, db, email=credentials.email)
+    password_hash = db_user.password_hash if db_user is not None else None
+    # Verifying may have to wait its turn; don't hold on to a pooled connection meanwhile
+    await run_in_db_pool(db.close)
 
+    password = credentials.password.get_secret_value()
+    # A missing user is checked against a dummy hash, so it takes as long as a wrong password
+    if not await verify_password_async(password, password_hash) or db_user is None or password_hash is None:
+        logger.warning("Failed login")
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Incorrect email address or password")
 
-@router.post("/logout", status_code=status.HTTP_200_OK, response_model=User)
-async def post_logout_user(user: User) -> User:
-    """
-    Log the user out.
+    if needs_rehash(password_hash):
+        # The cost settings changed since the password was last hashed
+        new_hash = await hash_password_async(password)
+        await run_in_db_pool(crud.update_password_hash, db, db_user.id, new_hash)
 
-    Returns:
-        User object.
+    logger.info("POST login user %s", db_user.id)
+    token, claims = issue_token(db_user.id)
+    return AccessToken(access_token=token, expires_in=claims.expires - int(time.time()), user_id=claims.user_id)
 
-    """
-    logger.info("POST logout user %s", user.username)
-    return user
 
+@router.post("/logout", status_code=status.HTTP_204_NO_CONTENT)
+async def post_logout_user(
+    claims: Annotated[TokenClaims, Depends(get_token_claims)], db: Annotated[Session, Depends(get_db)],
+) -> None:
+    """Log the user out, revoking the access token the request was sent with."""
+    logger.info("POST logout user %s", claims.user_id)
 
-@router.get("/{user_id}", status_code=status.HTTP_200_OK, response_model=User)
+    await run_in_db_pool(revoke, db, claims)
+
+
+@router.get("/{user_id}", status_code=status.HTTP_200_OK, response_model=User, dependencies=[Depends(get_current_user)])
 async def get_user_by_id(user_id: UUID, db: Annotated[Session, Depends(get_db)]) -> UserModel:
     """
     Get user by user ID.
@@ -84,14 +121,54 @@ async def get_user_by_id(user_id: UUID, db: Annotated[Session, Depends(get_db)])
     """
     logger.info("GET user %s", user_id)
 
-    db_user = crud.read_user(db, user_id=user_id)
+    db_user = await run_in_db_pool(crud.read_user, db, user_id=user_id)
     if db_user is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
     return db_user
 
 
+@router.get("/{user_id}/rooms", status_code=status.HTTP_200_OK, response_model=list[Room])
+async def get_user_rooms(
+    user_id: UUID,
+    current_user: CurrentUser,
+    response: Response,
+    db: Annotated[Session, Depends(get_db)],
+    after: Annotated[str | None, Query(description="Only return rooms after this cursor")] = None,
+    limit: Annotated[int, Query(ge=1, le=MAX_MEMBERSHIP_PAGE_SIZE)] = DEFAULT_MEMBERSHIP_PAGE_SIZE,
+) -> list[RoomModel]:
+    """
+    Fetch a page of the rooms the user is a member of; only the public ones, unless it is the logged in user.
+
+    When the page is full, the cursor for the next one is sent in the
+    `X-Next-Cursor` header.
+
+    Returns:
+        List of rooms, ordered by ID.
+
+    Raises:
+        HTTPException: If the cursor is malformed.
+
+    """
+    logger.info("GET rooms of user %s", user_id)
+
+    try:
+        after_id = decode_id_cursor(after) if after is not None else None
+    except ValueError as err:
+        logger.warning("Invalid room cursor")
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor") from err
+
+    db_rooms = await run_in_db_pool(
+        crud.read_user_rooms, db, user_id, after=after_id, limit=limit, public_only=user_id != current_user,
+    )
+    if len(db_rooms) == limit:
+        response.headers[NEXT_CURSOR_HEADER] = encode_id_cursor(db_rooms[-1].id)
+    return db_rooms
+
+
 @router.put("/{user_id}", status_code=status.HTTP_200_OK, response_model=User)
-async def update_user_by_id(user_id: UUID, user: User, db: Annotated[Session, Depends(get_db)]) -> UserModel:
+async def update_user_by_id(
+    user_id: UUID, user: User, current_user: CurrentUser, db: Annotated[Session, Depends(get_db)],
+) -> UserModel:
     """
     Edit user by user ID.
 
@@ -99,20 +176,49 @@ async def update_user_by_id(user_id: UUID, user: User, db: Annotated[Session, De
         The updated user object.
 
     Raises:
-        HTTPException: If the user does not exist.
+        HTTPException: If the user is someone else, or does not exist.
 
     """
     logger.info("PUT user %s", user_id)
 
-    db_user = crud.update_user(db, user=user)
+    if current_user != user_id or user.id != user_id:
+        logger.error("Not allowed to change another user")
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not allowed to change another user")
+
+    db_user = await run_in_db_pool(crud.update_user, db, user=user)
     if db_user is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
     return db_user
 
 
-@router.delete("/{user_id}", status_code=status.HTTP_204_NO_CONTENT)
-async def delete_user_by_id(user_id: UUID, db: Annotated[Session, Depends(get_db)]) -> None:
-    """Delete user by user ID."""
+@router.delete("/{user_id}", status_code=status.HTTP_202_ACCEPTED, response_model=DeletionJob)
+async def delete_user_by_id(
+    user_id: UUID,
+    current_user: CurrentUser,
+    request: Request,
+    response: Response,
+    db: Annotated[Session, Depends(get_db)],
+) -> DeletionJobModel:
+    """
+    Delete user by user ID.
+
+    The user is gone at once; their messages and memberships are purged in
+    the background, which the job in the Location header tracks.
+
+    Returns:
+        Deletion job object.
+
+    Raises:
+        HTTPException: If the user is someone else, or does not exist.
+
+    """
     logger.info("DELETE user %s", user_id)
 
-    crud.delete_user(db, user_id=user_id)
+    if current_user != user_id:
+        logger.error("Not allowed to change another user")
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not allowed to change another user")
+
+    db_job = await run_in_db_pool(crud.delete_user, db, user_id=user_id)
+    if db_job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
+    return accept_deletion(db_job, request, response)
@@ -3,9 +3,10 @@
 import logging
 
 from fastapi import APIRouter, status
-from fastapi.responses import PlainTextResponse
+from fastapi.responses import PlainTextResponse, Response
 
 from eguivalet_server.config import ROBOTS_TXT
+from eguivalet_server.metrics import CONTENT_TYPE, registry
 from eguivalet_server.schemas import HelloWorld
 
 logger = logging.getLogger(__name__)
@@ -39,3 +40,15 @@ async def get_robots_txt() -> str:
     """
     logger.info("GET robots.txt")
     return ROBOTS_TXT.read_text()
+
+
+@router.get("/metrics", status_code=status.HTTP_200_OK, response_class=PlainTextResponse)
+async def get_metrics() -> Response:
+    """
+    Give the server metrics in the Prometheus text format.
+
+    Returns:
+        The current value of every metric.
+
+    """
+    return Response(content=registry.render(), media_type=CONTENT_TYPE)
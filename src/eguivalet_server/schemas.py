@@ -8,7 +8,15 @@
 
 from pydantic import BaseModel, Field, SecretStr, validator
 
-from eguivalet_server.config import MAX_MESSAGE_LENGTH, MIN_MESSAGE_LENGTH, AccessLevel
+from eguivalet_server.config import (
+    MAX_MESSAGE_BATCH_SIZE,
+    MAX_MESSAGE_LENGTH,
+    MIN_MESSAGE_LENGTH,
+    AccessLevel,
+    DeletionKind,
+    DeletionStatus,
+    RoomEventType,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -36,6 +44,22 @@ class UserCreate(UserBase):
     password: SecretStr
 
 
+class UserLogin(BaseModel):
+    """Used when logging in."""
+
+    email: str
+    password: SecretStr
+
+
+class AccessToken(BaseModel):
+    """Issued when logging in, and sent back in the `Authorization: Bearer` header."""
+
+    access_token: str
+    token_type: str = "bearer"  # ruff:ignore[hardcoded-password-string]
+    expires_in: int  # Seconds
+    user_id: UUID
+
+
 class User(UserBase):
     """User of the system."""
 
@@ -95,6 +119,40 @@ def user_id_exists(cls: type[Message], value: UUID) -> UUID:  # type: ignore[mis
         return value  # NOTE: Implement if needed
 
 
+class MessageBatch(BaseModel):
+    """Several messages sent to a chatroom at once."""
+
+    messages: list[Message]
+
+    @validator("messages")
+    def batch_size_acceptable(cls: type[MessageBatch], value: list[Message]) -> list[Message]:  # type: ignore[misc] # ruff:ignore[invalid-first-argument-name-for-method]
+        """
+        Verify that the batch is neither empty nor too large.
+
+        Returns:
+            The given value if valid.
+
+        Raises:
+            ValueError: If the given value is not valid.
+
+        """
+        if not value:
+            msg = "Batch is empty"
+            raise ValueError(msg)
+        if len(value) > MAX_MESSAGE_BATCH_SIZE:
+            msg = "Batch is too large"
+            raise ValueError(msg)
+        return value
+
+
+class MessageBatchResult(BaseModel):
+    """Outcome of a single message in a batch."""
+
+    id: UUID
+    created: bool
+    detail: str | None = None
+
+
 class EncryptedMessage(Message):
     """Encrypted message sent in a chatroom."""
 
@@ -139,3 +197,37 @@ def public_if_no_owner(cls: type[Room], value: UUID | None, values: dict[str, ob
             msg = "Private rooms must have an owner"
             raise ValueError(msg)
         return value
+
+
+# Event models
+
+
+class RoomEvent(BaseModel):
+    """Event pushed to everyone subscribed to a chatroom."""
+
+    event: RoomEventType
+    room_id: UUID
+    message_id: UUID
+    message: Message | None = None
+    cursor: str | None = None  # Of a new message, for fetching the messages after it
+
+
+# Deletion models
+
+
+class DeletionJob(BaseModel):
+    """Progress of purging what a deleted room or user left behind."""
+
+    id: UUID
+    kind: DeletionKind
+    target_id: UUID
+    status: DeletionStatus
+    messages_deleted: int
+    memberships_deleted: int
+    creation_time: datetime
+    completion_time: datetime | None = None
+
+    class Config:
+        """Configure the deletion job schema."""
+
+        orm_mode = True
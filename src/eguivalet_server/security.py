@@ -0,0 +1,151 @@
+"""Hashes and verifies passwords without holding up the event loop."""
+
+from __future__ import annotations
+
+import base64
+import hashlib
+import hmac
+import logging
+import secrets
+from functools import cache
+
+import anyio
+import anyio.to_thread
+
+from eguivalet_server.config import (
+    PASSWORD_HASH_N,
+    PASSWORD_HASH_P,
+    PASSWORD_HASH_R,
+    PASSWORD_HASH_THREADS,
+)
+
+logger = logging.getLogger(__name__)
+
+ALGORITHM = "scrypt"
+SALT_LENGTH = 16  # bytes
+KEY_LENGTH = 32  # bytes
+
+# Hashing takes tens of milliseconds of CPU on purpose. The threads doing it
+# are capped separately from the database threads, so a burst of logins queues
+# up here instead of delaying every other request. OpenSSL releases the GIL
+# while hashing, so the threads run in parallel.
+password_hash_limiter = anyio.CapacityLimiter(PASSWORD_HASH_THREADS)
+
+
+def b64encode(data: bytes) -> str:
+    """
+    Encode bytes as unpadded base64.
+
+    Returns:
+        The encoded string.
+
+    """
+    return base64.b64encode(data).decode().rstrip("=")
+
+
+def b64decode(data: str) -> bytes:
+    """
+    Decode unpadded base64.
+
+    Returns:
+        The decoded bytes.
+
+    """
+    return base64.b64decode(data + "=" * (-len(data) % 4))
+
+
+def scrypt(password: str, salt: bytes, n: int, r: int, p: int) -> bytes:
+    """
+    Derive a key from a password.
+
+    Returns:
+        The derived key.
+
+    """
+    # scrypt needs 128 * n * r bytes, which the default limit of 32 MiB may not cover
+    return hashlib.scrypt(
+        password.encode(), salt=salt, n=n, r=r, p=p, maxmem=256 * n * r + 1024 * 1024, dklen=KEY_LENGTH,
+    )
+
+
+def hash_password(password: str, n: int = PASSWORD_HASH_N, r: int = PASSWORD_HASH_R, p: int = PASSWORD_HASH_P) -> str:
+    """
+    Hash a password with a random salt, at the configured cost unless told otherwise.
+
+    Returns:
+        The hash, along with the algorithm, cost and salt used, eg. "scrypt$16384$8$1$<salt>$<key>".
+
+    """
+    salt = secrets.token_bytes(SALT_LENGTH)
+    return f"{ALGORITHM}${n}${r}${p}${b64encode(salt)}${b64encode(scrypt(password, salt, n, r, p))}"
+
+
+def verify_password(password: str, password_hash: str) -> bool:
+    """
+    Check a password against a hash made by `hash_password`.
+
+    Returns:
+        True if the password matches; False if not, or if the hash is not one of ours.
+
+    """
+    try:
+        algorithm, n, r, p, salt, key = password_hash.split("$")
+        if algorithm != ALGORITHM:
+            return False
+        derived = scrypt(password, b64decode(salt), int(n), int(r), int(p))
+    except ValueError:
+        logger.warning("Unrecognised password hash")
+        return False
+    return hmac.compare_digest(derived, b64decode(key))
+
+
+def needs_rehash(password_hash: str) -> bool:
+    """
+    Check whether a hash was made with other than the configured cost.
+
+    Returns:
+        True if the password should be hashed again.
+
+    """
+    return not password_hash.startswith(f"{ALGORITHM}${PASSWORD_HASH_N}${PASSWORD_HASH_R}${PASSWORD_HASH_P}$")
+
+
+@cache
+def dummy_hash() -> str:
+    """
+    Hash a password nobody knows, to verify against when a user does not exist.
+
+    Returns:
+        The hash.
+
+    """
+    return hash_password(secrets.token_urlsafe())
+
+
+async def hash_password_async(password: str) -> str:
+    """
+    Hash a password in the password hashing threads.
+
+    Returns:
+        The hash.
+
+    """
+    return await anyio.to_thread.run_sync(hash_password, password, limiter=password_hash_limiter)
+
+
+async def verify_password_async(password: str, password_hash: str | None) -> bool:
+    """
+    Check a password in the password hashing threads.
+
+    Without a hash to check against, a dummy one is checked instead, so a
+    login for a user who does not exist takes as long as a wrong password.
+
+    Returns:
+        True if the password matches.
+
+    """
+    def verify() -> bool:
+        return verify_password(password, password_hash or dummy_hash())
+
+    matches = await anyio.to_thread.run_sync(verify, limiter=password_hash_limiter)
+    return matches and password_hash is not None
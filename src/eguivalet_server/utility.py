@@ -1 +1,98 @@
 """Miscellaneous utility functions."""
+
+from __future__ import annotations
+
+import base64
+from datetime import datetime
+from typing import NamedTuple
+from uuid import UUID
+
+
+class MessageCursor(NamedTuple):
+    """Position in a room's message history, in the order messages are listed."""
+
+    creation_time: datetime
+    id: UUID
+
+
+def encode_cursor(creation_time: datetime, message_id: UUID) -> str:
+    """
+    Turn a message's sort key into an opaque pagination cursor.
+
+    Returns:
+        A URL-safe cursor string.
+
+    """
+    raw = f"{creation_time.isoformat()}|{message_id.hex}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> MessageCursor:
+    """
+    Parse a pagination cursor created by `encode_cursor`.
+
+    Returns:
+        The message sort key the cursor points to.
+
+    Raises:
+        ValueError: If the cursor is malformed.
+
+    """
+    padding = "=" * (-len(cursor) % 4)
+    try:
+        raw = base64.urlsafe_b64decode(cursor + padding).decode()
+    except UnicodeDecodeError as err:
+        msg = "Malformed cursor"
+        raise ValueError(msg) from err
+
+    creation_time, separator, message_id = raw.partition("|")
+    if not separator:
+        msg = "Malformed cursor"
+        raise ValueError(msg)
+    return MessageCursor(datetime.fromisoformat(creation_time), UUID(message_id))
+
+
+def encode_id_cursor(item_id: UUID) -> str:
+    """
+    Turn the ID of the last item of a page into an opaque pagination cursor.
+
+    Returns:
+        A URL-safe cursor string.
+
+    """
+    return base64.urlsafe_b64encode(item_id.bytes).decode().rstrip("=")
+
+
+def decode_id_cursor(cursor: str) -> UUID:
+    """
+    Parse a pagination cursor created by `encode_id_cursor`.
+
+    Returns:
+        The ID the cursor points to.
+
+    Raises:
+        ValueError: If the cursor is malformed.
+
+    """
+    padding = "=" * (-len(cursor) % 4)
+    try:
+        return UUID(bytes=base64.urlsafe_b64decode(cursor + padding))
+    except ValueError as err:
+        msg = "Malformed cursor"
+        raise ValueError(msg) from err
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """
+    Check an If-None-Match header against the current ETag of a resource.
+
+    Weak and strong validators compare equal, as is proper for GET requests.
+
+    Returns:
+        True if the client's copy is still current.
+
+    """
+    if if_none_match.strip() == "*":
+        return True
+    current = etag.removeprefix("W/")
+    return any(candidate.strip().removeprefix("W/") == current for candidate in if_none_match.split(","))
@@ -3,21 +3,29 @@
 # pylint: disable=W0621
 
 import uuid
-from collections.abc import Generator
+from collections.abc import Callable, Generator
+from datetime import datetime, timedelta
 
 import pytest
 from fastapi.testclient import TestClient
 from pydantic import SecretStr
 from sqlalchemy import create_engine
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, sessionmaker
 from sqlalchemy_utils import create_database, database_exists
 
 from eguivalet_server import crud, schemas
+from eguivalet_server.auth import issue_token
 from eguivalet_server.config import (
     SQLALCHEMY_TEST_DATABASE_URL,
 )
 from eguivalet_server.database import Base, get_db
+from eguivalet_server.launcher import DATABASE_READY_VARIABLE
 from eguivalet_server.main import app
+from eguivalet_server.purger import purger
+from eguivalet_server.query_monitor import query_monitor
+from eguivalet_server.security import hash_password
+
+TEST_PASSWORD = "CORRECT HORSE BATTERY STAPLE"  # ruff:ignore[hardcoded-password-string]
 
 
 @pytest.fixture(scope="session")
@@ -39,7 +47,14 @@ def db_engine():
     if not database_exists:  # type: ignore[truthy-function]
         create_database(engine.url)
 
+    # Start from a fresh schema so new tables and indexes are always in place
+    Base.metadata.drop_all(bind=engine)
     Base.metadata.create_all(bind=engine)
+
+    # Check every request, and fail the ones that lazy load in a loop
+    query_monitor.sample_rate = 1.0
+    query_monitor.strict = True
+    query_monitor.instrument(engine)
     return engine
 
 
@@ -64,19 +79,43 @@ def db_session(db_engine):
     database_session.rollback()
     connection.close()
 
+    # The rollback undoes the changes, but not what was cached from them
+    crud.clear_caches()
+
 
 @pytest.fixture
-def client(db_session) -> Generator[TestClient, None, None]:
+def token_headers() -> Callable[[uuid.UUID], dict[str, str]]:
+    """
+    Create access tokens for any user, without logging in.
+
+    Returns:
+        A function giving the headers that authenticate a request as the user.
+
+    """
+
+    def headers(user_id: uuid.UUID) -> dict[str, str]:
+        token, _ = issue_token(user_id)
+        return {"Authorization": f"Bearer {token}"}
+
+    return headers
+
+
+@pytest.fixture
+def client(db_session, db_engine, test_users, token_headers, monkeypatch) -> Generator[TestClient, None, None]:
     """
     Override the normal database access with test database.
 
     Yields:
-         Configured test client.
+         Configured test client, logged in as the first of the example users.
 
     """
     app.dependency_overrides[get_db] = lambda: db_session
+    # Keep the background purger off the main database; it cannot see the uncommitted test data anyway
+    monkeypatch.setattr(purger, "session_factory", sessionmaker(bind=db_engine))
+    # The test database is set up by `db_engine`, so the main one is left alone
+    monkeypatch.setenv(DATABASE_READY_VARIABLE, "1")
 
-    with TestClient(app) as test_client:
+    with TestClient(app, headers=token_headers(test_users[0])) as test_client:
         yield test_client
 
 
@@ -100,8 +139,20 @@ def public_rooms(db_session) -> list[uuid.UUID]:
     return rooms
 
 
+@pytest.fixture(scope="session")
+def test_password_hash() -> str:
+    """
+    Hash the password of the example users once, as hashing is slow on purpose.
+
+    Returns:
+        The password hash.
+
+    """
+    return hash_password(TEST_PASSWORD)
+
+
 @pytest.fixture
-def test_users(db_session) -> list[uuid.UUID]:
+def test_users(db_session, test_password_hash) -> list[uuid.UUID]:
     """
     Add some example users to the database.
 
@@ -116,8 +167,9 @@ def test_users(db_session) -> list[uuid.UUID]:
             schemas.UserCreate(
                 username=f"TestUser{num}",
                 email=f"test.user{num}@jmail.com",
-                password=SecretStr("CORRECT HORSE BATTERY STAPLE"),
+                password=SecretStr(TEST_PASSWORD),
             ),
+            test_password_hash,
         ).id
         for num in range(5)
     ]
@@ -147,3 +199,29 @@ def private_rooms(db_session, test_users) -> list[uuid.UUID]:
     ]
 
     return rooms
+
+
+@pytest.fixture
+def room_messages(db_session, public_rooms, test_users) -> list[uuid.UUID]:
+    """
+    Add some example messages to the first public room, one minute apart.
+
+    Returns:
+        A list of message UUIDs, oldest first.
+
+    """
+    start = datetime(2022, 9, 11, 12, 0)  # ruff:ignore[call-datetime-without-tzinfo]
+    messages: list[uuid.UUID] = [
+        crud.create_message(
+            db_session,
+            schemas.Message(
+                user_id=test_users[num % len(test_users)],
+                message=f"Message #{num}",
+                creation_time=start + timedelta(minutes=num),
+            ),
+            public_rooms[0],
+        ).id
+        for num in range(10)
+    ]
+
+    return messages
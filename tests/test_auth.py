@@ -0,0 +1,86 @@
+"""Unit tests for access tokens."""
+
+import json
+import uuid
+
+import pytest
+
+from eguivalet_server import crud
+from eguivalet_server.auth import (
+    InvalidTokenError,
+    RevocationList,
+    b64url_decode,
+    b64url_encode,
+    issue_token,
+    revoked_tokens,
+    sync_revocations,
+    verified_tokens,
+    verify_token,
+)
+from eguivalet_server.config import TOKEN_LIFETIME
+
+
+def test_issued_tokens_verify():
+    """Tests that a fresh token is accepted, and is remembered for next time."""
+    user_id = uuid.uuid4()
+    token, claims = issue_token(user_id)
+    assert verify_token(token) == claims
+    assert claims.user_id == user_id
+
+    hits = verified_tokens.hits
+    assert verify_token(token) == claims
+    assert verified_tokens.hits == hits + 1
+
+
+def test_tampered_tokens_are_rejected():
+    """Tests that changing the payload or the algorithm breaks the token."""
+    token, _ = issue_token(uuid.uuid4())
+    header, payload, signature = token.split(".")
+
+    claims = json.loads(b64url_decode(payload))
+    claims["sub"] = str(uuid.uuid4())
+    forged_payload = b64url_encode(json.dumps(claims).encode())
+    unsigned_header = b64url_encode(b'{"alg":"none","typ":"JWT"}')
+
+    for forged in (
+        f"{header}.{forged_payload}.{signature}",
+        f"{unsigned_header}.{payload}.",
+        f"{header}.{payload}",
+        "",
+        "a.b.c.d",
+    ):
+        with pytest.raises(InvalidTokenError):
+            verify_token(forged)
+
+
+def test_expired_tokens_are_rejected():
+    """Tests that a token stops working once its lifetime is up."""
+    token, claims = issue_token(uuid.uuid4(), now=1_000_000)
+    assert claims.expires == 1_000_000 + TOKEN_LIFETIME
+    assert verify_token(token, now=claims.expires - 1) == claims
+    with pytest.raises(InvalidTokenError, match="expired"):
+        verify_token(token, now=claims.expires)
+
+
+def test_revocation_list_forgets_expired_tokens():
+    """Tests that the revocation list only keeps tokens that would still work."""
+    revoked = RevocationList()
+    revoked.add("old", 100)
+    revoked.update([("new", 300)], now=200)
+    assert "new" in revoked
+    assert "old" not in revoked
+    assert len(revoked) == 1
+
+
+def test_revocations_are_synced_from_the_database(db_session):
+    """Tests that tokens revoked by another worker are picked up, and expired ones removed."""
+    token, claims = issue_token(uuid.uuid4())
+    crud.revoke_token(db_session, claims.token_id, claims.expires)
+    crud.revoke_token(db_session, "expired", 1)
+    assert verify_token(token) == claims
+
+    sync_revocations(db_session)
+    with pytest.raises(InvalidTokenError, match="revoked"):
+        verify_token(token)
+    assert "expired" not in revoked_tokens
+    assert [token_id for token_id, _ in crud.read_revoked_tokens(db_session, 0)] == [claims.token_id]
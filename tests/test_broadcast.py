@@ -0,0 +1,58 @@
+"""Unit tests for the room event hub."""
+
+import uuid
+
+import anyio
+
+from eguivalet_server.broadcast import RoomBroadcaster, Subscription
+from eguivalet_server.broker import UnixSocketBroker
+
+
+def test_publish_reaches_room_subscribers_only():
+    """Tests that events are only delivered to subscribers of the same room."""
+    broadcaster = RoomBroadcaster()
+    room_id, other_room_id = uuid.uuid4(), uuid.uuid4()
+
+    async def publish_and_receive() -> None:
+        with broadcaster.subscribe(room_id) as subscription, broadcaster.subscribe(other_room_id) as other:
+            assert broadcaster.publish(room_id, "hello") == 1
+            assert broadcaster.publish(other_room_id, "world") == 1
+            assert await subscription.get() == "hello"
+            assert await other.get() == "world"
+
+    anyio.run(publish_and_receive)
+    assert broadcaster.subscriber_count(room_id) == 0
+
+
+def test_lagging_subscriber_is_cut_off():
+    """Tests that a subscriber with a full queue receives the disconnect marker."""
+    subscription = Subscription(uuid.uuid4(), queue_size=2)
+
+    async def overflow() -> None:
+        for payload in ("a", "b", "c", "d"):
+            subscription.push(payload)
+        assert subscription.lagged
+        assert await subscription.get() is None
+
+    anyio.run(overflow)
+
+
+def test_broker_carries_events_of_subscribed_rooms():
+    """Tests that the broker listens to the rooms with subscribers, and only sends on events published here."""
+    broker = UnixSocketBroker("unused.sock")  # Never connected
+    broadcaster = RoomBroadcaster(broker)
+    room_id = uuid.uuid4()
+
+    async def publish_and_deliver() -> None:
+        with broadcaster.subscribe(room_id) as subscription, broadcaster.subscribe(room_id):
+            assert broker.rooms == {room_id}
+            assert broadcaster.publish(room_id, "local") == 2  # ruff:ignore[magic-value-comparison]
+            assert broadcaster.deliver(room_id, "remote") == 2  # ruff:ignore[magic-value-comparison]
+            assert await subscription.get() == "local"
+            assert await subscription.get() == "remote"
+        assert not broker.rooms
+        assert (await broker.next_batch()).events == [(room_id, "local")]
+
+    anyio.run(publish_and_deliver)
+    assert broadcaster.has_audience(uuid.uuid4())
+    assert not RoomBroadcaster().has_audience(room_id)
@@ -0,0 +1,260 @@
+"""Unit tests for passing room events between workers."""
+
+import socket
+import uuid
+from collections import defaultdict
+from collections.abc import Callable, Iterable, Sequence
+from contextlib import suppress
+
+import anyio
+import pytest
+
+from eguivalet_server.broker import (
+    Broker,
+    BrokerHub,
+    PostgresBroker,
+    UnixSocketBroker,
+    channel_name,
+    create_broker,
+    encode_batch,
+    parse_frame,
+)
+
+
+async def eventually(condition: Callable[[], bool]) -> None:
+    """Wait until a condition holds, failing after a few seconds."""
+    with anyio.fail_after(5):
+        while not condition():  # ruff:ignore[async-busy-wait]
+            await anyio.sleep(0.01)
+
+
+class Received:
+    """Collects the events a broker receives, by room."""
+
+    def __init__(self) -> None:
+        """Start with no events."""
+        self.events: defaultdict[uuid.UUID, list[str]] = defaultdict(list)
+
+    def __call__(self, room_id: uuid.UUID, payload: str) -> None:
+        """Record an event."""
+        self.events[room_id].append(payload)
+
+
+class FakeNotifyServer:
+    """Routes notifications between fake PostgreSQL connections, the way the database does."""
+
+    def __init__(self) -> None:
+        """Start with no connections."""
+        self.channels: defaultdict[str, set[FakeNotifyConnection]] = defaultdict(set)
+        self.notify_calls: list[int] = []
+
+    def connect(self) -> "FakeNotifyConnection":
+        """
+        Open a connection.
+
+        Returns:
+            The connection.
+
+        """
+        return FakeNotifyConnection(self)
+
+
+class FakeNotifyConnection:
+    """A PostgreSQL connection used for LISTEN and NOTIFY, with a socket pair standing in for its socket."""
+
+    def __init__(self, server: FakeNotifyServer) -> None:
+        """Connect to the fake server."""
+        self.server = server
+        self.pending: list[tuple[str, str]] = []
+        self._socket, self._peer = socket.socketpair()
+        self._socket.setblocking(False)  # ruff:ignore[boolean-positional-value-in-call]
+
+    def fileno(self) -> int:
+        """
+        Get the socket that becomes readable when there are notifications.
+
+        Returns:
+            The file descriptor.
+
+        """
+        return self._socket.fileno()
+
+    def listen(self, channels: Iterable[str]) -> None:
+        """Start receiving the notifications of the channels."""
+        for channel in channels:
+            self.server.channels[channel].add(self)
+
+    def unlisten(self, channels: Iterable[str]) -> None:
+        """Stop receiving the notifications of the channels."""
+        for channel in channels:
+            self.server.channels[channel].discard(self)
+
+    def notify(self, notifications: Sequence[tuple[str, str]]) -> None:
+        """Notify every connection listening to each channel, including this one."""
+        self.server.notify_calls.append(len(notifications))
+        for channel, payload in notifications:
+            for connection in self.server.channels[channel]:
+                connection.pending.append((channel, payload))
+                connection._peer.send(b"!")  # ruff:ignore[private-member-access]
+
+    def poll(self) -> list[tuple[str, str]]:
+        """
+        Take the notifications received so far.
+
+        Returns:
+            Channel and payload pairs.
+
+        """
+        with suppress(BlockingIOError):
+            self._socket.recv(4096)
+        notifications, self.pending = self.pending, []
+        return notifications
+
+    def close(self) -> None:
+        """Close the connection."""
+        for listeners in self.server.channels.values():
+            listeners.discard(self)
+        self._socket.close()
+        self._peer.close()
+
+
+def test_broker_batches_what_changed():
+    """Tests that a batch holds the rooms listened to or left since the last one, and the queued events."""
+    broker = UnixSocketBroker("unused.sock", queue_size=3, batch_size=2)
+    room_id, other_room_id = uuid.uuid4(), uuid.uuid4()
+
+    async def batches() -> None:
+        broker.listen(room_id)
+        broker.listen(other_room_id)
+        for payload in ("a", "b", "c", "d"):
+            broker.publish(room_id, payload)
+        assert broker.dropped == 1
+
+        batch = await broker.next_batch()
+        assert batch.listen == {room_id, other_room_id}
+        assert batch.events == [(room_id, "b"), (room_id, "c")]
+        broker.unlisten(other_room_id)
+        batch = await broker.next_batch()
+        assert (batch.listen, batch.unlisten, batch.events) == (set(), {other_room_id}, [(room_id, "d")])
+
+        with anyio.move_on_after(0.05) as timeout:
+            await broker.next_batch()
+        assert timeout.cancelled_caught
+
+    anyio.run(batches)
+    with pytest.raises(TypeError, match="connect"):
+        Broker()  # type: ignore[abstract]
+
+
+def test_frames_round_trip():
+    """Tests that encoded frames decode to the same rooms and events."""
+    room_id = uuid.uuid4()
+    broker = UnixSocketBroker("unused.sock")
+    broker.listen(room_id)
+    broker.publish(room_id, '{"event": "message_created"}')
+    batch = anyio.run(broker.next_batch)
+
+    listen, event = encode_batch(batch).splitlines()
+    assert parse_frame(listen) == (b"L", room_id, b"")
+    assert parse_frame(event) == (b"E", room_id, b'{"event": "message_created"}')
+    for line in (b"", b"X " + room_id.hex.encode(), b"E not-a-room"):
+        with pytest.raises(ValueError, match=r"."):
+            parse_frame(line)
+
+
+def test_unix_socket_broker(tmp_path):
+    """Tests that events go through the hub to the other workers listening to the room, and no others."""
+    path = str(tmp_path / "broker.sock")
+    hub = BrokerHub()
+    sender, listener, bystander = UnixSocketBroker(path), UnixSocketBroker(path), UnixSocketBroker(path)
+    received = {broker: Received() for broker in (sender, listener, bystander)}
+    room_id = uuid.uuid4()
+
+    async def exchange() -> None:
+        async with anyio.create_task_group() as tasks:
+            await tasks.start(hub.serve, path)
+            for broker, deliver in received.items():
+                tasks.start_soon(broker.run, deliver)
+
+            sender.listen(room_id)
+            listener.listen(room_id)
+            await eventually(lambda: hub.listener_count(room_id) == 2)  # ruff:ignore[magic-value-comparison]
+            for number in range(100):
+                sender.publish(room_id, f'{{"number": {number}}}')
+            await eventually(lambda: len(received[listener].events[room_id]) == 100)  # ruff:ignore[magic-value-comparison]
+            assert received[listener].events[room_id] == [f'{{"number": {number}}}' for number in range(100)]
+
+            listener.unlisten(room_id)
+            await eventually(lambda: hub.listener_count(room_id) == 1)
+            listener.publish(room_id, "{}")
+            await eventually(lambda: received[sender].events[room_id] == ["{}"])
+            tasks.cancel_scope.cancel()
+
+    anyio.run(exchange)
+    assert not received[sender].events[room_id][1:]
+    assert not received[bystander].events
+
+
+def test_unix_socket_broker_reconnects(tmp_path):
+    """Tests that brokers keep trying to reach the hub, then listen and send what was queued."""
+    path = str(tmp_path / "broker.sock")
+    sender, listener = UnixSocketBroker(path), UnixSocketBroker(path)
+    received = Received()
+    room_id = uuid.uuid4()
+
+    async def reconnect() -> None:
+        async with anyio.create_task_group() as tasks:
+            tasks.start_soon(listener.run, received, 0.01)
+            listener.listen(room_id)
+            sender.publish(room_id, "{}")
+            await anyio.sleep(0.05)
+
+            hub = BrokerHub()
+            await tasks.start(hub.serve, path)
+            await eventually(lambda: hub.listener_count(room_id) == 1)
+            tasks.start_soon(sender.run, Received(), 0.01)
+            await eventually(lambda: received.events[room_id] == ["{}"])
+            tasks.cancel_scope.cancel()
+
+    anyio.run(reconnect)
+
+
+def test_postgres_broker():
+    """Tests that events are sent as a single notification batch, and received by the listening brokers only."""
+    server = FakeNotifyServer()
+    sender, listener = PostgresBroker(server.connect), PostgresBroker(server.connect)
+    received = {sender: Received(), listener: Received()}
+    room_id = uuid.uuid4()
+
+    async def exchange() -> None:
+        async with anyio.create_task_group() as tasks:
+            for broker, deliver in received.items():
+                tasks.start_soon(broker.run, deliver)
+            sender.listen(room_id)
+            listener.listen(room_id)
+            await eventually(lambda: len(server.channels[channel_name(room_id)]) == 2)  # ruff:ignore[magic-value-comparison]
+            for number in range(3):
+                sender.publish(room_id, str(number))
+            await eventually(lambda: len(received[listener].events[room_id]) == 3)  # ruff:ignore[magic-value-comparison]
+
+            listener.unlisten(room_id)
+            await eventually(lambda: len(server.channels[channel_name(room_id)]) == 1)
+            sender.publish(room_id, "3")
+            await eventually(lambda: server.notify_calls == [3, 1])
+            tasks.cancel_scope.cancel()
+
+    anyio.run(exchange)
+    assert received[listener].events[room_id] == ["0", "1", "2"]
+    # The database notifies the sender too, which skips its own events
+    assert not received[sender].events
+
+
+def test_create_broker():
+    """Tests that the configured broker is created, or none for a single worker."""
+    assert create_broker(None) is None
+    assert create_broker("local") is None
+    assert isinstance(create_broker("unix", "broker.sock"), UnixSocketBroker)
+    with pytest.raises(ValueError, match="SOCKET"):
+        create_broker("unix", None)
+    with pytest.raises(ValueError, match="sqlite"):
+        create_broker("postgresql")
@@ -0,0 +1,201 @@
+"""Unit tests for the process-local caches."""
+
+import uuid
+from datetime import datetime, timedelta
+from typing import NamedTuple
+
+from eguivalet_server.cache import RecentMessages, TTLCache
+
+START = datetime(2022, 9, 11, 12)  # ruff:ignore[call-datetime-without-tzinfo]
+
+
+class FakeClock:
+    """A clock that only moves when told to."""
+
+    def __init__(self) -> None:
+        """Start the clock at zero."""
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        """
+        Tell the current time.
+
+        Returns:
+            The time set by the test.
+
+        """
+        return self.now
+
+
+class Message(NamedTuple):
+    """A message as cached."""
+
+    id: uuid.UUID
+    message: str
+    creation_time: datetime
+
+
+def make_messages(count: int, start: int = 0) -> list[Message]:
+    """
+    Create messages a minute apart.
+
+    Returns:
+        The messages, oldest first.
+
+    """
+    return [Message(uuid.uuid4(), f"#{num}", START + timedelta(minutes=num)) for num in range(start, start + count)]
+
+
+def cursor(message: Message) -> tuple[datetime, uuid.UUID]:
+    """
+    Point at a message.
+
+    Returns:
+        The sort key of the message.
+
+    """
+    return (message.creation_time, message.id)
+
+
+def test_ttl_cache_expiry():
+    """Tests that entries expire once their time to live has passed."""
+    clock = FakeClock()
+    cache: TTLCache[str, int] = TTLCache(ttl=10, clock=clock)
+
+    cache.set("key", 1)
+    clock.now = 9.9
+    assert cache.get("key") == 1
+
+    clock.now = 10
+    assert cache.get("key") is None
+
+
+def test_ttl_cache_refuses_stale_generation():
+    """Tests that a value loaded before an invalidation is not stored."""
+    cache: TTLCache[str, int] = TTLCache(ttl=10)
+
+    generation = cache.generation
+    cache.invalidate("key")
+    assert not cache.set("key", 1, generation=generation)
+    assert cache.get("key") is None
+
+    assert cache.set("key", 2, generation=cache.generation)
+    assert cache.get("key") == 2  # ruff:ignore[magic-value-comparison]
+
+
+def test_ttl_cache_evicts_least_recently_used():
+    """Tests that a full cache evicts the entry that was used the longest time ago."""
+    cache: TTLCache[str, int] = TTLCache(ttl=10, maxsize=2)
+
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3  # ruff:ignore[magic-value-comparison]
+    assert len(cache) == 2  # ruff:ignore[magic-value-comparison]
+
+
+def test_ttl_cache_counts_hits_and_misses():
+    """Tests that lookups are counted as hits or misses, expired entries being misses."""
+    clock = FakeClock()
+    cache: TTLCache[str, int] = TTLCache(ttl=10, clock=clock)
+
+    cache.set("key", 1)
+    cache.get("key")
+    cache.get("other")
+    clock.now = 10
+    cache.get("key")
+
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_recent_messages_pages():
+    """Tests which pages a room's newest messages can answer for."""
+    cache: RecentMessages[Message] = RecentMessages(room_size=4, budget=10_000, ttl=10, entry_overhead=100)
+    room_id = uuid.uuid4()
+    messages = make_messages(6)
+    assert cache.read(room_id, None, 2) is None
+
+    assert cache.fill(room_id, messages[-4:], cache.generation(room_id))
+    assert cache.read(room_id, None, 2) == messages[-2:]
+    assert cache.read(room_id, None, 5) is None
+    assert cache.read(room_id, cursor(messages[2]), 2) == messages[3:5]
+    assert cache.read(room_id, cursor(messages[5]), 2) == []
+    assert cache.read(room_id, cursor(messages[1]), 2) is None
+    assert cache.read(room_id, (datetime.now().astimezone(), uuid.uuid4()), 2) is None
+    assert (cache.hits, cache.misses) == (3, 4)
+
+    other_room_id = uuid.uuid4()
+    assert cache.fill(other_room_id, messages[:2], cache.generation(other_room_id))
+    assert cache.read(other_room_id, None, 5) == messages[:2]
+    assert cache.read(other_room_id, (START - timedelta(days=1), uuid.uuid4()), 5) == messages[:2]
+
+
+def test_recent_messages_follow_writes():
+    """Tests that new, edited and deleted messages are reflected, and the oldest forgotten when full."""
+    cache: RecentMessages[Message] = RecentMessages(room_size=3, budget=10_000, ttl=10, entry_overhead=100)
+    room_id = uuid.uuid4()
+    messages = make_messages(5)
+    cache.fill(room_id, messages[:2], cache.generation(room_id))
+
+    cache.add(room_id, messages[2:4])
+    cache.add(room_id, messages[3:4])
+    assert cache.read(room_id, None, 3) == messages[1:4]
+    assert cache.read(room_id, cursor(messages[0]), 3) is None
+
+    edited = messages[2]._replace(message="Edited")
+    cache.replace(room_id, edited)
+    cache.remove(room_id, messages[3].id)
+    cache.add(room_id, [messages[4], Message(uuid.uuid4(), "Too old", START - timedelta(days=1))])
+    assert cache.read(room_id, cursor(messages[1]), 3) == [edited, messages[4]]
+    assert cache.size == 3 * 100 + len("#1Edited#4")
+
+
+def test_recent_messages_forget_rooms_given_other_times():
+    """Tests that a message with a time zone, in a room cached without, drops the room and keeps the size right."""
+    cache: RecentMessages[Message] = RecentMessages(room_size=3, budget=10_000, ttl=10, entry_overhead=100)
+    room_id, other_room_id = uuid.uuid4(), uuid.uuid4()
+    cache.fill(room_id, make_messages(2), cache.generation(room_id))
+    cache.fill(other_room_id, make_messages(1), cache.generation(other_room_id))
+
+    aware = Message(uuid.uuid4(), "Zoned", datetime.now().astimezone())
+    cache.add(room_id, [*make_messages(1, start=2), aware])
+    assert room_id not in cache
+    assert cache.size == 100 + len("#0")
+
+
+def test_recent_messages_refuse_stale_fill():
+    """Tests that messages read before a write to the room are not stored."""
+    cache: RecentMessages[Message] = RecentMessages(room_size=3, budget=10_000, ttl=10, entry_overhead=100)
+    room_id = uuid.uuid4()
+
+    generation = cache.generation(room_id)
+    cache.add(room_id, make_messages(1))
+    assert not cache.fill(room_id, [], generation)
+    assert room_id not in cache
+
+    cache.invalidate(room_id)
+    assert cache.fill(room_id, [], cache.generation(room_id))
+    cache.clear()
+    assert room_id not in cache
+
+
+def test_recent_messages_budget_and_expiry():
+    """Tests that the least recently read rooms are evicted to stay within the budget, and tails expire."""
+    clock = FakeClock()
+    cache: RecentMessages[Message] = RecentMessages(room_size=3, budget=500, ttl=10, entry_overhead=100, clock=clock)
+    rooms = [uuid.uuid4() for _ in range(3)]
+    for room_id in rooms[:2]:
+        cache.fill(room_id, make_messages(2), cache.generation(room_id))
+    cache.read(rooms[0], None, 1)
+    cache.fill(rooms[2], make_messages(2), cache.generation(rooms[2]))
+
+    assert [room_id in cache for room_id in rooms] == [True, False, True]
+    assert cache.size == 2 * (2 * 100 + len("#0#1"))
+
+    clock.now = 10
+    assert rooms[0] not in cache
+    assert cache.read(rooms[0], None, 1) is None
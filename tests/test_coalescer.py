@@ -0,0 +1,87 @@
+"""Unit tests for group committing writes."""
+
+import asyncio
+import uuid
+
+import pytest
+from fastapi import status
+
+from eguivalet_server import crud
+from eguivalet_server.coalescer import WriteCoalescer
+from eguivalet_server.config import ROOM_ROOT
+from eguivalet_server.routes.api.v1 import rooms
+
+
+def test_concurrent_writes_share_a_batch():
+    """Tests that writes submitted within the window are flushed together."""
+    batches: list[list[int]] = []
+
+    def flush(batch: list[int]) -> list[int]:
+        batches.append(batch)
+        return [item * 2 for item in batch]
+
+    coalescer = WriteCoalescer(flush, window=0.05, max_batch=100)
+
+    async def submit_all() -> list[int]:
+        return await asyncio.gather(*(coalescer.submit(item) for item in range(10)))
+
+    assert asyncio.run(submit_all()) == [item * 2 for item in range(10)]
+    assert batches == [list(range(10))]
+
+
+def test_batches_are_capped():
+    """Tests that no batch grows beyond the maximum size."""
+    batches: list[list[int]] = []
+
+    def flush(batch: list[int]) -> list[int]:
+        batches.append(batch)
+        return batch
+
+    coalescer = WriteCoalescer(flush, window=10, max_batch=4)
+
+    async def submit_all() -> list[int]:
+        return await asyncio.gather(*(coalescer.submit(item) for item in range(10)))
+
+    assert asyncio.run(submit_all()) == list(range(10))
+    assert [len(batch) for batch in batches] == [4, 4, 2]
+
+
+def test_failed_batch_fails_every_write():
+    """Tests that an error while committing reaches everyone in the batch."""
+
+    def flush(batch: list[int]) -> list[int]:
+        msg = "Disk full"
+        raise OSError(msg)
+
+    coalescer = WriteCoalescer(flush, window=0.01, max_batch=100)
+
+    async def submit_all() -> list[object]:
+        return await asyncio.gather(*(coalescer.submit(item) for item in range(3)), return_exceptions=True)
+
+    assert all(isinstance(result, OSError) for result in asyncio.run(submit_all()))
+
+
+def test_post_message_by_id_coalesced(client, db_session, public_rooms, test_users, monkeypatch):
+    """Tests posting messages through the group commit path."""
+    coalescer = WriteCoalescer(lambda batch: crud.create_messages(db_session, batch), window=0.001, max_batch=8)
+    monkeypatch.setattr(rooms, "MESSAGE_WRITE_COALESCING", True)
+    monkeypatch.setattr(rooms, "message_writer", coalescer)
+
+    data = {
+        "id": str(uuid.uuid4()),
+        "user_id": str(test_users[0]),
+        "message": "Carpe diem.",
+    }
+
+    response = client.post(f"{ROOM_ROOT}/{public_rooms[0]}", json=data)
+    assert response.status_code == status.HTTP_200_OK, response.text
+    assert response.json()["message"] == "Carpe diem."
+
+    with pytest.MonkeyPatch.context() as patch:
+        # Bypass the existence check to make the coalescer detect the duplicate
+        patch.setattr(crud, "read_message", lambda *_args, **_kwargs: None)
+        response = client.post(f"{ROOM_ROOT}/{public_rooms[0]}", json=data)
+    assert response.status_code == status.HTTP_400_BAD_REQUEST, response.text
+
+    response = client.get(f"{ROOM_ROOT}/{public_rooms[0]}/messages/{data['id']}")
+    assert response.status_code == status.HTTP_200_OK, response.text
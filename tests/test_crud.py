@@ -1,11 +1,17 @@
 """Tests for CRUD-operations not tested elsewhere."""
 
-import pytest
+import uuid
+from datetime import datetime, timezone
 
-from eguivalet_server import crud
+from sqlalchemy import create_engine, inspect, update
+from sqlalchemy.orm import Session
+
+from eguivalet_server import crud, models, schemas
+from eguivalet_server.config import AccessLevel, DeletionKind, DeletionStatus
+from eguivalet_server.query_monitor import track_queries
+from eguivalet_server.utility import MessageCursor
 
 
-@pytest.mark.xfail
 def test_read_public_rooms_all(db_session, public_rooms):
     """Tests fetching all public rooms."""
     db_rooms = crud.read_public_rooms(db_session)
@@ -13,6 +19,23 @@ def test_read_public_rooms_all(db_session, public_rooms):
     assert {room.id for room in db_rooms} == set(public_rooms), (db_rooms, public_rooms)
 
 
+def test_read_public_rooms_excludes_private(db_session, public_rooms, private_rooms):
+    """Tests that private rooms are not listed as public."""
+    db_rooms = crud.read_public_rooms(db_session)
+    assert {room.id for room in db_rooms} == set(public_rooms), (db_rooms, public_rooms)
+
+
+def test_read_public_rooms_cached_invalidation(db_session, public_rooms, test_users):
+    """Tests that creating and deleting rooms invalidates the cached listing."""
+    cached = crud.read_public_rooms_cached(db_session)
+    assert crud.read_public_rooms_cached(db_session) is cached
+
+    crud.delete_room(db_session, public_rooms[0], test_users[0])
+    updated = crud.read_public_rooms_cached(db_session)
+    assert updated.etag != cached.etag
+    assert {room.id for room in updated.rooms} == set(public_rooms[1:])
+
+
 def test_read_users_all(db_session, test_users):
     """Tests fetching all users."""
     db_users = crud.read_users(db_session)
@@ -38,3 +61,341 @@ def test_read_messages_empty(db_session, public_rooms):
     """Tests fetching messages from an empty chatroom."""
     db_messages = crud.read_messages(db_session, public_rooms[0])
     assert len(db_messages) == 0, db_messages
+
+
+def test_read_messages_latest_page(db_session, public_rooms, room_messages):
+    """Tests fetching the newest messages of a room without a cursor."""
+    db_messages = crud.read_messages(db_session, public_rooms[0], limit=3)
+    assert [message.id for message in db_messages] == room_messages[-3:], db_messages
+
+
+def test_read_messages_before_cursor(db_session, public_rooms, room_messages):
+    """Tests paging backwards through a room's history."""
+    oldest = crud.read_messages(db_session, public_rooms[0], limit=3)[0]
+    cursor = MessageCursor(oldest.creation_time, oldest.id)
+
+    db_messages = crud.read_messages(db_session, public_rooms[0], before=cursor, limit=3)
+    assert [message.id for message in db_messages] == room_messages[-6:-3], db_messages
+
+
+def test_read_messages_after_cursor(db_session, public_rooms, room_messages):
+    """Tests paging forwards through a room's history."""
+    first = crud.read_message(db_session, public_rooms[0], room_messages[1])
+    cursor = MessageCursor(first.creation_time, first.id)
+
+    db_messages = crud.read_messages(db_session, public_rooms[0], after=cursor, limit=4)
+    assert [message.id for message in db_messages] == room_messages[2:6], db_messages
+
+
+def test_read_message_rows(db_session, public_rooms, room_messages):
+    """Tests that message rows hold what the message schema shows, in the same order as the models."""
+    db_messages = crud.read_messages(db_session, public_rooms[0], limit=4)
+    rows = crud.read_message_rows(db_session, public_rooms[0], limit=4)
+    assert [row.id for row in rows] == room_messages[-4:], rows
+    assert [row._asdict() for row in rows] == [
+        schemas.Message.model_validate(db_message, from_attributes=True).model_dump() for db_message in db_messages
+    ]
+
+    cursor = MessageCursor(rows[0].creation_time, rows[0].id)
+    assert [row.id for row in crud.read_message_rows(db_session, public_rooms[0], before=cursor, limit=2)] == (
+        room_messages[-6:-4]
+    )
+    assert [row.id for row in crud.read_message_rows(db_session, public_rooms[0], after=cursor, limit=2)] == (
+        room_messages[-3:-1]
+    )
+
+
+def test_read_message_rows_cached(db_session, public_rooms, test_users, room_messages):
+    """Tests that recent messages are read from the cache once warm, and that writes keep it up to date."""
+    rows = crud.read_message_rows(db_session, public_rooms[0], limit=3)
+    assert [row.id for row in rows] == room_messages[-3:], rows
+    cursor = MessageCursor(rows[0].creation_time, rows[0].id)
+
+    with track_queries("warm") as queries:
+        assert [row.id for row in crud.read_message_rows(db_session, public_rooms[0], limit=2)] == room_messages[-2:]
+        assert [row.id for row in crud.read_message_rows(db_session, public_rooms[0], after=cursor, limit=5)] == (
+            room_messages[-2:]
+        )
+    assert not queries.counts, queries.counts
+
+    new = crud.create_message(db_session, schemas.Message(user_id=test_users[0], message="New"), public_rooms[0])
+    crud.create_messages(db_session, [(public_rooms[0], schemas.Message(user_id=test_users[0], message="Batch"))])
+    crud.update_message(
+        db_session, schemas.Message(id=room_messages[-1], user_id=test_users[0], message="Edited"), public_rooms[0],
+    )
+    crud.delete_message(db_session, public_rooms[0], room_messages[-2])
+
+    expected = [row.message for row in crud.query_message_rows(db_session, public_rooms[0], limit=4)]
+    assert expected == ["Message #7", "Edited", "New", "Batch"], expected
+    with track_queries("updated") as queries:
+        assert [row.message for row in crud.read_message_rows(db_session, public_rooms[0], limit=4)] == expected
+        assert crud.read_message_rows(db_session, public_rooms[0], limit=1)[0].id != new.id
+    assert not queries.counts, queries.counts
+
+
+def test_create_messages_with_time_zone(db_session, public_rooms, test_users, room_messages):
+    """Tests that batched messages sent with a time zone are cached as the database stores them."""
+    assert len(crud.read_message_rows(db_session, public_rooms[0], limit=3)) == 3  # ruff:ignore[magic-value-comparison]
+    message = schemas.Message(
+        user_id=test_users[0], message="Zoned", creation_time=datetime(2030, 1, 1, 12, tzinfo=timezone.utc),
+    )
+    assert crud.create_messages(db_session, [(public_rooms[0], message)]) == [True]
+
+    assert crud.read_message_rows(db_session, public_rooms[0], limit=3) == (
+        crud.query_message_rows(db_session, public_rooms[0], limit=3)
+    )
+    assert crud.read_message_rows(db_session, public_rooms[0], limit=1)[0].id == message.id
+
+
+def test_read_message_rows_old_cursor(db_session, public_rooms, room_messages, monkeypatch):
+    """Tests that pages after a cursor older than the cached messages are read from the database."""
+    monkeypatch.setattr(crud.recent_messages, "room_size", 4)
+    first = crud.read_message(db_session, public_rooms[0], room_messages[0])
+    cursor = MessageCursor(first.creation_time, first.id)
+
+    rows = crud.read_message_rows(db_session, public_rooms[0], after=cursor, limit=3)
+    assert [row.id for row in rows] == room_messages[1:4], rows
+    assert public_rooms[0] in crud.recent_messages
+
+
+def test_create_messages_multiple_rooms(db_session, public_rooms, test_users):
+    """Tests bulk creating messages spread over several rooms."""
+    messages = [
+        (room_id, schemas.Message(user_id=test_users[0], message=f"Hello, room #{num}"))
+        for num, room_id in enumerate(public_rooms)
+    ]
+
+    assert crud.create_messages(db_session, messages) == [True] * len(messages)
+    assert crud.create_messages(db_session, messages[:1]) == [False]
+
+    for room_id, message in messages:
+        assert [db_message.id for db_message in crud.read_messages(db_session, room_id)] == [message.id]
+
+
+def test_can_post_cached(db_session, private_rooms, test_users):
+    """Tests that permission checks are answered from the cache once it is warm."""
+    room, owner, outsider = private_rooms[0], test_users[0], test_users[1]
+    assert crud.can_post(db_session, room, owner)
+    assert not crud.can_post(db_session, room, outsider)
+
+    with track_queries("warm") as queries:
+        assert crud.can_post(db_session, room, owner)
+        assert not crud.can_post(db_session, room, outsider)
+    assert not queries.counts, queries.counts
+
+    crud.add_member(db_session, room, outsider)
+    assert crud.can_post(db_session, room, outsider)
+    crud.remove_member(db_session, room, outsider)
+    assert not crud.can_post(db_session, room, outsider)
+
+
+def test_can_post_banned(db_session, public_rooms, test_users):
+    """Tests that banned users may not post even in public rooms."""
+    db_session.execute(
+        update(models.User).where(models.User.id == test_users[0]).values(global_access_level=AccessLevel.BANNED),
+    )
+    assert not crud.can_post(db_session, public_rooms[0], test_users[0])
+    assert crud.can_post(db_session, public_rooms[0], test_users[1])
+    assert crud.read_posters(db_session, public_rooms[0], test_users[:2]) == {test_users[1]}
+
+
+def test_can_post_nonexistent_room(db_session, test_users):
+    """Tests that permission checks tell rooms that do not exist apart."""
+    room = crud.create_room(db_session, schemas.Room(name="Short-lived"))
+    assert crud.can_post(db_session, room.id, test_users[0])
+
+    crud.delete_room(db_session, room.id, test_users[0])
+    assert crud.can_post(db_session, room.id, test_users[0]) is None
+
+
+def test_deleted_users_are_hidden(db_session, public_rooms, test_users):
+    """Tests that a deleted user is gone at once, but keeps their ID and email address until purged."""
+    crud.add_member(db_session, public_rooms[0], test_users[0])
+    job = crud.delete_user(db_session, test_users[0])
+    assert (job.kind, job.target_id, job.status) == (DeletionKind.USER, test_users[0], DeletionStatus.PENDING)
+    assert crud.delete_user(db_session, test_users[0]).id == job.id
+    assert crud.delete_user(db_session, uuid.uuid4()) is None
+
+    assert crud.read_user(db_session, test_users[0]) is None
+    assert crud.read_user_by_email(db_session, "test.user0@jmail.com") is None
+    assert crud.read_user(db_session, test_users[0], include_deleted=True) is not None
+    assert crud.read_user_by_email(db_session, "test.user0@jmail.com", include_deleted=True) is not None
+    assert test_users[0] not in {user.id for user in crud.read_users(db_session)}
+    assert not crud.read_room_members(db_session, public_rooms[0])
+    assert not crud.can_post(db_session, public_rooms[0], test_users[0])
+
+
+def test_purge_deleted_room(db_session, public_rooms, test_users, room_messages):
+    """Tests that a deleted room is purged batch by batch: its messages, then its memberships, then the room."""
+    for user in test_users[:3]:
+        crud.add_member(db_session, public_rooms[0], user)
+    job = crud.delete_room(db_session, public_rooms[0], test_users[0])
+    # Messages stay readable by room ID until purged, so they may be cached again meanwhile
+    assert len(crud.read_message_rows(db_session, public_rooms[0], limit=3)) == 3  # ruff:ignore[magic-value-comparison]
+    assert crud.read_pending_deletions(db_session) == [job.id]
+
+    batches = 1
+    while not crud.purge_deletion_batch(db_session, job.id, batch_size=4):
+        batches += 1
+    # Ten messages in three batches, three memberships in one, and the room in the last
+    assert batches == 5  # ruff:ignore[magic-value-comparison]
+    db_session.refresh(job)
+    assert (job.status, job.messages_deleted, job.memberships_deleted) == (DeletionStatus.DONE, len(room_messages), 3)
+    assert job.completion_time is not None
+
+    assert crud.read_room(db_session, public_rooms[0], include_deleted=True) is None
+    assert not crud.read_message_rows(db_session, public_rooms[0], limit=3)
+    assert not crud.read_pending_deletions(db_session)
+    assert crud.purge_deletion_batch(db_session, job.id)
+
+
+def test_purge_deleted_user(db_session, public_rooms, test_users, room_messages):
+    """Tests that purging a deleted user removes their messages and memberships everywhere, and nothing else."""
+    for room in public_rooms[:2]:
+        crud.add_member(db_session, room, test_users[0])
+    crud.add_member(db_session, public_rooms[0], test_users[1])
+    job = crud.delete_user(db_session, test_users[0])
+
+    while not crud.purge_deletion_batch(db_session, job.id, batch_size=1):
+        pass
+    db_session.refresh(job)
+    assert (job.status, job.messages_deleted, job.memberships_deleted) == (DeletionStatus.DONE, 2, 2)
+
+    remaining = crud.read_messages(db_session, public_rooms[0])
+    assert len(remaining) == len(room_messages) - 2
+    assert test_users[0] not in {message.user_id for message in remaining}
+    assert [user.id for user in crud.read_room_members(db_session, public_rooms[0])] == [test_users[1]]
+    assert crud.read_user(db_session, test_users[0], include_deleted=True) is None
+
+
+def test_search_messages_follows_edits(db_session, public_rooms, test_users):
+    """Tests that the search index keeps up with new, edited, batched and deleted messages."""
+    message = crud.create_message(
+        db_session, schemas.Message(user_id=test_users[0], message="Meet at the lighthouse"), public_rooms[0],
+    )
+    crud.create_messages(db_session, [
+        (public_rooms[0], schemas.Message(user_id=test_users[1], message="Which lighthouse?")),
+        (public_rooms[1], schemas.Message(user_id=test_users[1], message="Wrong lighthouse")),
+    ])
+    assert len(crud.search_messages(db_session, public_rooms[0], "lighthouse")) == 2  # ruff:ignore[magic-value-comparison]
+    assert [found.id for found in crud.search_messages(db_session, public_rooms[0], "MEET")] == [message.id]
+
+    crud.update_message(
+        db_session, schemas.Message(id=message.id, user_id=test_users[0], message="Meet at the pier"), public_rooms[0],
+    )
+    assert [found.id for found in crud.search_messages(db_session, public_rooms[0], "pier")] == [message.id]
+    assert len(crud.search_messages(db_session, public_rooms[0], "lighthouse")) == 1
+
+    crud.delete_message(db_session, public_rooms[0], message.id)
+    assert crud.search_messages(db_session, public_rooms[0], "pier") == []
+
+
+def test_search_messages_quotes_query_syntax(db_session, public_rooms, test_users):
+    """Tests that search terms are looked for as words, rather than run as FTS5 query syntax."""
+    message = schemas.Message(user_id=test_users[0], message='Say "NEAR" OR else')
+    crud.create_message(db_session, message, public_rooms[0])
+    for terms in ('NEAR(" OR', "room_id:x", "*", "   "):
+        assert isinstance(crud.search_messages(db_session, public_rooms[0], terms), list), terms
+    assert len(crud.search_messages(db_session, public_rooms[0], '"near" or')) == 1
+
+
+def test_rebuild_search_index():
+    """Tests that messages written before the index existed are found once it is rebuilt."""
+    engine = create_engine("sqlite://")
+    models.Base.metadata.create_all(bind=engine)
+    with engine.begin() as connection:
+        for trigger in ("insert", "update", "delete"):
+            connection.exec_driver_sql(f"DROP TRIGGER messages_fts_{trigger}")
+        connection.exec_driver_sql("DROP TABLE messages_fts")
+
+    with Session(engine) as db:
+        room = crud.create_room(db, schemas.Room(name="Old room"))
+        crud.create_message(db, schemas.Message(user_id=uuid.uuid4(), message="Written long ago"), room.id)
+
+        with engine.begin() as connection:
+            assert models.rebuild_search_index(connection)
+        assert len(crud.search_messages(db, room.id, "ago")) == 1
+
+
+# The tables as the first release created them in SQLite
+BASELINE_SCHEMA = (
+    """
+    CREATE TABLE rooms (
+        id CHAR(32) NOT NULL, name VARCHAR(256), public BOOLEAN, owner CHAR(32), PRIMARY KEY (id)
+    )
+    """,
+    "CREATE INDEX ix_rooms_id ON rooms (id)",
+    """
+    CREATE TABLE users (
+        id CHAR(32) NOT NULL, username VARCHAR(64), email VARCHAR(255), password_hash VARCHAR(128),
+        global_access_level INTEGER, PRIMARY KEY (id), UNIQUE (email)
+    )
+    """,
+    "CREATE INDEX ix_users_id ON users (id)",
+    """
+    CREATE TABLE users_in_rooms (
+        user_id CHAR(32) NOT NULL, room_id CHAR(32) NOT NULL, PRIMARY KEY (user_id, room_id),
+        FOREIGN KEY(user_id) REFERENCES users (id), FOREIGN KEY(room_id) REFERENCES rooms (id)
+    )
+    """,
+    """
+    CREATE TABLE messages (
+        id CHAR(32) NOT NULL, user_id CHAR(32), room_id CHAR(32), message VARCHAR(256), creation_time DATETIME,
+        last_edited DATETIME, PRIMARY KEY (id), FOREIGN KEY(user_id) REFERENCES users (id),
+        FOREIGN KEY(room_id) REFERENCES rooms (id)
+    )
+    """,
+    "CREATE INDEX ix_messages_id ON messages (id)",
+)
+
+
+def test_upgrade_schema():
+    """Tests that a database from before the soft deletes gets the new columns and indexes."""
+    engine = create_engine("sqlite://")
+    models.Base.metadata.create_all(bind=engine)
+    with engine.begin() as connection:
+        connection.exec_driver_sql("DROP INDEX ix_messages_user_id")
+        for table in ("rooms", "users"):
+            connection.exec_driver_sql(f"ALTER TABLE {table} DROP COLUMN deletion_time")
+
+    models.Base.metadata.create_all(bind=engine)
+    with Session(engine) as db:
+        room = crud.create_room(db, schemas.Room(name="Old room"))
+        assert crud.delete_room(db, room.id, uuid.uuid4()) is not None
+        assert crud.read_room(db, room.id) is None
+    with engine.connect() as connection:
+        indexes = {index["name"] for index in inspect(connection).get_indexes("messages")}
+    assert "ix_messages_user_id" in indexes
+
+
+def test_upgrade_baseline_schema():
+    """Tests that a database created by the first release gets every column and index added since, search included."""
+    engine = create_engine("sqlite://")
+    room_id, message_id = uuid.uuid4(), uuid.uuid4()
+    with engine.begin() as connection:
+        for statement in BASELINE_SCHEMA:
+            connection.exec_driver_sql(statement)
+        connection.exec_driver_sql(
+            "INSERT INTO rooms (id, name, public) VALUES (?, 'Old room', 1)", (room_id.hex,),
+        )
+        connection.exec_driver_sql(
+            "INSERT INTO messages (id, room_id, message, creation_time) VALUES (?, ?, 'Written long ago', ?)",
+            (message_id.hex, room_id.hex, "2020-01-01 00:00:00.000000"),
+        )
+
+    models.Base.metadata.create_all(bind=engine)
+    with Session(engine) as db:
+        assert [message.id for message in crud.search_messages(db, room_id, "long")] == [message_id]
+    with engine.connect() as connection:
+        inspector = inspect(connection)
+        for column in models.LATE_COLUMNS:
+            assert column.name in {existing["name"] for existing in inspector.get_columns(column.table.name)}
+        indexes = {
+            index["name"] for table in ("messages", "rooms", "users_in_rooms") for index in inspector.get_indexes(table)
+        }
+    assert {
+        "ix_messages_room_id_creation_time_id",
+        "ix_messages_user_id",
+        "ix_rooms_public",
+        "ix_users_in_rooms_room_id_user_id",
+    } <= indexes
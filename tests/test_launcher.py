@@ -0,0 +1,93 @@
+"""Unit tests for the server launcher."""
+
+import os
+import socket
+from pathlib import Path
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, inspect
+
+from eguivalet_server import launcher
+from eguivalet_server.launcher import (
+    DATABASE_READY_VARIABLE,
+    EVENT_BROKER_SOCKET_VARIABLE,
+    EVENT_BROKER_VARIABLE,
+    bind_socket,
+    build_config,
+    default_workers,
+    parse_args,
+    running_broker_hub,
+    share_event_broker,
+)
+from eguivalet_server.main import app
+
+
+def test_parse_args_defaults_to_production():
+    """Tests that the launcher runs a worker per CPU and does not reload by default."""
+    args = parse_args([])
+    assert args.workers == default_workers(), args
+    assert not args.reload
+    assert not args.rebuild_search_index
+
+
+def test_parse_args_rejects_zero_workers():
+    """Tests that at least one worker is required."""
+    with pytest.raises(SystemExit):
+        parse_args(["--workers", "0"])
+
+
+def test_build_config_production():
+    """Tests that production mode runs several workers with the fastest event loop available."""
+    workers = 4
+    config = build_config(parse_args(["--workers", str(workers)]))
+    assert config.workers == workers, config.workers
+    assert not config.should_reload
+    assert config.loop == "auto", config.loop
+    assert config.http == "auto", config.http
+    assert config.timeout_graceful_shutdown is not None
+
+
+def test_build_config_reload_uses_one_process():
+    """Tests that development mode reloads a single process."""
+    config = build_config(parse_args(["--reload", "--workers", "4"]))
+    assert config.workers == 1, config.workers
+    assert config.should_reload
+
+
+@pytest.mark.skipif(not hasattr(socket, "SO_REUSEPORT"), reason="SO_REUSEPORT is not supported")
+def test_bind_socket_allows_port_reuse():
+    """Tests that a second server can bind the port while the first still holds it."""
+    first = bind_socket("127.0.0.1", 0, 16)
+    try:
+        port = first.getsockname()[1]
+        second = bind_socket("127.0.0.1", port, 16)
+        second.close()
+    finally:
+        first.close()
+
+
+def test_share_event_broker(monkeypatch):
+    """Tests that several workers get a Unix socket broker, run by the launcher, and a single one none."""
+    monkeypatch.delenv(EVENT_BROKER_VARIABLE, raising=False)
+    monkeypatch.delenv(EVENT_BROKER_SOCKET_VARIABLE, raising=False)
+    assert share_event_broker(1) is None
+    assert os.environ[EVENT_BROKER_VARIABLE] == "local"
+
+    path = share_event_broker(4)
+    assert path is not None
+    assert os.environ[EVENT_BROKER_VARIABLE] == "unix"
+    assert os.environ[EVENT_BROKER_SOCKET_VARIABLE] == path
+    with running_broker_hub(path), socket.socket(socket.AF_UNIX) as worker:
+        worker.connect(path)
+    assert not Path(path).exists()
+
+
+def test_app_initialises_database_without_launcher(tmp_path, monkeypatch):
+    """Tests that the app creates the tables itself when an ASGI server runs it without the launcher."""
+    engine = create_engine(f"sqlite:///{tmp_path / 'server.db'}")
+    monkeypatch.setattr(launcher, "engine", engine)
+    monkeypatch.setenv(DATABASE_READY_VARIABLE, "")
+    with TestClient(app):
+        assert os.environ[DATABASE_READY_VARIABLE]
+    assert "messages" in inspect(engine).get_table_names()
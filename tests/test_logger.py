@@ -0,0 +1,85 @@
+"""Unit tests for the logging pipeline."""
+
+import json
+import logging
+import queue
+
+from fastapi import status
+
+from eguivalet_server.config import REQUEST_ID_HEADER, ROOM_ROOT
+from eguivalet_server.logger import (
+    DroppingQueueHandler,
+    JsonFormatter,
+    RedactingFilter,
+    RequestIdFilter,
+    SamplingFilter,
+    request_id,
+)
+
+
+def make_record(message: str, *args: object) -> logging.LogRecord:
+    """
+    Create a log record as a logger would.
+
+    Returns:
+        The record.
+
+    """
+    return logging.LogRecord("test", logging.INFO, __file__, 1, message, args, None)
+
+
+def test_json_formatter_includes_request_id_and_exception():
+    """Tests that records are formatted as JSON, with the request ID and any exception."""
+    token = request_id.set("abc123")
+    try:
+        record = make_record("GET room %s", 42)
+        RequestIdFilter().filter(record)
+    finally:
+        request_id.reset(token)
+    error = ValueError("boom")
+    record.exc_info = (ValueError, error, error.__traceback__)
+
+    entry = json.loads(JsonFormatter().format(record))
+    assert entry["message"] == "GET room 42", entry
+    assert entry["request_id"] == "abc123", entry
+    assert entry["level"] == "INFO", entry
+    assert "ValueError: boom" in entry["exception"], entry
+
+
+def test_sampling_filter_keeps_a_fraction():
+    """Tests that only every n:th sampled message is kept, and other messages are left alone."""
+    sampling = SamplingFilter(["GET messages from room ID: %s"], rate=0.25)
+    kept = [sampling.filter(make_record("GET messages from room ID: %s", index)) for index in range(8)]
+    assert kept == [True, False, False, False, True, False, False, False], kept
+    assert sampling.filter(make_record("DELETE chatroom by ID: %s", 1))
+
+
+def test_redacting_filter_hides_access_tokens():
+    """Tests that access tokens are cut out of logged URLs, and other messages are left alone."""
+    record = make_record('%s - "WebSocket %s" [accepted]', "127.0.0.1:5000", "/rooms/1/ws?access_token=abc.def&x=1")
+    assert RedactingFilter().filter(record)
+    assert record.getMessage() == '127.0.0.1:5000 - "WebSocket /rooms/1/ws?access_token=[redacted]&x=1" [accepted]'
+
+    record = make_record("GET room %s", 42)
+    assert RedactingFilter().filter(record)
+    assert record.args == (42,), record.args
+
+
+def test_queue_handler_drops_records_when_full():
+    """Tests that a full queue drops records instead of blocking the caller."""
+    handler = DroppingQueueHandler(queue.Queue(1))
+    handler.handle(make_record("first"))
+    handler.handle(make_record("second"))
+    assert handler.dropped == 1, handler.dropped
+    assert handler.queue.get_nowait().msg == "first"
+
+
+def test_request_id_is_returned(client):
+    """Tests that responses carry the request ID, reusing a valid one sent by the client."""
+    response = client.get(f"{ROOM_ROOT}/", headers={REQUEST_ID_HEADER: "client-id.1"})
+    assert response.status_code == status.HTTP_200_OK, response.text
+    assert response.headers[REQUEST_ID_HEADER] == "client-id.1", response.headers
+
+    response = client.get(f"{ROOM_ROOT}/", headers={REQUEST_ID_HEADER: "not valid!"})
+    assert response.headers[REQUEST_ID_HEADER] != "not valid!", response.headers
+    assert response.headers[REQUEST_ID_HEADER], response.headers
@@ -0,0 +1,121 @@
+"""Unit tests for the metrics subsystem."""
+
+import uuid
+
+import anyio
+import pytest
+from fastapi import status
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import QueuePool
+
+from eguivalet_server.config import ROOM_ROOT
+from eguivalet_server.metrics import (
+    CONTENT_TYPE,
+    CRUD_CALL_DURATION,
+    CRUD_DB_SECONDS,
+    DB_STATEMENT_DURATION,
+    HTTP_REQUEST_DURATION,
+    Counter,
+    Histogram,
+    Metric,
+    MetricsRegistry,
+    instrument_engine,
+    track_db_call,
+)
+
+
+def test_counter_render():
+    """Tests that counters render one escaped sample per label combination."""
+    counter = Counter("test_total", "A test counter.", ("path",))
+    counter.inc('say "hi"\n')
+    counter.inc('say "hi"\n', amount=2)
+
+    test_registry = MetricsRegistry()
+    test_registry.register(counter)
+    assert test_registry.render().splitlines() == [
+        "# HELP test_total A test counter.",
+        "# TYPE test_total counter",
+        r'test_total{path="say \"hi\"\n"} 3.0',
+    ]
+    with pytest.raises(TypeError, match="samples"):
+        Metric("test_untyped", "A metric without samples.")  # type: ignore[abstract]
+
+
+def test_histogram_buckets_are_cumulative():
+    """Tests that histogram buckets count every observation at or below their bound."""
+    histogram = Histogram("test_seconds", "A test histogram.", buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 5.0):
+        histogram.observe(value)
+
+    lines = histogram.render()
+    assert 'test_seconds_bucket{le="0.1"} 2.0' in lines, lines
+    assert 'test_seconds_bucket{le="1.0"} 3.0' in lines, lines
+    assert 'test_seconds_bucket{le="+Inf"} 4.0' in lines, lines
+    assert "test_seconds_sum 5.65" in lines, lines
+    assert "test_seconds_count 4.0" in lines, lines
+
+
+def test_instrument_engine_times_statements():
+    """Tests that statements are timed, and attributed to the database call running them."""
+    engine = create_engine("sqlite://", poolclass=QueuePool)
+    test_registry = MetricsRegistry()
+    instrument_engine(engine, test_registry)
+    selects = DB_STATEMENT_DURATION.count("SELECT")
+
+    def query() -> None:
+        with engine.connect() as connection:
+            connection.execute(text("SELECT 1"))
+
+    with track_db_call(query):
+        query()
+
+    assert DB_STATEMENT_DURATION.count("SELECT") == selects + 1
+    assert CRUD_DB_SECONDS.value("query") > 0
+    assert "db_pool_checked_out 0.0" in test_registry.render()
+
+
+def test_db_calls_are_timed_in_the_thread_pool():
+    """Tests that calls through the database thread pool are counted under the function name."""
+    from eguivalet_server.database import run_in_db_pool  # ruff:ignore[import-outside-top-level]
+
+    def some_crud_function() -> int:
+        return 1
+
+    calls = CRUD_CALL_DURATION.count("some_crud_function")
+    anyio.run(run_in_db_pool, some_crud_function)
+    assert CRUD_CALL_DURATION.count("some_crud_function") == calls + 1
+
+
+def test_get_metrics(client, public_rooms):  # pylint: disable=W0613
+    """Tests that requests are timed under their route template, and served in the Prometheus format."""
+    route = f"{ROOM_ROOT}/{{room_id}}"
+    requests = HTTP_REQUEST_DURATION.count("GET", route, "200")
+
+    client.get(f"{ROOM_ROOT}/{public_rooms[0]}")
+    client.get(f"{ROOM_ROOT}/{public_rooms[1]}")
+    assert HTTP_REQUEST_DURATION.count("GET", route, "200") == requests + 2
+
+    response = client.get("/metrics")
+    assert response.status_code == status.HTTP_200_OK, response.text
+    assert response.headers["content-type"] == CONTENT_TYPE
+    assert f'http_request_duration_seconds_count{{method="GET",route="{route}",status="200"}}' in response.text
+    assert str(public_rooms[0]) not in response.text
+
+
+def test_get_metrics_cache_counters(client, public_rooms, test_users):
+    """Tests that the hits and misses of the process-local caches are exported."""
+    message = {"user_id": str(test_users[0]), "message": "Counted"}
+    for _ in range(2):
+        client.post(f"{ROOM_ROOT}/{public_rooms[0]}", json=message | {"id": str(uuid.uuid4())})
+
+    response = client.get("/metrics")
+    assert 'cache_hits_total{cache="room_public"}' in response.text, response.text
+    assert 'cache_misses_total{cache="access_level"}' in response.text, response.text
+
+
+def test_get_metrics_unmatched_route(client):
+    """Tests that requests to unknown paths share a single time series."""
+    requests = HTTP_REQUEST_DURATION.count("GET", "unmatched", "404")
+    response = client.get("/no/such/path")
+    assert response.status_code == status.HTTP_404_NOT_FOUND, response.text
+    assert HTTP_REQUEST_DURATION.count("GET", "unmatched", "404") == requests + 1
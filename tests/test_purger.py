@@ -0,0 +1,57 @@
+"""Unit tests for purging deleted rooms and users in the background."""
+
+import uuid
+from collections.abc import Callable
+
+import anyio
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from eguivalet_server import crud, models, schemas
+from eguivalet_server.config import DeletionStatus
+from eguivalet_server.purger import Purger
+
+
+async def eventually(condition: Callable[[], bool]) -> None:
+    """Wait until a condition holds, failing after a few seconds."""
+    with anyio.fail_after(5):
+        while not condition():  # ruff:ignore[async-busy-wait]
+            await anyio.sleep(0.01)
+
+
+def test_purger(tmp_path):
+    """Tests that the purger resumes unfinished jobs at startup, and starts on new ones when woken."""
+    engine = create_engine(f"sqlite:///{tmp_path / 'purge.db'}")
+    models.Base.metadata.create_all(bind=engine)
+    session_factory = sessionmaker(bind=engine)
+    purger = Purger(session_factory, batch_size=2, pause=0, poll_interval=60)
+
+    with session_factory() as db:
+        rooms = [crud.create_room(db, schemas.Room(name=f"Room #{num}")).id for num in range(2)]
+        for room in rooms:
+            for num in range(5):
+                crud.create_message(db, schemas.Message(user_id=uuid.uuid4(), message=f"Message #{num}"), room)
+        left_over = crud.delete_room(db, rooms[0], uuid.uuid4()).id
+
+    def finished(job_id: uuid.UUID) -> bool:
+        with session_factory() as db:
+            return crud.read_deletion_job(db, job_id).status == DeletionStatus.DONE
+
+    async def purge() -> uuid.UUID:
+        async with anyio.create_task_group() as tasks:
+            tasks.start_soon(purger.run)
+            await eventually(lambda: finished(left_over))
+
+            with session_factory() as db:
+                new = crud.delete_room(db, rooms[1], uuid.uuid4()).id
+            purger.wake()
+            await eventually(lambda: finished(new))
+            tasks.cancel_scope.cancel()
+        return new
+
+    new = anyio.run(purge)
+    with session_factory() as db:
+        assert [crud.read_deletion_job(db, job_id).messages_deleted for job_id in (left_over, new)] == [5, 5]
+        assert not crud.read_messages(db, rooms[1])
+        assert crud.read_room(db, rooms[1], include_deleted=True) is None
+    crud.clear_caches()
@@ -0,0 +1,76 @@
+"""Unit tests for the slow query log and the repeated statement detector."""
+
+import logging
+
+import pytest
+from fastapi import status
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import Session
+
+from eguivalet_server import crud, models, schemas
+from eguivalet_server.config import ROOM_ROOT
+from eguivalet_server.query_monitor import (
+    QueryMonitor,
+    RepeatedQueryError,
+    normalise,
+    query_monitor,
+    track_queries,
+)
+
+
+def test_normalise_collapses_in_lists():
+    """Tests that statements only differing in whitespace and list lengths compare equal."""
+    assert normalise("SELECT *\n  FROM rooms WHERE id IN (?, ?, ?)") == normalise(
+        "SELECT * FROM rooms WHERE id IN (?)",
+    )
+
+
+def test_slow_queries_are_logged_with_their_plan(caplog):
+    """Tests that a statement over the threshold is logged with its parameters and query plan."""
+    engine = create_engine("sqlite://")
+    QueryMonitor(slow_threshold=1e-9).instrument(engine)
+
+    with caplog.at_level(logging.WARNING, "eguivalet_server.query_monitor"), engine.connect() as connection:
+        connection.execute(text("CREATE TABLE things (id INTEGER PRIMARY KEY)"))
+        connection.execute(text("SELECT * FROM things WHERE id = :id"), {"id": 42})
+
+    select = next(record.message for record in caplog.records if "FROM things" in record.message)
+    assert select.startswith("Slow query"), select
+    assert "(42,)" in select, select
+    assert "SEARCH things USING INTEGER PRIMARY KEY" in select, select
+    assert "tests/test_query_monitor.py" in select, select
+
+
+def test_repeated_statements_are_reported_once(caplog):
+    """Tests that lazy loading a relationship for every room in a list is reported."""
+    engine = create_engine("sqlite://")
+    models.Base.metadata.create_all(bind=engine)
+    QueryMonitor(repeated_threshold=2).instrument(engine)
+
+    room_count = 3
+    with Session(engine) as db:
+        for number in range(room_count):
+            crud.create_room(db, schemas.Room(name=f"Room {number}"))
+
+        with caplog.at_level(logging.WARNING, "eguivalet_server.query_monitor"), track_queries("test") as queries:
+            for room in db.query(models.Room).all():
+                _ = room.messages
+
+    warnings = [record.message for record in caplog.records if "ran the same statement" in record.message]
+    assert len(warnings) == 1, warnings
+    assert "FROM messages" in warnings[0], warnings
+    assert "test_query_monitor.py" in warnings[0], warnings
+    assert max(queries.counts.values()) == room_count
+
+
+def test_strict_mode_fails_the_request(client, db_session, monkeypatch):
+    """Tests that in strict mode, a request running a statement too often fails."""
+    room = crud.create_room(db_session, schemas.Room(name="Strict"))
+    monkeypatch.setattr(query_monitor, "repeated_threshold", 0)
+
+    with pytest.raises(RepeatedQueryError):
+        client.get(f"{ROOM_ROOT}/{room.id}")
+
+    monkeypatch.undo()
+    response = client.get(f"{ROOM_ROOT}/{room.id}")
+    assert response.status_code == status.HTTP_200_OK, response.text
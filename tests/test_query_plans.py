@@ -0,0 +1,150 @@
+"""Regression tests making sure the hot CRUD queries are served by indexes."""
+
+# pylint: disable=W0621
+
+import re
+import uuid
+from collections.abc import Callable
+from functools import partial
+
+import pytest
+from pydantic import SecretStr
+from sqlalchemy import event
+
+from eguivalet_server import crud, schemas
+from eguivalet_server.utility import MessageCursor
+
+FULL_SCAN = re.compile(r"^SCAN (TABLE )?\w+$")
+TEMP_SORT = re.compile(r"USE TEMP B-TREE FOR ORDER BY")
+
+QueryPlans = Callable[[Callable[[], object]], list[tuple[str, list[str]]]]
+
+
+@pytest.fixture
+def query_plans(db_session) -> QueryPlans:
+    """
+    Capture the query plans of the statements a CRUD call executes.
+
+    Returns:
+        A function that runs the given callable and returns each statement
+        it executed, along with the details of its query plan.
+
+    """
+    connection = db_session.connection()
+    statements: list[tuple[str, object]] = []
+
+    def capture(_conn, _cursor, statement, parameters, _context, _executemany) -> None:
+        if statement.lstrip().upper().startswith(("SELECT", "UPDATE", "DELETE")):
+            statements.append((statement, parameters))
+
+    def plans(func: Callable[[], object]) -> list[tuple[str, list[str]]]:
+        statements.clear()
+        event.listen(connection, "before_cursor_execute", capture)
+        try:
+            func()
+        finally:
+            event.remove(connection, "before_cursor_execute", capture)
+
+        return [
+            (
+                statement,
+                [row[-1] for row in connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters)],
+            )
+            for statement, parameters in list(statements)
+        ]
+
+    return plans
+
+
+def assert_indexed(plans: list[tuple[str, list[str]]]) -> None:
+    """Fail if any of the captured statements scans a whole table or sorts in memory."""
+    assert plans, "No statements were captured"
+    for statement, details in plans:
+        for detail in details:
+            assert not FULL_SCAN.match(detail), (statement, details)
+            assert not TEMP_SORT.search(detail), (statement, details)
+
+
+def test_read_public_rooms_plan(db_session, query_plans, public_rooms):
+    """Tests that listing public rooms only reads the public rooms."""
+    assert_indexed(query_plans(lambda: crud.read_public_rooms(db_session)))
+
+
+def test_read_room_plan(db_session, query_plans, public_rooms):
+    """Tests that fetching a room uses its primary key."""
+    assert_indexed(query_plans(lambda: crud.read_room(db_session, public_rooms[0])))
+
+
+def test_delete_room_plan(db_session, query_plans, public_rooms, test_users):
+    """Tests that deleting a room uses its primary key."""
+    assert_indexed(query_plans(lambda: crud.delete_room(db_session, public_rooms[0], test_users[0])))
+
+
+def test_membership_plans(db_session, query_plans, private_rooms, test_users):
+    """Tests that membership lists are ordered index range scans, and membership checks index lookups."""
+    room, user = private_rooms[0], test_users[0]
+    assert_indexed(query_plans(lambda: crud.read_user_rooms(db_session, user, after=room, limit=10)))
+    assert_indexed(query_plans(lambda: crud.read_room_members(db_session, room, after=user, limit=10)))
+    assert_indexed(query_plans(lambda: crud.can_post(db_session, room, user)))
+    assert_indexed(query_plans(lambda: crud.can_read(db_session, room, test_users[1])))
+    assert_indexed(query_plans(lambda: crud.read_members_among(db_session, room, test_users)))
+
+
+def test_read_user_plans(db_session, query_plans, test_users):
+    """Tests that user lookups use the primary key and the email index."""
+    assert_indexed(query_plans(lambda: crud.read_user(db_session, test_users[0])))
+    assert_indexed(query_plans(lambda: crud.read_user_by_email(db_session, "test.user0@jmail.com")))
+
+
+def test_update_and_delete_user_plans(db_session, query_plans, test_users):
+    """Tests that modifying a user uses the primary key."""
+    user = schemas.User(id=test_users[0], username="Renamed", email="test.user0@jmail.com")
+    assert_indexed(query_plans(lambda: crud.update_user(db_session, user)))
+    assert_indexed(query_plans(lambda: crud.delete_user(db_session, test_users[0])))
+
+
+def test_purge_deletion_plans(db_session, query_plans, public_rooms, room_messages, test_users):
+    """Tests that every batch of a purge, and finding the jobs left to do, use indexes."""
+    crud.add_member(db_session, public_rooms[0], test_users[0])
+    crud.add_member(db_session, public_rooms[1], test_users[1])
+    assert_indexed(query_plans(lambda: crud.read_pending_deletions(db_session)))
+    for job in (
+        crud.delete_user(db_session, test_users[1]),
+        crud.delete_room(db_session, public_rooms[0], test_users[0]),
+    ):
+        # Messages, memberships, then the user or room itself
+        for _ in range(3):
+            assert_indexed(query_plans(partial(crud.purge_deletion_batch, db_session, job.id)))
+    assert_indexed(query_plans(lambda: crud.delete_room(db_session, public_rooms[0], test_users[0])))
+
+
+def test_read_message_plan(db_session, query_plans, public_rooms, room_messages):
+    """Tests that fetching a message uses its primary key."""
+    assert_indexed(query_plans(lambda: crud.read_message(db_session, public_rooms[0], room_messages[0])))
+
+
+@pytest.mark.parametrize("direction", [None, "before", "after"])
+def test_read_messages_plan(db_session, query_plans, public_rooms, room_messages, direction):
+    """Tests that every kind of message page is an ordered index range scan."""
+    message = crud.read_message(db_session, public_rooms[0], room_messages[5])
+    cursors = {direction: MessageCursor(message.creation_time, message.id)} if direction else {}
+
+    assert_indexed(query_plans(lambda: crud.read_messages(db_session, public_rooms[0], limit=3, **cursors)))
+
+
+def test_update_and_delete_message_plans(db_session, query_plans, public_rooms, room_messages, test_users):
+    """Tests that modifying a message uses its primary key."""
+    message = schemas.Message(id=room_messages[0], user_id=test_users[0], message="Edited")
+    assert_indexed(query_plans(lambda: crud.update_message(db_session, message, public_rooms[0])))
+    assert_indexed(query_plans(lambda: crud.delete_message(db_session, public_rooms[0], room_messages[0])))
+
+
+def test_create_user_plan(db_session, query_plans):
+    """Tests that creating a user does not scan anything when reloading it."""
+    user = schemas.UserCreate(
+        id=uuid.uuid4(),
+        username="Finn McCool",
+        email="finn.mccool@jmail.com",
+        password=SecretStr("Tr0ub4dor&3"),
+    )
+    assert_indexed(query_plans(lambda: crud.create_user(db_session, user, "scrypt$...")))
@@ -1,18 +1,40 @@
 """Unit tests for chatrooms."""
 
+import time
 import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 
+import anyio
 import pytest
-from fastapi import status
+from fastapi import WebSocketDisconnect, status
 from pydantic import ValidationError
+from sqlalchemy import update
 
+from eguivalet_server import crud, models
+from eguivalet_server.broadcast import room_broadcaster
 from eguivalet_server.config import (
+    MAX_MESSAGE_BATCH_SIZE,
     MAX_MESSAGE_LENGTH,
     MIN_MESSAGE_LENGTH,
+    NEXT_CURSOR_HEADER,
+    NEXT_OFFSET_HEADER,
+    ROOM_SUBSCRIBER_QUEUE_SIZE,
+    AccessLevel,
+    RoomEventType,
 )
 from eguivalet_server.config import (
     ROOM_ROOT as ROOT,
 )
+from eguivalet_server.routes.api.v1 import rooms
+from eguivalet_server.schemas import Message
+from eguivalet_server.utility import encode_cursor
+
+
+def wait_for_subscriber(room_id: uuid.UUID) -> None:
+    """Wait until a request being handled in another thread has subscribed to a room."""
+    while not room_broadcaster.subscriber_count(room_id):
+        time.sleep(0.01)
 
 
 def test_get_public_rooms(client, public_rooms):  # pylint: disable=W0613
@@ -79,11 +101,15 @@ def test_get_room_by_id_public(client, public_rooms):
     assert response.status_code == status.HTTP_200_OK, response.text
 
 
-def test_get_room_by_id_private(client, private_rooms):
-    """Tests fetching a private room."""
+def test_get_room_by_id_private(client, private_rooms, test_users, token_headers):
+    """Tests that a private room can only be fetched by its members, and seems not to exist to others."""
     response = client.get(f"{ROOT}/{private_rooms[0]}")
     assert response.status_code == status.HTTP_200_OK, response.text
 
+    response = client.get(f"{ROOT}/{private_rooms[0]}", headers=token_headers(test_users[1]))
+    assert response.status_code == status.HTTP_404_NOT_FOUND, response.text
+    assert response.json()["detail"] == "Room not found"
+
 
 def test_get_room_by_id_nonexistent(client):
     """Tests fetching a room that does not exist."""
@@ -129,29 +155,64 @@ def test_post_message_by_id_message_too_long(client, public_rooms, test_users):
     assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY, response.text
 
 
-def test_delete_room_by_id_public(client, public_rooms):
+def test_delete_room_by_id_public(client, test_users, token_headers):
     """Tests deleting a public room."""
-    # NOTE: We need to check admin permissions first
+    response = client.post(f"{ROOT}/", json={"name": "Owned", "public": True, "owner": str(test_users[0])})
+    assert response.status_code == status.HTTP_200_OK, response.text
+    room_id = response.json()["id"]
 
-    response = client.delete(f"{ROOT}/{public_rooms[0]}")
-    assert response.status_code == status.HTTP_204_NO_CONTENT, response.text
+    response = client.delete(f"{ROOT}/{room_id}")
+    assert response.status_code == status.HTTP_202_ACCEPTED, response.text
+    job = response.json()
+    assert (job["kind"], job["target_id"], job["status"]) == ("room", room_id, "pending"), job
 
-    response = client.get(f"{ROOT}/{public_rooms[0]}")
+    # Only the user who deleted the room is shown the job
+    location = response.headers["Location"]
+    assert client.get(location).status_code == status.HTTP_200_OK
+    response = client.get(location, headers=token_headers(test_users[1]))
+    assert response.status_code == status.HTTP_404_NOT_FOUND, response.text
+
+    response = client.get(f"{ROOT}/{room_id}")
     assert response.status_code == status.HTTP_404_NOT_FOUND, response.text
 
+    # Deleting again points at the same job; the ID stays taken until the room has been purged
+    response = client.delete(f"{ROOT}/{room_id}")
+    assert response.status_code == status.HTTP_202_ACCEPTED, response.text
+    assert response.json()["id"] == job["id"]
+    response = client.post(f"{ROOT}/", json={"id": room_id, "name": "Reborn"})
+    assert response.status_code == status.HTTP_400_BAD_REQUEST, response.text
+
 
 def test_delete_room_by_id_private(client, private_rooms):
     """Tests deleting private rooms."""
-    # NOTE: We need to check the room owner matches the
-    # currently logged in user, or an administrator
-
     response = client.delete(f"{ROOT}/{private_rooms[0]}")
-    assert response.status_code == status.HTTP_204_NO_CONTENT, response.text
+    assert response.status_code == status.HTTP_202_ACCEPTED, response.text
 
     response = client.get(f"{ROOT}/{private_rooms[0]}")
     assert response.status_code == status.HTTP_404_NOT_FOUND, response.text
 
 
+def test_delete_room_by_id_not_owner(client, db_session, public_rooms, private_rooms, test_users, token_headers):
+    """Tests that only the owner of a room, or an administrator, may delete it."""
+    for room in (private_rooms[1], public_rooms[0]):
+        response = client.delete(f"{ROOT}/{room}")
+        assert response.status_code == status.HTTP_403_FORBIDDEN, response.text
+    response = client.get(f"{ROOT}/{private_rooms[1]}", headers=token_headers(test_users[1]))
+    assert response.status_code == status.HTTP_200_OK, response.text
+
+    administrator = update(models.User).values(global_access_level=AccessLevel.ADMINISTRATOR)
+    db_session.execute(administrator.where(models.User.id == test_users[0]))
+    crud.access_level_cache.invalidate(test_users[0])
+    response = client.delete(f"{ROOT}/{public_rooms[0]}")
+    assert response.status_code == status.HTTP_202_ACCEPTED, response.text
+
+
+def test_delete_room_by_id_nonexistent(client):
+    """Tests that deleting a room that never existed fails."""
+    response = client.delete(f"{ROOT}/{uuid.uuid4()}")
+    assert response.status_code == status.HTTP_404_NOT_FOUND, response.text
+
+
 def test_get_messages_empty(client, public_rooms):
     """Tests fetching all messages from a public room."""
     response = client.get(f"{ROOT}/{public_rooms[0]}/messages")
@@ -159,7 +220,7 @@ def test_get_messages_empty(client, public_rooms):
     assert len(response.json()) == 0
 
 
-def test_get_messages(client, public_rooms, test_users):
+def test_get_messages(client, public_rooms, test_users, token_headers):
     """Tests fetching all messages from a public room."""
     messages = [
         "Hasta la vista.",
@@ -172,7 +233,7 @@ def test_get_messages(client, public_rooms, test_users):
             "user_id": str(user),
             "message": message,
         }
-        response = client.post(f"{ROOT}/{public_rooms[0]}", json=data)
+        response = client.post(f"{ROOT}/{public_rooms[0]}", json=data, headers=token_headers(user))
         assert response.status_code == status.HTTP_200_OK, response.text
         assert response.json()["message"] == message
 
@@ -262,3 +323,484 @@ def test_delete_message_by_id(client, public_rooms, test_users):
 
     response = client.get(f"{ROOT}/{public_rooms[0]}/messages/{message_id}")
     assert response.status_code == status.HTTP_404_NOT_FOUND, response.text
+
+
+def test_room_events_websocket(client, public_rooms, test_users):
+    """Tests that message events are pushed to WebSocket subscribers."""
+    message_id = str(uuid.uuid4())
+
+    data = {
+        "id": message_id,
+        "user_id": str(test_users[0]),
+        "message": "Veni, vidi, vici.",
+    }
+
+    token = client.headers["Authorization"].removeprefix("Bearer ")
+    with client.websocket_connect(f"{ROOT}/{public_rooms[0]}/ws", params={"access_token": token}) as websocket:
+        response = client.post(f"{ROOT}/{public_rooms[0]}", json=data)
+        assert response.status_code == status.HTTP_200_OK, response.text
+        event = websocket.receive_json()
+        assert event["event"] == "message_created", event
+        assert event["message"]["message"] == "Veni, vidi, vici.", event
+
+        data["message"] = "Veni, vidi, vixi."
+        response = client.put(f"{ROOT}/{public_rooms[0]}/messages/{message_id}", json=data)
+        assert response.status_code == status.HTTP_200_OK, response.text
+        event = websocket.receive_json()
+        assert event["event"] == "message_edited", event
+        assert event["message"]["message"] == "Veni, vidi, vixi.", event
+
+        response = client.delete(f"{ROOT}/{public_rooms[0]}/messages/{message_id}")
+        assert response.status_code == status.HTTP_204_NO_CONTENT, response.text
+        event = websocket.receive_json()
+        assert event["event"] == "message_deleted", event
+        assert event["message_id"] == message_id, event
+        assert event["message"] is None, event
+
+
+def test_room_events_websocket_nonexistent(client):
+    """Tests subscribing to the events of a room that does not exist."""
+    token = client.headers["Authorization"].removeprefix("Bearer ")
+    with (
+        pytest.raises(WebSocketDisconnect) as disconnect,
+        client.websocket_connect(f"{ROOT}/{uuid.uuid4()}/ws", params={"access_token": token}),
+    ):
+        pass
+    assert disconnect.value.reason == "Room not found", disconnect.value
+
+
+def test_room_events_websocket_unauthenticated(client, public_rooms):
+    """Tests that subscribing needs an access token."""
+    with pytest.raises(WebSocketDisconnect) as disconnect, client.websocket_connect(f"{ROOT}/{public_rooms[0]}/ws"):
+        pass
+    assert disconnect.value.reason == "Not authenticated", disconnect.value
+
+
+def test_get_messages_paged(client, public_rooms, room_messages):
+    """Tests paging backwards through a room's messages with cursors."""
+    response = client.get(f"{ROOT}/{public_rooms[0]}/messages", params={"limit": 4})
+    assert response.status_code == status.HTTP_200_OK, response.text
+    assert [message["id"] for message in response.json()] == [str(msg) for msg in room_messages[-4:]]
+
+    cursor = response.headers[NEXT_CURSOR_HEADER]
+    response = client.get(f"{ROOT}/{public_rooms[0]}/messages", params={"limit": 4, "before": cursor})
+    assert response.status_code == status.HTTP_200_OK, response.text
+    assert [message["id"] for message in response.json()] == [str(msg) for msg in room_messages[-8:-4]]
+
+    cursor = response.headers[NEXT_CURSOR_HEADER]
+    response = client.get(f"{ROOT}/{public_rooms[0]}/messages", params={"limit": 4, "before": cursor})
+    assert response.status_code == status.HTTP_200_OK, response.text
+    assert [message["id"] for message in response.json()] == [str(msg) for msg in room_messages[:-8]]
+    assert NEXT_CURSOR_HEADER not in response.headers
+
+
+def test_get_messages_after_cursor(client, public_rooms, room_messages):
+    """Tests fetching the messages newer than a cursor."""
+    response = client.get(f"{ROOT}/{public_rooms[0]}/messages", params={"limit": 1})
+    cursor = response.headers[NEXT_CURSOR_HEADER]
+
+    response = client.get(f"{ROOT}/{public_rooms[0]}/messages", params={"limit": 5, "after": cursor})
+    assert response.status_code == status.HTTP_200_OK, response.text
+    assert response.json() == []
+    assert NEXT_CURSOR_HEADER not in response.headers
+
+
+def test_get_messages_invalid_cursor(client, public_rooms):
+    """Tests error handling for malformed cursors."""
+    response = client.get(f"{ROOT}/{public_rooms[0]}/messages", params={"before": "not-a-cursor"})
+    assert response.status_code == status.HTTP_400_BAD_REQUEST, response.text
+
+
+def test_get_public_rooms_etag(client, public_rooms):
+    """Tests conditional requests for the public room listing."""
+    response = client.get(f"{ROOT}/")
+    assert response.status_code == status.HTTP_200_OK, response.text
+    assert {room["id"] for room in response.json()} == {str(room) for room in public_rooms}
+    etag = response.headers["ETag"]
+
+    response = client.get(f"{ROOT}/", headers={"If-None-Match": etag})
+    assert response.status_code == status.HTTP_304_NOT_MODIFIED, response.text
+    assert response.headers["ETag"] == etag
+
+    response = client.post(f"{ROOT}/", json={"name": "Yet Another Room", "public": True})
+    assert response.status_code == status.HTTP_200_OK, response.text
+
+    response = client.get(f"{ROOT}/", headers={"If-None-Match": etag})
+    assert response.status_code == status.HTTP_200_OK, response.text
+    assert response.headers["ETag"] != etag
+    assert len(response.json()) == len(public_rooms) + 1
+
+
+def test_post_message_batch(client, public_rooms, test_users):
+    """Tests sending several messages to a public room at once."""
+    existing_id = str(uuid.uuid4())
+    response = client.post(
+        f"{ROOT}/{public_rooms[0]}",
+        json={"id": existing_id, "user_id": str(test_users[0]), "message": "First!"},
+    )
+    assert response.status_code == status.HTTP_200_OK, response.text
+
+    new_id = str(uuid.uuid4())
+    batch = {
+        "messages": [
+            {"user_id": str(test_users[0]), "message": "Second."},
+            {"id": existing_id, "user_id": str(test_users[0]), "message": "First again?"},
+            {"id": new_id, "user_id": str(test_users[0]), "message": "Third."},
+            {"id": new_id, "user_id": str(test_users[0]), "message": "Third, twice."},
+            {"user_id": str(test_users[1]), "message": "Someone else's."},
+        ],
+    }
+
+    response = client.post(f"{ROOT}/{public_rooms[0]}/messages:batch", json=batch)
+    assert response.status_code == status.HTTP_200_OK, response.text
+    assert [result["created"] for result in response.json()] == [True, False, True, False, False]
+    assert response.json()[4]["detail"] == "Not allowed to post as another user", response.json()
+
+    response = client.get(f"{ROOT}/{public_rooms[0]}/messages")
+    assert response.status_code == status.HTTP_200_OK, response.text
+    assert sorted(message["message"] for message in response.json()) == ["First!", "Second.", "Third."]
+
+
+@pytest.mark.parametrize("count", [0, MAX_MESSAGE_BATCH_SIZE + 1])
+def test_post_message_batch_size_limits(client, public_rooms, test_users, count):
+    """Tests that empty and oversized batches are rejected."""
+    batch = {"messages": [{"user_id": str(test_users[0]), "message": "Spam"}] * count}
+
+    response = client.post(f"{ROOT}/{public_rooms[0]}/messages:batch", json=batch)
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY, response.text
+
+
+def test_post_message_private_room_members_only(client, private_rooms, test_users, token_headers):
+    """Tests that only members can post to a private room, its owner being one from the start."""
+    data = {"user_id": str(test_users[1]), "message": "Let me in!"}
+    response = client.post(f"{ROOT}/{private_rooms[0]}", json=data, headers=token_headers(test_users[1]))
+    assert response.status_code == status.HTTP_403_FORBIDDEN, response.text
+    assert response.json()["detail"] == "Not allowed to post in the room", response.text
+
+    data = {"user_id": str(test_users[0]), "message": "Owner here."}
+    response = client.post(f"{ROOT}/{private_rooms[0]}", json=data)
+    assert response.status_code == status.HTTP_200_OK, response.text
+
+    response = client.put(f"{ROOT}/{private_rooms[0]}/members/{test_users[1]}")
+    assert response.status_code == status.HTTP_204_NO_CONTENT, response.text
+
+    data = {"user_id": str(test_users[1]), "message": "Thanks!"}
+    response = client.post(f"{ROOT}/{private_rooms[0]}", json=data, headers=token_headers(test_users[1]))
+    assert response.status_code == status.HTTP_200_OK, response.text
+
+
+def test_post_message_as_another_user(client, public_rooms, test_users):
+    """Tests that messages can only be sent as the logged in user."""
+    data = {"user_id": str(test_users[1]), "message": "It was me, honest."}
+    response = client.post(f"{ROOT}/{public_rooms[0]}", json=data)
+    assert response.status_code == status.HTTP_403_FORBIDDEN, response.text
+    assert response.json()["detail"] == "Not allowed to post as another user", response.text
+
+
+def test_room_routes_need_a_token(client, public_rooms):
+    """Tests that room routes turn away requests without a valid access token."""
+    for headers in ({"Authorization": ""}, {"Authorization": "Bearer not.a.token"}):
+        response = client.get(f"{ROOT}/{public_rooms[0]}", headers=headers)
+        assert response.status_code == status.HTTP_401_UNAUTHORIZED, response.text
+        assert response.headers["WWW-Authenticate"].startswith("Bearer"), response.headers
+
+
+def test_post_message_nonexistent_room(client, test_users):
+    """Tests sending a message to a room that does not exist."""
+    data = {"user_id": str(test_users[0]), "message": "Hello?"}
+    response = client.post(f"{ROOT}/{uuid.uuid4()}", json=data)
+    assert response.status_code == status.HTTP_404_NOT_FOUND, response.text
+
+
+def test_post_message_batch_with_time_zone(client, public_rooms, test_users, room_messages):
+    """Tests that batched messages sent with a time zone are accepted, and read back at once."""
+    response = client.get(f"{ROOT}/{public_rooms[0]}/messages")
+    assert response.status_code == status.HTTP_200_OK, response.text
+
+    message = {"user_id": str(test_users[0]), "message": "Zoned", "creation_time": "2030-01-01T12:00:00Z"}
+    response = client.post(f"{ROOT}/{public_rooms[0]}/messages:batch", json={"messages": [message]})
+    assert response.status_code == status.HTTP_200_OK, response.text
+    assert [result["created"] for result in response.json()] == [True]
+
+    response = client.get(f"{ROOT}/{public_rooms[0]}/messages", params={"limit": 2})
+    assert [message["message"] for message in response.json()] == ["Message #9", "Zoned"], response.text
+
+
+def test_post_message_batch_private_room(client, private_rooms, test_users, token_headers):
+    """Tests that batched messages from non-members of a private room are skipped."""
+    batch = {"messages": [{"user_id": str(test_users[1]), "message": "Let me in!"}]}
+
+    response = client.post(
+        f"{ROOT}/{private_rooms[0]}/messages:batch", json=batch, headers=token_headers(test_users[1]),
+    )
+    assert response.status_code == status.HTTP_200_OK, response.text
+    assert [result["created"] for result in response.json()] == [False]
+    assert response.json()[0]["detail"] == "Not allowed to post in the room"
+
+    batch = {"messages": [{"user_id": str(test_users[0]), "message": "Owner here."}]}
+    response = client.post(f"{ROOT}/{private_rooms[0]}/messages:batch", json=batch)
+    assert response.status_code == status.HTTP_200_OK, response.text
+    assert [result["created"] for result in response.json()] == [True]
+
+
+def test_room_members(client, public_rooms, test_users, token_headers):
+    """Tests joining and leaving a room, and paging through its members."""
+    for user in test_users:
+        response = client.put(f"{ROOT}/{public_rooms[0]}/members/{user}", headers=token_headers(user))
+        assert response.status_code == status.HTTP_204_NO_CONTENT, response.text
+    # Joining twice changes nothing
+    response = client.put(f"{ROOT}/{public_rooms[0]}/members/{test_users[0]}")
+    assert response.status_code == status.HTTP_204_NO_CONTENT, response.text
+
+    response = client.get(f"{ROOT}/{public_rooms[0]}/members", params={"limit": 3})
+    assert response.status_code == status.HTTP_200_OK, response.text
+    first_page = [user["id"] for user in response.json()]
+
+    response = client.get(
+        f"{ROOT}/{public_rooms[0]}/members", params={"limit": 3, "after": response.headers[NEXT_CURSOR_HEADER]},
+    )
+    assert response.status_code == status.HTTP_200_OK, response.text
+    assert NEXT_CURSOR_HEADER not in response.headers
+    assert first_page + [user["id"] for user in response.json()] == sorted(str(user) for user in test_users)
+
+    response = client.delete(f"{ROOT}/{public_rooms[0]}/members/{test_users[0]}")
+    assert response.status_code == status.HTTP_204_NO_CONTENT, response.text
+    response = client.get(f"{ROOT}/{public_rooms[0]}/members")
+    assert str(test_users[0]) not in {user["id"] for user in response.json()}
+
+
+def test_room_members_errors(client, public_rooms, private_rooms, test_users):
+    """Tests joining rooms and users that do not exist, and listing the members of a missing room."""
+    response = client.put(f"{ROOT}/{uuid.uuid4()}/members/{test_users[0]}")
+    assert response.status_code == status.HTTP_404_NOT_FOUND, response.text
+
+    response = client.put(f"{ROOT}/{private_rooms[0]}/members/{uuid.uuid4()}")
+    assert response.status_code == status.HTTP_404_NOT_FOUND, response.text
+
+    response = client.get(f"{ROOT}/{uuid.uuid4()}/members")
+    assert response.status_code == status.HTTP_404_NOT_FOUND, response.text
+
+    response = client.get(f"{ROOT}/{public_rooms[0]}/members", params={"after": "not-a-cursor"})
+    assert response.status_code == status.HTTP_400_BAD_REQUEST, response.text
+
+
+def test_private_room_members_by_invitation(client, private_rooms, test_users, token_headers):
+    """Tests that only the owner adds members to a private room, and nobody else removes the owner."""
+    intruder = token_headers(test_users[1])
+    response = client.put(f"{ROOT}/{private_rooms[0]}/members/{test_users[1]}", headers=intruder)
+    assert response.status_code == status.HTTP_403_FORBIDDEN, response.text
+    data = {"user_id": str(test_users[1]), "message": "Let me in!"}
+    response = client.post(f"{ROOT}/{private_rooms[0]}", json=data, headers=intruder)
+    assert response.status_code == status.HTTP_403_FORBIDDEN, response.text
+
+    response = client.put(f"{ROOT}/{private_rooms[0]}/members/{test_users[1]}")
+    assert response.status_code == status.HTTP_204_NO_CONTENT, response.text
+    response = client.put(f"{ROOT}/{private_rooms[0]}/members/{test_users[2]}", headers=intruder)
+    assert response.status_code == status.HTTP_403_FORBIDDEN, response.text
+    response = client.delete(f"{ROOT}/{private_rooms[0]}/members/{test_users[0]}", headers=intruder)
+    assert response.status_code == status.HTTP_403_FORBIDDEN, response.text
+
+    # Members may leave by themselves
+    response = client.delete(f"{ROOT}/{private_rooms[0]}/members/{test_users[1]}", headers=intruder)
+    assert response.status_code == status.HTTP_204_NO_CONTENT, response.text
+
+
+def test_public_room_members_join_themselves(client, public_rooms, test_users, token_headers):
+    """Tests that users join and leave public rooms by themselves, and not others."""
+    response = client.put(f"{ROOT}/{public_rooms[0]}/members/{test_users[1]}")
+    assert response.status_code == status.HTTP_403_FORBIDDEN, response.text
+
+    response = client.put(f"{ROOT}/{public_rooms[0]}/members/{test_users[1]}", headers=token_headers(test_users[1]))
+    assert response.status_code == status.HTTP_204_NO_CONTENT, response.text
+    response = client.delete(f"{ROOT}/{public_rooms[0]}/members/{test_users[1]}")
+    assert response.status_code == status.HTTP_403_FORBIDDEN, response.text
+
+
+def test_change_message_of_another_user(client, public_rooms, test_users, token_headers):
+    """Tests that messages can only be edited and deleted by their sender, and not handed to someone else."""
+    message_id = str(uuid.uuid4())
+    data = {"id": message_id, "user_id": str(test_users[0]), "message": "Mine."}
+    response = client.post(f"{ROOT}/{public_rooms[0]}", json=data)
+    assert response.status_code == status.HTTP_200_OK, response.text
+
+    other = token_headers(test_users[1])
+    forged = {**data, "user_id": str(test_users[1]), "message": "Mine now."}
+    for edit, headers in ((data, other), (forged, other), (forged, None)):
+        response = client.put(f"{ROOT}/{public_rooms[0]}/messages/{message_id}", json=edit, headers=headers)
+        assert response.status_code == status.HTTP_403_FORBIDDEN, response.text
+    response = client.delete(f"{ROOT}/{public_rooms[0]}/messages/{message_id}", headers=other)
+    assert response.status_code == status.HTTP_403_FORBIDDEN, response.text
+
+    response = client.put(f"{ROOT}/{public_rooms[0]}/messages/{uuid.uuid4()}", json=data)
+    assert response.status_code == status.HTTP_400_BAD_REQUEST, response.text
+    response = client.get(f"{ROOT}/{public_rooms[0]}/messages/{message_id}")
+    assert response.json()["message"] == "Mine.", response.text
+
+
+def test_private_room_readers(client, private_rooms, test_users, token_headers):
+    """Tests that the messages, members and events of a private room are for its members only."""
+    message_id = str(uuid.uuid4())
+    data = {"id": message_id, "user_id": str(test_users[0]), "message": "Secret plans"}
+    response = client.post(f"{ROOT}/{private_rooms[0]}", json=data)
+    assert response.status_code == status.HTTP_200_OK, response.text
+
+    intruder = token_headers(test_users[1])
+    for path, params in (
+        ("messages", {}),
+        ("messages/search", {"q": "plans"}),
+        (f"messages/{message_id}", {}),
+        ("members", {}),
+        ("events", {}),
+    ):
+        response = client.get(f"{ROOT}/{private_rooms[0]}/{path}", params=params, headers=intruder)
+        assert response.status_code == status.HTTP_403_FORBIDDEN, (path, response.text)
+
+    token = intruder["Authorization"].removeprefix("Bearer ")
+    with (
+        pytest.raises(WebSocketDisconnect) as disconnect,
+        client.websocket_connect(f"{ROOT}/{private_rooms[0]}/ws", params={"access_token": token}),
+    ):
+        pass
+    assert disconnect.value.reason == "Not allowed to read the room", disconnect.value
+
+    response = client.get(f"{ROOT}/{private_rooms[0]}/messages/search", params={"q": "plans"})
+    assert [message["id"] for message in response.json()] == [message_id]
+
+
+def test_search_messages(client, public_rooms, test_users):
+    """Tests finding messages by their words, a page at a time, in one room only."""
+    texts = ["The cat sat on the mat", "A dog barked", "Cats and dogs", "Where is the cat?", "cat"]
+    for room_id in public_rooms[:2]:
+        batch = {"messages": [{"user_id": str(test_users[0]), "message": text} for text in texts]}
+        response = client.post(f"{ROOT}/{room_id}/messages:batch", json=batch)
+        assert response.status_code == status.HTTP_200_OK, response.text
+
+    response = client.get(f"{ROOT}/{public_rooms[0]}/messages/search", params={"q": "CAT", "limit": 2})
+    assert response.status_code == status.HTTP_200_OK, response.text
+    first_page = response.json()
+    assert response.headers[NEXT_OFFSET_HEADER] == "2"
+
+    response = client.get(
+        f"{ROOT}/{public_rooms[0]}/messages/search",
+        params={"q": "CAT", "limit": 2, "offset": response.headers[NEXT_OFFSET_HEADER]},
+    )
+    assert response.status_code == status.HTTP_200_OK, response.text
+    assert NEXT_OFFSET_HEADER not in response.headers
+    # The same messages were sent to the second room, and are not found twice
+    results = first_page + response.json()
+    assert sorted(message["message"] for message in results) == ["The cat sat on the mat", "Where is the cat?", "cat"]
+
+    response = client.get(f"{ROOT}/{public_rooms[0]}/messages/search", params={"q": "cat mat"})
+    assert [message["message"] for message in response.json()] == ["The cat sat on the mat"]
+
+
+def test_search_messages_errors(client, public_rooms):
+    """Tests that a search needs words, and finds nothing in a room that does not exist."""
+    response = client.get(f"{ROOT}/{public_rooms[0]}/messages/search", params={"q": ""})
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY, response.text
+
+    response = client.get(f"{ROOT}/{uuid.uuid4()}/messages/search", params={"q": "cat"})
+    assert response.status_code == status.HTTP_200_OK, response.text
+    assert response.json() == []
+
+
+def test_get_messages_long_poll(client, public_rooms, test_users):
+    """Tests that a long poll is answered as soon as a newer message arrives."""
+    first = {"id": str(uuid.uuid4()), "user_id": str(test_users[0]), "message": "Anyone?"}
+    response = client.post(f"{ROOT}/{public_rooms[0]}", json=first)
+    assert response.status_code == status.HTTP_200_OK, response.text
+    cursor = encode_cursor(datetime.fromisoformat(response.json()["creation_time"]), uuid.UUID(first["id"]))
+
+    with ThreadPoolExecutor(1) as executor:
+        poll = executor.submit(
+            client.get, f"{ROOT}/{public_rooms[0]}/messages", params={"after": cursor, "wait": 10},
+        )
+        wait_for_subscriber(public_rooms[0])
+        second = {"id": str(uuid.uuid4()), "user_id": str(test_users[0]), "message": "Yes!"}
+        response = client.post(f"{ROOT}/{public_rooms[0]}", json=second)
+        assert response.status_code == status.HTTP_200_OK, response.text
+        response = poll.result(timeout=10)
+
+    assert response.status_code == status.HTTP_200_OK, response.text
+    assert [message["id"] for message in response.json()] == [second["id"]]
+    assert NEXT_CURSOR_HEADER in response.headers
+
+
+def test_get_messages_long_poll_timeout(client, public_rooms):
+    """Tests that a long poll with nothing new to return gives up after the wait."""
+    cursor = encode_cursor(datetime(2100, 1, 1), uuid.uuid4())  # ruff:ignore[call-datetime-without-tzinfo]
+    wait = 0.2
+    started = time.monotonic()
+    response = client.get(f"{ROOT}/{public_rooms[0]}/messages", params={"after": cursor, "wait": wait})
+    assert response.status_code == status.HTTP_200_OK, response.text
+    assert time.monotonic() - started >= wait
+    assert response.json() == []
+    assert NEXT_CURSOR_HEADER not in response.headers
+
+    response = client.get(f"{ROOT}/{public_rooms[0]}/messages", params={"after": cursor, "wait": 3600})
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY, response.text
+
+
+def test_room_events_stream(db_session, public_rooms, test_users, monkeypatch):
+    """Tests that the event stream keeps idle connections open, and gives new messages an ID."""
+    monkeypatch.setattr(rooms, "EVENT_STREAM_KEEPALIVE_INTERVAL", 0.01)
+    message = Message(user_id=test_users[0], message="Is this thing on?")
+    created = rooms.message_event(RoomEventType.MESSAGE_CREATED, public_rooms[0], message.id, message)
+    deleted = rooms.message_event(RoomEventType.MESSAGE_DELETED, public_rooms[0], message.id)
+
+    async def stream() -> list[str]:
+        with room_broadcaster.subscribe(public_rooms[0]) as subscription:
+            events = rooms.stream_room_events(db_session, subscription)
+            frames = [await anext(events)]
+            room_broadcaster.publish(public_rooms[0], created.model_dump_json())
+            room_broadcaster.publish(public_rooms[0], deleted.model_dump_json())
+            frames += [await anext(events), await anext(events)]
+            await events.aclose()
+            return frames
+
+    keepalive, created_frame, deleted_frame = anyio.run(stream)
+    assert keepalive.startswith(":"), keepalive
+    assert created_frame.startswith(f"id: {created.cursor}\nevent: message_created\ndata: {{"), created_frame
+    assert deleted_frame.startswith("event: message_deleted\ndata: {"), deleted_frame
+    assert all(frame.endswith("\n\n") for frame in (keepalive, created_frame, deleted_frame))
+
+
+def test_room_events_stream_catches_up(client, public_rooms, test_users):
+    """Tests that a reconnecting event stream first sends the messages after the last one it saw."""
+    messages = [
+        {"id": str(uuid.uuid4()), "user_id": str(test_users[0]), "message": text, "creation_time": creation_time}
+        for text, creation_time in (("Seen", "2026-01-01T00:00:00"), ("Missed", "2026-01-01T00:01:00"))
+    ]
+    for message in messages:
+        response = client.post(f"{ROOT}/{public_rooms[0]}", json=message)
+        assert response.status_code == status.HTTP_200_OK, response.text
+    last_event_id = encode_cursor(datetime.fromisoformat(messages[0]["creation_time"]), uuid.UUID(messages[0]["id"]))
+
+    def overflow() -> None:
+        for _ in range(ROOM_SUBSCRIBER_QUEUE_SIZE + 1):
+            room_broadcaster.publish(public_rooms[0], "{}")
+
+    with ThreadPoolExecutor(1) as executor:
+        stream = executor.submit(
+            client.get, f"{ROOT}/{public_rooms[0]}/events", headers={"Last-Event-ID": last_event_id},
+        )
+        wait_for_subscriber(public_rooms[0])
+        # Falling behind is the only way the stream ends on its own
+        client.portal.call(overflow)
+        response = stream.result(timeout=10)
+
+    assert response.status_code == status.HTTP_200_OK, response.text
+    assert response.headers["Content-Type"].startswith("text/event-stream"), response.headers
+    frames = response.text.split("\n\n")
+    assert frames[0].startswith("id: "), frames
+    assert f'"message_id":"{messages[1]["id"]}"' in frames[0], frames
+    assert frames[1:] == [""], frames
+
+
+def test_room_events_stream_errors(client, public_rooms):
+    """Tests streaming the events of a room that does not exist, or from a malformed cursor."""
+    response = client.get(f"{ROOT}/{uuid.uuid4()}/events")
+    assert response.status_code == status.HTTP_404_NOT_FOUND, response.text
+
+    response = client.get(f"{ROOT}/{public_rooms[0]}/events", headers={"Last-Event-ID": "not-a-cursor"})
+    assert response.status_code == status.HTTP_400_BAD_REQUEST, response.text
@@ -0,0 +1,54 @@
+"""Unit tests for password hashing."""
+
+import anyio
+
+from eguivalet_server.config import PASSWORD_HASH_N
+from eguivalet_server.security import (
+    hash_password,
+    hash_password_async,
+    needs_rehash,
+    verify_password,
+    verify_password_async,
+)
+
+# Cheap enough to keep the tests fast
+TEST_COST = {"n": 2**4, "r": 8, "p": 1}
+
+
+def test_hash_and_verify():
+    """Tests that a password verifies against its own hash, and a wrong one does not."""
+    password_hash = hash_password("Tr0ub4dor&3", **TEST_COST)
+    assert password_hash.startswith("scrypt$16$8$1$"), password_hash
+    assert verify_password("Tr0ub4dor&3", password_hash)
+    assert not verify_password("tr0ub4dor&3", password_hash)
+
+
+def test_hashes_are_salted():
+    """Tests that hashing the same password twice gives different hashes."""
+    assert hash_password("hunter22", **TEST_COST) != hash_password("hunter22", **TEST_COST)
+
+
+def test_unrecognised_hashes_do_not_verify():
+    """Tests that hashes in another format are rejected rather than raising."""
+    for password_hash in ("", "x" * 64, "bcrypt$16$8$1$c2FsdA$a2V5", "scrypt$sixteen$8$1$c2FsdA$a2V5"):
+        assert not verify_password("hunter22", password_hash), password_hash
+
+
+def test_needs_rehash():
+    """Tests that only hashes made at another cost need hashing again."""
+    assert needs_rehash(hash_password("hunter22", **TEST_COST))
+    assert not needs_rehash(f"scrypt${PASSWORD_HASH_N}$8$1$c2FsdA$a2V5")
+
+
+def test_async_round_trip():
+    """Tests hashing and verifying in the password hashing threads, with and without a user."""
+
+    async def round_trip() -> tuple[bool, bool, bool]:
+        password_hash = await hash_password_async("hunter22")
+        return (
+            await verify_password_async("hunter22", password_hash),
+            await verify_password_async("hunter23", password_hash),
+            await verify_password_async("hunter22", None),
+        )
+
+    assert anyio.run(round_trip) == (True, False, False)
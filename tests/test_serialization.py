@@ -0,0 +1,34 @@
+"""Unit tests for encoding database rows as JSON."""
+
+import json
+
+from eguivalet_server import crud, schemas, serialization
+from eguivalet_server.serialization import RowsResponse, encode_rows
+
+
+def test_encode_rows_matches_schema(db_session, public_rooms, room_messages):
+    """Tests that encoded rows look the same as the validated and dumped models."""
+    rows = crud.read_message_rows(db_session, public_rooms[0])
+    expected = [
+        schemas.Message.model_validate(db_message, from_attributes=True).model_dump(mode="json")
+        for db_message in crud.read_messages(db_session, public_rooms[0])
+    ]
+    assert len(expected) == len(room_messages)
+    assert json.loads(encode_rows(rows)) == expected
+
+
+def test_encode_rows_without_orjson(db_session, public_rooms, room_messages, monkeypatch):
+    """Tests that Pydantic encodes the rows the same way when orjson is not installed."""
+    rows = crud.read_message_rows(db_session, public_rooms[0], limit=3)
+    encoded = encode_rows(rows)
+
+    monkeypatch.setattr(serialization, "orjson", None)
+    assert encode_rows(rows) == encoded
+
+
+def test_rows_response(db_session, public_rooms, room_messages):
+    """Tests that the response is JSON, with the given headers."""
+    response = RowsResponse(crud.read_message_rows(db_session, public_rooms[0], limit=1), headers={"X-Test": "1"})
+    assert response.media_type == "application/json"
+    assert response.headers["X-Test"] == "1"
+    assert [message["id"] for message in json.loads(response.body)] == [str(room_messages[-1])]
@@ -1,9 +1,14 @@
 """Unit tests for user routes."""
 
+import logging
 import uuid
 
 from fastapi import status
 
+from eguivalet_server.config import (
+    NEXT_CURSOR_HEADER,
+    ROOM_ROOT,
+)
 from eguivalet_server.config import (
     USER_ROOT as ROOT,
 )
@@ -41,24 +46,59 @@ def test_post_new_user_id_exists(client, test_users):
 def test_post_login_user(client, test_users):
     """Tests user login."""
     data = {
-        "id": str(test_users[0]),
-        "username": "Lazar Diarmaid",
-        "email": "lazar.diarmaid@fian.na",
+        "email": "test.user0@jmail.com",
+        "password": "CORRECT HORSE BATTERY STAPLE",
     }
 
     response = client.post(f"{ROOT}/login", json=data)
     assert response.status_code == status.HTTP_200_OK, response.text
+    assert response.json()["user_id"] == str(test_users[0]), response.json()
 
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+    response = client.get(f"{ROOT}/{test_users[0]}", headers=headers)
+    assert response.status_code == status.HTTP_200_OK, response.text
 
-def test_post_logout_user(client, test_users):
-    """Tests user logout."""
+
+def test_post_login_user_wrong_credentials(client, test_users, caplog):
+    """Tests that a wrong password and an unknown email address are turned away alike, without logging either."""
+    with caplog.at_level(logging.INFO, "eguivalet_server"):
+        for data in (
+            {"email": "test.user0@jmail.com", "password": "Tr0ub4dor&3"},
+            {"email": "nobody@jmail.com", "password": "CORRECT HORSE BATTERY STAPLE"},
+        ):
+            response = client.post(f"{ROOT}/login", json=data)
+            assert response.status_code == status.HTTP_401_UNAUTHORIZED, response.text
+            assert response.json()["detail"] == "Incorrect email address or password", response.text
+    assert not [record for record in caplog.records if "@jmail.com" in record.getMessage()], caplog.text
+
+
+def test_post_login_new_user(client):
+    """Tests logging in with the password a user signed up with."""
     data = {
-        "id": str(test_users[0]),
-        "username": "Lazar Diarmaid",
-        "email": "lazar.diarmaid@fian.na",
+        "username": "Finn McCool",
+        "email": "finn.mccool@jmail.com",
+        "password": "Tr0ub4dor&3",
     }
+    response = client.post(f"{ROOT}/", json=data)
+    assert response.status_code == status.HTTP_201_CREATED, response.text
+    user_id = response.json()["id"]
+
+    response = client.post(f"{ROOT}/login", json={"email": data["email"], "password": data["password"]})
+    assert response.status_code == status.HTTP_200_OK, response.text
+    assert response.json()["user_id"] == user_id, response.json()
+
+
+def test_post_logout_user(client, test_users):
+    """Tests that logging out revokes the access token, and only that one."""
+    data = {"email": "test.user0@jmail.com", "password": "CORRECT HORSE BATTERY STAPLE"}
+    other_headers = {"Authorization": f"Bearer {client.post(f'{ROOT}/login', json=data).json()['access_token']}"}
+
+    response = client.post(f"{ROOT}/logout")
+    assert response.status_code == status.HTTP_204_NO_CONTENT, response.text
 
-    response = client.post(f"{ROOT}/logout", json=data)
+    response = client.get(f"{ROOT}/{test_users[0]}")
+    assert response.status_code == status.HTTP_401_UNAUTHORIZED, response.text
+    response = client.get(f"{ROOT}/{test_users[0]}", headers=other_headers)
     assert response.status_code == status.HTTP_200_OK, response.text
 
 
@@ -80,7 +120,7 @@ def test_update_user_by_id(client, test_users):
     assert response.status_code == status.HTTP_200_OK, response.text
 
 
-def test_update_user_by_id_nonexistent(client):
+def test_update_user_by_id_nonexistent(client, token_headers):
     """Tests updating user information by ID when the user does not exist."""
     user_id = uuid.uuid4()
 
@@ -90,14 +130,80 @@ def test_update_user_by_id_nonexistent(client):
         "email": "lazar.diarmaid@fian.na",
     }
 
-    response = client.put(f"{ROOT}/{user_id}", json=data)
+    response = client.put(f"{ROOT}/{user_id}", json=data, headers=token_headers(user_id))
     assert response.status_code == status.HTTP_404_NOT_FOUND, response.text
 
 
-def test_delete_user_by_id(client, test_users):
+def test_update_another_user(client, test_users):
+    """Tests that users can only change themselves."""
+    data = {
+        "id": str(test_users[1]),
+        "username": "Lazar Diarmaid",
+        "email": "lazar.diarmaid@fian.na",
+    }
+
+    response = client.put(f"{ROOT}/{test_users[1]}", json=data)
+    assert response.status_code == status.HTTP_403_FORBIDDEN, response.text
+    response = client.put(f"{ROOT}/{test_users[0]}", json=data)
+    assert response.status_code == status.HTTP_403_FORBIDDEN, response.text
+    response = client.delete(f"{ROOT}/{test_users[1]}")
+    assert response.status_code == status.HTTP_403_FORBIDDEN, response.text
+
+
+def test_delete_user_by_id(client, test_users, token_headers):
     """Tests deleting user by ID."""
     response = client.delete(f"{ROOT}/{test_users[0]}")
-    assert response.status_code == status.HTTP_204_NO_CONTENT, response.text
+    assert response.status_code == status.HTTP_202_ACCEPTED, response.text
+    job = response.json()
+    assert (job["kind"], job["target_id"]) == ("user", str(test_users[0])), job
+
+    # The job can be followed, even by a user that no longer exists, but not by others
+    location = response.headers["Location"]
+    response = client.get(location)
+    assert response.status_code == status.HTTP_200_OK, response.text
+    assert response.json()["id"] == job["id"]
+    response = client.get(location, headers=token_headers(test_users[1]))
+    assert response.status_code == status.HTTP_404_NOT_FOUND, response.text
 
     response = client.get(f"{ROOT}/{test_users[0]}")
     assert response.status_code == status.HTTP_404_NOT_FOUND, response.text
+
+
+def test_get_user_rooms(client, public_rooms, private_rooms, test_users):
+    """Tests paging through the rooms a user is a member of."""
+    for room in public_rooms:
+        response = client.put(f"{ROOM_ROOT}/{room}/members/{test_users[0]}")
+        assert response.status_code == status.HTTP_204_NO_CONTENT, response.text
+    expected = sorted(str(room) for room in [*public_rooms, private_rooms[0]])
+
+    rooms: list[str] = []
+    params = {"limit": 4}
+    while True:
+        response = client.get(f"{ROOT}/{test_users[0]}/rooms", params=params)
+        assert response.status_code == status.HTTP_200_OK, response.text
+        rooms.extend(room["id"] for room in response.json())
+        if NEXT_CURSOR_HEADER not in response.headers:
+            break
+        params["after"] = response.headers[NEXT_CURSOR_HEADER]
+
+    assert rooms == expected, rooms
+
+
+def test_get_user_rooms_of_another_user(client, public_rooms, private_rooms, test_users, token_headers):
+    """Tests that the private rooms of a user are only listed to themselves."""
+    member = token_headers(test_users[1])
+    response = client.put(f"{ROOM_ROOT}/{public_rooms[0]}/members/{test_users[1]}", headers=member)
+    assert response.status_code == status.HTTP_204_NO_CONTENT, response.text
+
+    response = client.get(f"{ROOT}/{test_users[1]}/rooms")
+    assert response.status_code == status.HTTP_200_OK, response.text
+    assert [room["id"] for room in response.json()] == [str(public_rooms[0])]
+    response = client.get(f"{ROOT}/{test_users[1]}/rooms", headers=member)
+    assert {room["id"] for room in response.json()} == {str(public_rooms[0]), str(private_rooms[1])}
+
+
+def test_get_user_rooms_none(client):
+    """Tests listing the rooms of a user who has not joined any."""
+    response = client.get(f"{ROOT}/{uuid.uuid4()}/rooms")
+    assert response.status_code == status.HTTP_200_OK, response.text
+    assert response.json() == []
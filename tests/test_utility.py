@@ -0,0 +1,56 @@
+"""Unit tests for miscellaneous utility functions."""
+
+import uuid
+from datetime import datetime
+
+import pytest
+
+from eguivalet_server.utility import (
+    MessageCursor,
+    decode_cursor,
+    decode_id_cursor,
+    encode_cursor,
+    encode_id_cursor,
+    etag_matches,
+)
+
+
+def test_cursor_round_trip():
+    """Tests that cursors decode back to the key they were made from."""
+    creation_time = datetime(2022, 9, 11, 12, 0, 0, 123456)  # ruff:ignore[call-datetime-without-tzinfo]
+    message_id = uuid.uuid4()
+
+    cursor = encode_cursor(creation_time, message_id)
+    assert decode_cursor(cursor) == MessageCursor(creation_time, message_id)
+
+
+@pytest.mark.parametrize("cursor", ["", "not-a-cursor", "bm90fGF8dXVpZA"])
+def test_decode_cursor_malformed(cursor):
+    """Tests that malformed cursors are rejected."""
+    with pytest.raises(ValueError, match=r"."):
+        decode_cursor(cursor)
+
+
+def test_id_cursor_round_trip():
+    """Tests that ID cursors decode back to the ID they were made from, and reject anything else."""
+    item_id = uuid.uuid4()
+    assert decode_id_cursor(encode_id_cursor(item_id)) == item_id
+
+    with pytest.raises(ValueError, match=r"."):
+        decode_id_cursor("not-a-cursor")
+
+
+@pytest.mark.parametrize(
+    ("if_none_match", "expected"),
+    [
+        ('"abc"', True),
+        ('W/"abc"', True),
+        ('"xyz", "abc"', True),
+        ("*", True),
+        ('"xyz"', False),
+        ('"abcd"', False),
+    ],
+)
+def test_etag_matches(if_none_match, expected):
+    """Tests comparing If-None-Match headers against an ETag."""
+    assert etag_matches(if_none_match, '"abc"') is expected